@@ -0,0 +1,99 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+ONTOLOGY_DIR = os.path.join(ROOT_DIR, "ontology")
+
+TARGETS: List[Tuple[str, str]] = [
+    ("dataset.count_tokens", ROOT_DIR),
+    ("dataset.make_topics_order", ROOT_DIR),
+    ("dataset.build_dataset", ROOT_DIR),
+    ("ontology.export_topics_csv", ROOT_DIR),
+    ("ontology_tree", ONTOLOGY_DIR),
+    ("scheduler", ONTOLOGY_DIR),
+]
+
+
+def run_once(module: str, path: str) -> Tuple[float, str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([path, ROOT_DIR, env.get("PYTHONPATH", "")]).rstrip(os.pathsep)
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=path,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+    return elapsed, proc.stderr
+
+
+def heaviest(importtime_log: str, top: int) -> List[Tuple[str, float]]:
+    found: Dict[str, float] = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:") :].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        raw = parts[2]
+        level = (len(raw) - len(raw.lstrip()) - 1) // 2
+        if level == 1:
+            found[raw.strip()] = int(parts[1]) / 1000.0
+    return sorted(found.items(), key=lambda kv: kv[1], reverse=True)[:top]
+
+
+def baseline(repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], capture_output=True)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    interp = baseline(args.repeat)
+    results = []
+    for module, path in TARGETS:
+        try:
+            runs = [run_once(module, path) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            results.append({"module": module, "error": str(e)})
+            continue
+        wall = statistics.median(r[0] for r in runs)
+        results.append({
+            "module": module,
+            "wall_ms": wall * 1000.0,
+            "import_ms": max(0.0, wall - interp) * 1000.0,
+            "heaviest": heaviest(runs[-1][1], args.top),
+        })
+    if args.json:
+        print(json.dumps({"interpreter_ms": interp * 1000.0, "results": results}, indent=2))
+        return
+    print(f"interpreter startup: {interp * 1000.0:.1f} ms")
+    for r in results:
+        if "error" in r:
+            print(f"{r['module']:<28} error: {r['error']}")
+            continue
+        heavy = ", ".join(f"{n} {ms:.0f}ms" for n, ms in r["heaviest"])
+        print(f"{r['module']:<28} {r['import_ms']:>8.1f} ms   {heavy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+from __future__ import annotations
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from bench.mock_llm import build_response
+
+
+class LocalBatchBackend:
+    def __init__(
+        self,
+        root: str,
+        per_poll: int = 0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        responder: Callable[[Dict[str, Any]], Dict[str, Any]] = build_response,
+    ) -> None:
+        self.root = root
+        self.per_poll = int(per_poll)
+        self.error_rate = float(error_rate)
+        self.responder = responder
+        self._rng = random.Random(seed)
+        os.makedirs(os.path.join(root, "files"), exist_ok=True)
+        os.makedirs(os.path.join(root, "batches"), exist_ok=True)
+
+    def _file(self, file_id: str) -> str:
+        return os.path.join(self.root, "files", file_id + ".jsonl")
+
+    def _batch(self, batch_id: str) -> str:
+        return os.path.join(self.root, "batches", batch_id + ".json")
+
+    def _save(self, batch: Dict[str, Any]) -> None:
+        path = self._batch(batch["id"])
+        with tempfile.NamedTemporaryFile("w", delete=False, dir=os.path.dirname(path), prefix=".tmp_batch_", suffix=".json", encoding="utf-8") as tmp:
+            json.dump(batch, tmp, ensure_ascii=False, indent=2)
+            tmp_path = tmp.name
+        os.replace(tmp_path, path)
+
+    def upload(self, path: str) -> str:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        shutil.copyfile(path, self._file(file_id))
+        return file_id
+
+    def create(self, input_file_id: str, endpoint: str = "/v1/chat/completions", completion_window: str = "24h", metadata: Optional[Dict[str, str]] = None) -> str:
+        if not os.path.exists(self._file(input_file_id)):
+            raise FileNotFoundError(f"Unknown input file {input_file_id}")
+        with open(self._file(input_file_id), "rb") as f:
+            total = sum(1 for line in f if line.strip())
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "status": "validating",
+            "endpoint": endpoint,
+            "completion_window": completion_window,
+            "input_file_id": input_file_id,
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "completed_at": None,
+            "metadata": metadata or {},
+            "request_counts": {"total": total, "completed": 0, "failed": 0},
+            "_offset": 0,
+        }
+        self._save(batch)
+        return batch["id"]
+
+    def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        with open(self._batch(batch_id), "r", encoding="utf-8") as f:
+            batch = json.load(f)
+        if batch["status"] == "validating":
+            batch["status"] = "in_progress"
+            batch["output_file_id"] = f"file-{uuid.uuid4().hex[:24]}"
+            batch["error_file_id"] = f"file-{uuid.uuid4().hex[:24]}"
+            open(self._file(batch["output_file_id"]), "w").close()
+            open(self._file(batch["error_file_id"]), "w").close()
+        elif batch["status"] == "in_progress":
+            self._process(batch)
+        self._save(batch)
+        return {k: v for k, v in batch.items() if not k.startswith("_")}
+
+    def _process(self, batch: Dict[str, Any]) -> None:
+        counts = batch["request_counts"]
+        limit = self.per_poll or counts["total"]
+        done = 0
+        with open(self._file(batch["input_file_id"]), "r", encoding="utf-8") as src, \
+                open(self._file(batch["output_file_id"]), "a", encoding="utf-8") as out, \
+                open(self._file(batch["error_file_id"]), "a", encoding="utf-8") as err:
+            lines = [ln for ln in src if ln.strip()]
+            for line in lines[batch["_offset"] : batch["_offset"] + limit]:
+                req = json.loads(line)
+                result: Dict[str, Any] = {"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": req.get("custom_id")}
+                if self._rng.random() < self.error_rate:
+                    result["response"] = {"status_code": 500, "request_id": uuid.uuid4().hex, "body": {"error": {"message": "injected failure", "type": "server_error"}}}
+                    result["error"] = None
+                    err.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    counts["failed"] += 1
+                else:
+                    result["response"] = {"status_code": 200, "request_id": uuid.uuid4().hex, "body": self.responder(req.get("body") or {})}
+                    result["error"] = None
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    counts["completed"] += 1
+                done += 1
+        batch["_offset"] += done
+        if batch["_offset"] >= counts["total"]:
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+
+    def download(self, file_id: str, dest: str) -> None:
+        shutil.copyfile(self._file(file_id), dest)
@@ -0,0 +1,382 @@
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+_WORDS = [
+    "theory", "dynamics", "models", "structure", "analysis", "systems", "methods", "processes",
+    "geometry", "kinetics", "statistics", "topology", "spectra", "transport", "symmetry", "stability",
+    "algebra", "networks", "interactions", "mechanics", "signals", "materials", "fields", "phases",
+]
+_NAMES = ["Ada", "Bram", "Chiara", "Dmitri", "Esi", "Farah", "Goran", "Hana", "Ivo", "Jun"]
+_TOPIC_RE = re.compile(r"The current topic is '([^']*)'")
+_MAX_WORDS_RE = re.compile(r"Maximum length:\s*(\d+)\s*words")
+
+
+@dataclass
+class MockConfig:
+    latency: str = "lognormal:-2.5,0.6"
+    per_token_ms: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 0.05
+    invalid_rate: float = 0.0
+    stream_chunk_words: int = 8
+    seed: int = 0
+
+
+def parse_latency(spec: str):
+    kind, _, raw = (spec or "const:0").partition(":")
+    args = [float(x) for x in raw.split(",") if x.strip()]
+    kind = kind.strip().lower()
+    if kind == "const":
+        value = args[0] if args else 0.0
+        return lambda rng: value
+    if kind == "uniform":
+        lo, hi = (args + [0.0, 0.0])[:2]
+        return lambda rng: rng.uniform(lo, hi)
+    if kind == "lognormal":
+        mu, sigma = (args + [-2.5, 0.6])[:2]
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    if kind == "exp":
+        mean = args[0] if args else 0.1
+        return lambda rng: rng.expovariate(1.0 / mean) if mean > 0 else 0.0
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _seed_for(model: str, messages: List[Dict[str, Any]], index: int = 0) -> int:
+    h = hashlib.sha256()
+    h.update(model.encode("utf-8"))
+    for m in messages:
+        h.update(str(m.get("content", "")).encode("utf-8"))
+    h.update(str(index).encode("utf-8"))
+    return int.from_bytes(h.digest()[:8], "big")
+
+
+def fake_subtopics(topic: str, rng: random.Random) -> Dict[str, Any]:
+    count = rng.randint(3, 8)
+    picked = rng.sample(_WORDS, count)
+    return {"subtopics": [{"topic": f"{topic} {w}".strip(), "importance": rng.randint(2, 10)} for w in picked]}
+
+
+def _labels(names: List[str], label_content: str, script: bool) -> List[str]:
+    n = len(names)
+    if label_content == "generic_tagged_letter":
+        labels = [f"Person {chr(65 + i)}" for i in range(n)]
+    elif label_content == "generic_tagged_number":
+        labels = [f"Person {i + 1}" for i in range(n)]
+    elif label_content == "generic_letter":
+        labels = [chr(65 + i) for i in range(n)]
+    elif label_content == "generic_number":
+        labels = [str(i + 1) for i in range(n)]
+    elif label_content == "role":
+        labels = ["Physicist", "Engineer", "Analyst", "Historian", "Chemist"][:n]
+    else:
+        return names
+    return [l.upper() for l in labels] if script else labels
+
+
+def fake_dialogue(
+    topic: str,
+    max_words: int,
+    rng: random.Random,
+    label_layout: str = "inline",
+    label_content: str = "name_normal",
+    names: Optional[List[str]] = None,
+) -> str:
+    speakers = names or rng.sample(_NAMES, rng.choice([2, 3]))
+    labels = _labels(speakers, label_content, label_layout == "script")
+    lines: List[str] = []
+    words = 0
+    turn = 0
+    target = int(max_words * rng.uniform(0.6, 0.95))
+    while words < target:
+        n = rng.randint(12, 30)
+        body = f"On {topic}, " + " ".join(rng.choice(_WORDS) for _ in range(n)) + "."
+        label = labels[turn % len(labels)]
+        if label_layout == "script":
+            lines.append(f"{label}\n{body}\n")
+        elif label_layout == "none":
+            lines.append(body)
+        else:
+            lines.append(f"{label}: {body}")
+        words += n + 3
+        turn += 1
+    return "\n".join(lines).strip()
+
+
+def _requested_format(system: str) -> Tuple[str, str]:
+    try:
+        from dataset.prompts import SYSTEM_VARIANTS
+    except ImportError:
+        return "inline", "name_normal"
+    for key, msg in SYSTEM_VARIANTS.items():
+        if msg == system:
+            return key
+    return "inline", "name_normal"
+
+
+def _characters(text: str) -> List[str]:
+    _, _, rest = text.partition("Characters :\n")
+    names: List[str] = []
+    for line in rest.splitlines():
+        if not line.strip():
+            break
+        names.append(line.split(" (", 1)[0].strip())
+    return names
+
+
+def fake_completion(body: Dict[str, Any], index: int = 0, invalid_rate: float = 0.0) -> Tuple[Optional[Dict[str, Any]], str]:
+    model = str(body.get("model", "mock"))
+    messages = body.get("messages") or []
+    rng = random.Random(_seed_for(model, messages, index))
+    text = "\n".join(str(m.get("content", "")) for m in messages)
+    tools = body.get("tools") or []
+    if tools or "subtopics" in text:
+        m = _TOPIC_RE.search(text)
+        payload = json.dumps(fake_subtopics(m.group(1) if m else "Topic", rng))
+        if tools:
+            name = tools[0].get("function", {}).get("name", "Subtopics")
+            return {"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function", "function": {"name": name, "arguments": payload}}, payload
+        return None, payload
+    m = _MAX_WORDS_RE.search(text)
+    max_words = int(m.group(1)) if m else 200
+    topic = "the topic"
+    for line in text.splitlines():
+        if line.startswith("Topic:"):
+            topic = line[len("Topic:") :].strip()
+            break
+    system = next((str(m.get("content", "")) for m in messages if m.get("role") == "system"), "")
+    label_layout, label_content = _requested_format(system)
+    if invalid_rate and rng.random() < invalid_rate:
+        if rng.random() < 0.5:
+            label_layout = "none" if label_layout != "none" else "inline"
+        else:
+            max_words *= 3
+    return None, fake_dialogue(topic, max_words, rng, label_layout, label_content, _characters(text))
+
+
+def build_response(body: Dict[str, Any], cached_tokens: int = 0, invalid_rate: float = 0.0) -> Dict[str, Any]:
+    n = max(1, int(body.get("n", 1) or 1))
+    prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in body.get("messages") or [])
+    choices = []
+    completion_tokens = 0
+    for i in range(n):
+        tool_call, content = fake_completion(body, i, invalid_rate)
+        completion_tokens += estimate_tokens(content)
+        message: Dict[str, Any] = {"role": "assistant", "content": None if tool_call else content}
+        if tool_call:
+            message["tool_calls"] = [tool_call]
+        choices.append({"index": i, "message": message, "finish_reason": "tool_calls" if tool_call else "stop"})
+    reasoning = completion_tokens // 5 if body.get("reasoning_effort") else 0
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:16]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": str(body.get("model", "mock")),
+        "choices": choices,
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens + reasoning,
+            "total_tokens": prompt_tokens + completion_tokens + reasoning,
+            "prompt_tokens_details": {"cached_tokens": min(cached_tokens, prompt_tokens)},
+            "completion_tokens_details": {"reasoning_tokens": reasoning},
+        },
+    }
+
+
+class MockLLMServer:
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.config = config or MockConfig()
+        self._latency = parse_latency(self.config.latency)
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.aborted = 0
+        self.completion_tokens = 0
+        self._prefixes: set = set()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def cached_prefix_tokens(self, body: Dict[str, Any]) -> int:
+        messages = body.get("messages") or []
+        if not messages:
+            return 0
+        first = str(messages[0].get("content", ""))
+        digest = hashlib.sha256(f"{body.get('model', '')}\0{first}".encode("utf-8")).digest()
+        with self._lock:
+            hit = digest in self._prefixes
+            self._prefixes.add(digest)
+        return estimate_tokens(first) if hit else 0
+
+    def _draw(self) -> Tuple[float, float]:
+        with self._lock:
+            self.requests += 1
+            return self._rng.random(), self._latency(self._rng)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self) -> None:
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+                    return
+                self._send(404, {"error": {"message": "not found"}})
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", "0") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    self._send(400, {"error": {"message": "invalid json"}})
+                    return
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "not found"}})
+                    return
+                roll, delay = server._draw()
+                cfg = server.config
+                if roll < cfg.rate_limit_rate:
+                    with server._lock:
+                        server.rate_limited += 1
+                    self._send(429, {"error": {"message": "rate limited", "type": "rate_limit"}}, {"Retry-After": str(cfg.retry_after)})
+                    return
+                if roll < cfg.rate_limit_rate + cfg.error_rate:
+                    with server._lock:
+                        server.errors += 1
+                    time.sleep(delay)
+                    self._send(500, {"error": {"message": "injected failure", "type": "server_error"}})
+                    return
+                resp = build_response(body, server.cached_prefix_tokens(body), cfg.invalid_rate)
+                if body.get("stream"):
+                    time.sleep(delay)
+                    self._stream(resp, bool((body.get("stream_options") or {}).get("include_usage")))
+                    return
+                time.sleep(delay + cfg.per_token_ms * resp["usage"]["completion_tokens"] / 1000.0)
+                with server._lock:
+                    server.completion_tokens += resp["usage"]["completion_tokens"]
+                self._send(200, resp)
+
+            def _chunk(self, payload: Any) -> None:
+                data = b"data: " + (payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")) + b"\n\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def _stream(self, resp: Dict[str, Any], include_usage: bool) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                base = {"id": resp["id"], "object": "chat.completion.chunk", "created": resp["created"], "model": resp["model"]}
+                content = resp["choices"][0]["message"]["content"] or ""
+                words = re.findall(r"\S+\s*|\s+", content)
+                step = max(1, server.config.stream_chunk_words)
+                pieces = ["".join(words[k : k + step]) for k in range(0, len(words), step)]
+                sent = 0
+                try:
+                    self._chunk({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]})
+                    for piece in pieces:
+                        if server.config.per_token_ms:
+                            time.sleep(server.config.per_token_ms * estimate_tokens(piece) / 1000.0)
+                        self._chunk({**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+                        sent += estimate_tokens(piece)
+                    self._chunk({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                    if include_usage:
+                        self._chunk({**base, "choices": [], "usage": resp["usage"]})
+                    self._chunk(b"[DONE]")
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+                    with server._lock:
+                        server.aborted += 1
+                finally:
+                    with server._lock:
+                        server.completion_tokens += sent
+
+        return Handler
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", default=MockConfig.latency, help="const:S | uniform:A,B | lognormal:MU,SIGMA | exp:MEAN (seconds)")
+    parser.add_argument("--per-token-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="share of dialogues rendered in the wrong layout or at 3x length")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    cfg = MockConfig(
+        latency=args.latency,
+        per_token_ms=args.per_token_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        invalid_rate=args.invalid_rate,
+        seed=args.seed,
+    )
+    server = MockLLMServer(cfg, host=args.host, port=args.port)
+    print(f"Mock LLM listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+from __future__ import annotations
+import argparse
+import csv
+import json
+import os
+import pickle
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+ONTOLOGY_DIR = os.path.join(ROOT_DIR, "ontology")
+
+DEFAULT_SIZES = {
+    "ontology": [200, 1000, 3000],
+    "dataset": [100, 500, 2000],
+    "exporter": [1000, 10000, 100000],
+    "tokens": [1000, 10000, 100000],
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = (len(s) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == "darwin" else rss / 1024.0
+
+
+def timed(fn: Callable, latencies: List[float]) -> Callable:
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - t0)
+
+    return wrapper
+
+
+def atimed(fn: Callable, latencies: List[float]) -> Callable:
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - t0)
+
+    return wrapper
+
+
+def use_mock_env(base_url: str) -> None:
+    os.environ["OPENAI_API_KEY"] = "mock"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["MODEL_LIST"] = "mock/ontology"
+
+
+def synthetic_graph(size: int, seed: int = 0):
+    import networkx as nx
+
+    rng = random.Random(seed)
+    G = nx.DiGraph()
+    G.add_node("root", topic="Knowledge", parentid=None, expanded="true", depth=0, importance=10)
+    frontier = ["root"]
+    while G.number_of_nodes() < size:
+        parent = frontier[rng.randrange(len(frontier))]
+        depth = int(G.nodes[parent]["depth"]) + 1
+        nid = uuid.UUID(int=rng.getrandbits(128)).hex[:8]
+        G.add_node(nid, topic=f"Topic {G.number_of_nodes()}", parentid=parent, expanded="false", depth=depth, importance=rng.randint(0, 10))
+        G.add_edge(parent, nid, relation="is_a", order=0)
+        frontier.append(nid)
+    return G
+
+
+def write_topics(path: str, size: int) -> List[str]:
+    ids = [f"{i:08x}" for i in range(size)]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=["id", "topic", "path", "depth"])
+        w.writeheader()
+        for i, rid in enumerate(ids):
+            topic = f"Synthetic topic {i}"
+            w.writerow({"id": rid, "topic": topic, "path": f"Sciences > Field > Area > {topic}", "depth": 4})
+    return ids
+
+
+def bench_ontology(size: int, args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    from bench.mock_llm import MockLLMServer
+
+    sys.path.insert(0, ONTOLOGY_DIR)
+    with MockLLMServer(mock_config(args)) as server:
+        use_mock_env(server.base_url)
+        import ontology_tree
+
+        latencies: List[float] = []
+        ontology_tree.expand = timed(ontology_tree.expand, latencies)
+        csv_path = os.path.join(workdir, "tree.csv")
+        t0 = time.perf_counter()
+        nodes = ontology_tree.update_csv_tree(csv_path, max_nodes=size)
+        elapsed = time.perf_counter() - t0
+    return {"items": len(nodes), "unit": "nodes", "seconds": elapsed, "latencies": latencies, "requests": server.requests}
+
+
+def bench_dataset(size: int, args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    from bench.mock_llm import MockLLMServer
+
+    with MockLLMServer(mock_config(args)) as server:
+        use_mock_env(server.base_url)
+        from dataset import build_dataset as bd
+
+        csv_path = os.path.join(workdir, "topics.csv")
+        order_path = os.path.join(workdir, "topics.order.json")
+        out_path = os.path.join(workdir, "dataset.jsonl")
+        state_path = os.path.join(workdir, "dataset.state.json")
+        ids = write_topics(csv_path, size)
+        with open(order_path, "w", encoding="utf-8") as f:
+            json.dump({"seed": "0", "min_depth": 4, "ids": ids}, f)
+        latencies: List[float] = []
+        bd.generate_dialogue = atimed(bd.generate_dialogue, latencies)
+        bd.generate_dialogue_stream = atimed(bd.generate_dialogue_stream, latencies)
+        t0 = time.perf_counter()
+        bd.build_dataset(csv_path, order_path, out_path, state_path, workers=args.workers, usage_path=os.path.join(workdir, "usage.jsonl"), stream=args.stream)
+        elapsed = time.perf_counter() - t0
+    with open(out_path, "r", encoding="utf-8") as f:
+        rows = sum(1 for _ in f)
+    return {
+        "items": rows,
+        "unit": "dialogues",
+        "seconds": elapsed,
+        "latencies": latencies,
+        "requests": server.requests,
+        "completion_tokens": server.completion_tokens,
+        "aborted": server.aborted,
+    }
+
+
+def bench_exporter(size: int, args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    from ontology.export_topics_csv import export_topics_csv
+
+    pkl_path = os.path.join(workdir, "tree.pkl")
+    with open(pkl_path, "wb") as f:
+        pickle.dump(synthetic_graph(size, seed=args.seed), f, protocol=pickle.HIGHEST_PROTOCOL)
+    t0 = time.perf_counter()
+    export_topics_csv(pkl_path, os.path.join(workdir, "topics.csv"))
+    elapsed = time.perf_counter() - t0
+    return {"items": size, "unit": "rows", "seconds": elapsed, "latencies": [], "requests": 0}
+
+
+def bench_tokens(size: int, args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    from bench.mock_llm import fake_dialogue
+    from dataset.count_tokens import count_dataset_tokens
+
+    rng = random.Random(args.seed)
+    path = os.path.join(workdir, "dataset.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(size):
+            text = fake_dialogue(f"Topic {i}", rng.choice([100, 200, 300, 400, 500]), rng)
+            f.write(json.dumps({"id": f"{i:08x}", "topic": f"Topic {i}", "text": text}) + "\n")
+    t0 = time.perf_counter()
+    _, rows = count_dataset_tokens(path, "gpt-4o-mini")
+    elapsed = time.perf_counter() - t0
+    return {"items": rows, "unit": "rows", "seconds": elapsed, "latencies": [], "requests": 0}
+
+
+CASES = {
+    "ontology": bench_ontology,
+    "dataset": bench_dataset,
+    "exporter": bench_exporter,
+    "tokens": bench_tokens,
+}
+
+
+def mock_config(args: argparse.Namespace):
+    from bench.mock_llm import MockConfig
+
+    return MockConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        invalid_rate=args.invalid_rate,
+        per_token_ms=args.per_token_ms,
+        seed=args.seed,
+    )
+
+
+def run_case(case: str, size: int, args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix=f"bench_{case}_") as workdir:
+        res = CASES[case](size, args, workdir)
+    lat = res.pop("latencies")
+    seconds = res["seconds"]
+    res.update({
+        "case": case,
+        "size": size,
+        "rate": res["items"] / seconds if seconds > 0 else 0.0,
+        "p50_ms": percentile(lat, 0.50) * 1000.0,
+        "p99_ms": percentile(lat, 0.99) * 1000.0,
+        "peak_rss_mb": peak_rss_mb(),
+    })
+    return res
+
+
+def run_isolated(case: str, size: int, args: argparse.Namespace) -> Optional[Dict[str, Any]]:
+    cmd = [
+        sys.executable, "-m", "bench.run", "--child", case, "--sizes", str(size),
+        "--latency", args.latency, "--error-rate", str(args.error_rate),
+        "--rate-limit-rate", str(args.rate_limit_rate), "--invalid-rate", str(args.invalid_rate),
+        "--per-token-ms", str(args.per_token_ms), "--workers", str(args.workers), "--seed", str(args.seed),
+    ]
+    if args.stream:
+        cmd.append("--stream")
+    proc = subprocess.run(cmd, cwd=ROOT_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(f"[bench_error] case={case} size={size}\n{proc.stderr.strip()}", file=sys.stderr, flush=True)
+        return None
+    lines = [ln for ln in proc.stdout.splitlines() if ln.startswith("{")]
+    return json.loads(lines[-1]) if lines else None
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    header = f"{'case':<10}{'size':>9}{'items':>9}{'seconds':>10}{'rate':>22}{'p50 ms':>10}{'p99 ms':>10}{'rss MB':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        rate = f"{r['rate']:.1f} {r['unit']}/s"
+        print(f"{r['case']:<10}{r['size']:>9}{r['items']:>9}{r['seconds']:>10.2f}{rate:>22}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['peak_rss_mb']:>10.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", default="ontology,dataset,exporter,tokens")
+    parser.add_argument("--sizes", default="", help="comma-separated sizes; defaults per case")
+    parser.add_argument("--latency", default="lognormal:-4.5,0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="share of mock dialogues returned in the wrong layout or over length")
+    parser.add_argument("--per-token-ms", type=float, default=0.0, help="mock generation time per completion token")
+    parser.add_argument("--stream", action="store_true", help="dataset case: stream completions with early abort")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default="", help="also write results to this path")
+    parser.add_argument("--child", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    if args.child:
+        print(json.dumps(run_case(args.child, sizes[0], args)))
+        return
+    results: List[Dict[str, Any]] = []
+    for case in [c.strip() for c in args.cases.split(",") if c.strip()]:
+        if case not in CASES:
+            raise SystemExit(f"Unknown case: {case}")
+        for size in sizes or DEFAULT_SIZES[case]:
+            res = run_isolated(case, size, args)
+            if res is not None:
+                results.append(res)
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
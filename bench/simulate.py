@@ -0,0 +1,456 @@
+from __future__ import annotations
+import argparse
+import heapq
+import json
+import math
+import os
+import pickle
+import random
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from telemetry.usage import iter_records, load_prices  # noqa: E402
+
+MIN_SAMPLES = 20
+MIN_IMPORTANCE = 6
+DEFAULT_WORKERS = [1, 2, 4, 8, 16, 32, 64, 128]
+DEFAULTS = {
+    "ontology": {"median": 6.0, "sigma": 0.5, "prompt": 450, "completion": 250, "invalid": 0.0},
+    "dataset": {"median": 30.0, "sigma": 0.5, "prompt": 1200, "completion": 900, "invalid": 0.1},
+}
+
+
+@dataclass
+class ModelProfile:
+    stage: str
+    model: str
+    mu: float
+    sigma: float
+    tokens: List[Tuple[int, int]]
+    invalid: float
+    samples: int = 0
+
+    def latency(self, rng: random.Random) -> float:
+        return rng.lognormvariate(self.mu, self.sigma)
+
+    def draw_tokens(self, rng: random.Random) -> Tuple[int, int]:
+        return self.tokens[rng.randrange(len(self.tokens))]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "samples": self.samples,
+            "fitted": self.samples >= MIN_SAMPLES,
+            "p50_s": round(math.exp(self.mu), 3),
+            "p95_s": round(math.exp(self.mu + 1.645 * self.sigma), 3),
+            "prompt_tokens": round(sum(p for p, _ in self.tokens) / len(self.tokens), 1),
+            "completion_tokens": round(sum(c for _, c in self.tokens) / len(self.tokens), 1),
+            "invalid_rate": round(self.invalid, 4),
+        }
+
+
+def default_profile(stage: str, model: str) -> ModelProfile:
+    d = DEFAULTS[stage]
+    return ModelProfile(stage, model, math.log(d["median"]), d["sigma"], [(d["prompt"], d["completion"])], d["invalid"])
+
+
+def fit_profile(stage: str, model: str, records: List[Dict[str, Any]]) -> ModelProfile:
+    lat = [float(r.get("latency") or 0.0) for r in records if float(r.get("latency") or 0.0) > 0 and not r.get("variant")]
+    if len(lat) < MIN_SAMPLES:
+        prof = default_profile(stage, model)
+        prof.samples = len(lat)
+        return prof
+    logs = [math.log(x) for x in lat]
+    mu = sum(logs) / len(logs)
+    sigma = math.sqrt(sum((x - mu) ** 2 for x in logs) / max(1, len(logs) - 1))
+    tokens = [(int(r.get("prompt_tokens") or 0), int(r.get("completion_tokens") or 0)) for r in records if not r.get("variant")]
+    invalid = sum(1 for r in records if r.get("status", "ok") != "ok") / len(records)
+    return ModelProfile(stage, model, mu, sigma, tokens, invalid, len(lat))
+
+
+def fit_profiles(ledger: Optional[str]) -> Dict[str, Dict[str, ModelProfile]]:
+    grouped: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    if ledger and os.path.exists(ledger):
+        for rec in iter_records(ledger):
+            stage = rec.get("stage")
+            if stage in DEFAULTS:
+                grouped.setdefault((stage, str(rec.get("model", ""))), []).append(rec)
+    profiles: Dict[str, Dict[str, ModelProfile]] = {stage: {} for stage in DEFAULTS}
+    for (stage, model), recs in grouped.items():
+        profiles[stage][model] = fit_profile(stage, model, recs)
+    return profiles
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix: Dict[str, float] = {}
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        model, _, weight = part.partition("=")
+        mix[model.strip()] = float(weight) if weight else 1.0
+    return mix
+
+
+class ModelMix:
+    def __init__(self, stage: str, profiles: Dict[str, ModelProfile], mix: Dict[str, float]) -> None:
+        if not mix:
+            mix = {m: float(p.samples) for m, p in profiles.items() if p.samples} or {"default": 1.0}
+        self.profiles = [profiles.get(m) or default_profile(stage, m) for m in mix]
+        self.weights = [mix[m] for m in mix]
+
+    def pick(self, rng: random.Random) -> ModelProfile:
+        return rng.choices(self.profiles, weights=self.weights)[0]
+
+
+class RateLimiter:
+    def __init__(self, rpm: float) -> None:
+        self.gap = 60.0 / rpm if rpm > 0 else 0.0
+        self.next_free = 0.0
+
+    def start_at(self, t: float) -> float:
+        if self.gap <= 0:
+            return t
+        start = max(t, self.next_free)
+        self.next_free = start + self.gap
+        return start
+
+
+@dataclass
+class Totals:
+    requests: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    items: int = 0
+    rows: int = 0
+    by_model: Dict[str, int] = field(default_factory=dict)
+
+    def charge(self, prof: ModelProfile, prompt: int, completion: int, prices: Dict[str, Tuple[float, float]]) -> None:
+        self.requests += 1
+        self.prompt_tokens += prompt
+        self.completion_tokens += completion
+        self.by_model[prof.model] = self.by_model.get(prof.model, 0) + 1
+        p = prices.get(prof.model)
+        if p is not None:
+            self.cost += (prompt * p[0] + completion * p[1]) / 1_000_000
+
+
+@dataclass
+class GraphShape:
+    nodes: int
+    frontier: int
+    frontier_low: int
+    children: List[int]
+    eligible_share: float
+    checkpoint_per_node: float
+    domains: List[Tuple[int, int]] = field(default_factory=list)
+
+
+def graph_shape(pkl_path: Optional[str]) -> GraphShape:
+    if not pkl_path or not os.path.exists(pkl_path):
+        return GraphShape(1, 1, 0, list(range(3, 9)), 0.7, 0.0)
+    with open(pkl_path, "rb") as f:
+        G = pickle.load(f)
+    t0 = time.perf_counter()
+    pickle.dumps(G, protocol=pickle.HIGHEST_PROTOCOL)
+    per_node = (time.perf_counter() - t0) / max(1, G.number_of_nodes())
+    parent: Dict[str, Optional[str]] = {}
+    kids: Dict[str, int] = {}
+    for nid, data in G.nodes(data=True):
+        pid = data.get("parentid")
+        parent[str(nid)] = None if pid in (None, "", "None") else str(pid)
+        if parent[str(nid)] is not None:
+            kids[str(pid)] = kids.get(str(pid), 0) + 1
+    roots = {nid for nid, pid in parent.items() if pid is None}
+    domain_of: Dict[str, Optional[str]] = {}
+
+    def find_domain(nid: str) -> Optional[str]:
+        chain = []
+        cur: Optional[str] = nid
+        while cur is not None and cur not in domain_of:
+            pid = parent.get(cur)
+            if pid in roots:
+                domain_of[cur] = cur
+                break
+            chain.append(cur)
+            cur = pid
+        dom = domain_of.get(cur) if cur is not None else None
+        for c in chain:
+            domain_of[c] = dom
+        return dom
+
+    domains: Dict[str, List[int]] = {}
+    frontier = low = eligible = 0
+    for nid, data in G.nodes(data=True):
+        importance = int(data.get("importance", 0) or 0)
+        eligible += importance >= MIN_IMPORTANCE
+        dom = find_domain(str(nid)) if str(nid) not in roots else None
+        slot = domains.setdefault(dom, [0, 0]) if dom is not None else [0, 0]
+        if str(data.get("expanded", "false")).strip().lower() == "false":
+            if importance >= MIN_IMPORTANCE:
+                frontier += 1
+                slot[0] += 1
+            else:
+                low += 1
+                slot[1] += 1
+    children = [kids.get(str(nid), 0) for nid, data in G.nodes(data=True) if str(data.get("expanded", "")).strip().lower() == "true"]
+    if len(children) < MIN_SAMPLES:
+        children = list(range(3, 9))
+    n = max(1, G.number_of_nodes())
+    return GraphShape(G.number_of_nodes(), frontier, low, children, eligible / n, per_node, [tuple(domains[d]) for d in sorted(domains)])
+
+
+def request(mix: ModelMix, limiter: RateLimiter, prices: Dict[str, Tuple[float, float]], totals: Totals, error_rate: float, rng: random.Random, ready: float) -> float:
+    prof = mix.pick(rng)
+    end = limiter.start_at(ready)
+    while True:
+        end += prof.latency(rng)
+        prompt, completion = prof.draw_tokens(rng)
+        totals.charge(prof, prompt, completion, prices)
+        if rng.random() >= error_rate:
+            return end
+        totals.errors += 1
+        end = limiter.start_at(end)
+
+
+def plan_shards(domains: List[Tuple[int, int]], shards: int) -> List[List[int]]:
+    # Same longest-first assignment as ontology/shard.py make_plan.
+    state = [[0, 0] for _ in range(max(1, shards))]
+    load = [0] * len(state)
+    for f, low in sorted(domains, key=lambda d: -(d[0] + d[1])):
+        k = min(range(len(load)), key=lambda i: (load[i], i))
+        state[k][0] += f
+        state[k][1] += low
+        load[k] += (f + low) or 1
+    return state
+
+
+def simulate_ontology(shape: GraphShape, target: int, workers: int, mix: ModelMix, limiter: RateLimiter, prices: Dict[str, Tuple[float, float]], error_rate: float, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    totals = Totals()
+    nodes = shape.nodes
+    t = 0.0
+    domains = list(shape.domains)
+    if not domains and nodes < target:
+        # A fresh graph has nothing to shard until the root is expanded.
+        t = request(mix, limiter, prices, totals, error_rate, rng, 0.0)
+        added = min(shape.children[rng.randrange(len(shape.children))], target - nodes)
+        domains = [(1, 0) if rng.random() < shape.eligible_share else (0, 1) for _ in range(added)]
+        nodes += added
+        totals.items += 1
+    # One process checkpoints the pickle per node; shards journal instead and pay one merge write.
+    checkpoint = shape.checkpoint_per_node if workers <= 1 else 0.0
+    shards = 1 if workers <= 1 else max(1, min(workers, len(domains)))
+    state = plan_shards(domains, shards)
+    budget = math.ceil(max(0, target - nodes) / shards)
+    added_by = [0] * shards
+    heap = [(t, k) for k in range(shards)]
+    end = t
+    while heap:
+        ready, k = heapq.heappop(heap)
+        f, low = state[k]
+        if added_by[k] >= budget or f + low == 0:
+            end = max(end, ready)
+            continue
+        if rng.random() * (f + low) < low:
+            state[k][1] -= 1
+            heapq.heappush(heap, (ready + checkpoint * nodes, k))
+            continue
+        state[k][0] -= 1
+        done = request(mix, limiter, prices, totals, error_rate, rng, ready)
+        added = min(shape.children[rng.randrange(len(shape.children))], budget - added_by[k])
+        eligible = sum(1 for _ in range(added) if rng.random() < shape.eligible_share)
+        state[k][0] += eligible
+        state[k][1] += added - eligible
+        added_by[k] += added
+        nodes += added
+        totals.items += 1
+        heapq.heappush(heap, (done + checkpoint * nodes, k))
+    if workers > 1:
+        end += shape.checkpoint_per_node * nodes
+    totals.rows = nodes - shape.nodes
+    return {"seconds": end, "totals": totals, "shards": shards, "domains": len(domains)}
+
+
+def simulate_dataset(items: int, workers: int, batch_size: int, variants: int, max_attempts: int, mix: ModelMix, limiter: RateLimiter, prices: Dict[str, Tuple[float, float]], error_rate: float, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    totals = Totals()
+    t = 0.0
+    for start in range(0, items, batch_size):
+        batch = min(batch_size, items - start)
+        queue: Deque[Tuple[int, int]] = deque((k, 1) for k in range(batch))
+        servers: List[float] = [t] * min(workers, batch)
+        heapq.heapify(servers)
+        batch_end = t
+        while queue:
+            k, attempt = queue.popleft()
+            ready = heapq.heappop(servers)
+            begin = limiter.start_at(ready)
+            prof = mix.pick(rng)
+            end = begin + prof.latency(rng)
+            prompt, completion = prof.draw_tokens(rng)
+            totals.charge(prof, prompt, completion * variants, prices)
+            heapq.heappush(servers, end)
+            batch_end = max(batch_end, end)
+            if rng.random() < error_rate:
+                totals.errors += 1
+                queue.append((k, attempt))
+                continue
+            valid = sum(1 for _ in range(variants) if rng.random() >= prof.invalid)
+            if valid == 0 and attempt < max_attempts:
+                queue.append((k, attempt + 1))
+                continue
+            totals.items += 1
+            totals.rows += valid
+        t = batch_end
+    return {"seconds": t, "totals": totals}
+
+
+def knee(points: Sequence[Tuple[int, float]], threshold: float) -> Optional[int]:
+    for (w0, r0), (w1, r1) in zip(points, points[1:]):
+        if r0 <= 0 or w1 <= w0:
+            continue
+        if (r1 / r0 - 1.0) / (w1 / w0 - 1.0) < threshold:
+            return w0
+    return None
+
+
+def hms(seconds: float) -> str:
+    s = int(round(seconds))
+    return f"{s // 3600}:{s % 3600 // 60:02d}:{s % 60:02d}"
+
+
+def row(stage: str, workers: int, batch: int, res: Dict[str, Any]) -> Dict[str, Any]:
+    t: Totals = res["totals"]
+    return {
+        "stage": stage,
+        "workers": workers,
+        "batch": batch,
+        "seconds": round(res["seconds"], 1),
+        "items": t.items,
+        "rows": t.rows,
+        "requests": t.requests,
+        "errors": t.errors,
+        "prompt_tokens": t.prompt_tokens,
+        "completion_tokens": t.completion_tokens,
+        "cost": round(t.cost, 2),
+        "shards": res.get("shards"),
+        "throughput": round(t.rows / res["seconds"] * 3600, 1) if res["seconds"] > 0 else 0.0,
+        "by_model": t.by_model,
+    }
+
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    header = f"{'stage':<10}{'workers':>8}{'batch':>7}{'wall':>12}{'requests':>10}{'rows':>9}{'rows/h':>10}{'prompt tok':>13}{'compl tok':>13}{'cost $':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['stage']:<10}{r['workers']:>8}{r['batch']:>7}{hms(r['seconds']):>12}{r['requests']:>10}{r['rows']:>9}{r['throughput']:>10.1f}{r['prompt_tokens']:>13}{r['completion_tokens']:>13}{r['cost']:>10.2f}")
+
+
+def dataset_items(order_path: str, state_path: str) -> int:
+    from dataset.build_dataset import load_cursor
+    from dataset.make_topics_order import open_order
+
+    if not os.path.exists(order_path):
+        raise SystemExit(f"Order file {order_path} not found; pass --items")
+    with open_order(order_path) as order:
+        return max(0, len(order) - load_cursor(state_path))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stages", default="ontology,dataset")
+    parser.add_argument("--ledger", default=os.path.join(ROOT_DIR, "data", "usage.jsonl"), help="usage ledger to fit latency, tokens and invalid rates from")
+    parser.add_argument("--prices", default="", help="model -> USD per 1M tokens (see telemetry.usage)")
+    parser.add_argument("--graph", default=os.path.join(ROOT_DIR, "data", "ontology", "tree.pkl"))
+    parser.add_argument("--target-nodes", type=int, default=30000)
+    parser.add_argument("--order", default=os.path.join(ROOT_DIR, "data", "topics.order.json"))
+    parser.add_argument("--state", default=os.path.join(ROOT_DIR, "data", "dataset.state.json"))
+    parser.add_argument("--items", type=int, default=0, help="order positions to generate (default: rest of --order after the saved cursor)")
+    parser.add_argument("--workers", default=",".join(map(str, DEFAULT_WORKERS)), help="concurrency levels to sweep (ontology: parallel shards)")
+    parser.add_argument("--batch-sizes", default="", help="dataset batch sizes to sweep (default: 2 x workers, as build_dataset)")
+    parser.add_argument("--variants", type=int, default=1)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--ontology-mix", default="", help="model=weight,... (default: mix observed in the ledger)")
+    parser.add_argument("--dataset-mix", default="")
+    parser.add_argument("--rpm", type=float, default=0.0, help="requests per minute per API key (0 = unlimited)")
+    parser.add_argument("--keys", type=int, default=1, help="pooled API keys sharing the load")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail and are retried")
+    parser.add_argument("--knee", type=float, default=0.1, help="marginal efficiency below which extra workers count as diminishing returns")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default="", help="also write results to this path")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    workers = sorted({int(w) for w in args.workers.split(",") if w.strip()})
+    batches = [int(b) for b in args.batch_sizes.split(",") if b.strip()] or [0]
+    profiles = fit_profiles(args.ledger)
+    prices = load_prices(args.prices or None)
+    rpm = args.rpm * max(1, args.keys)
+    report: Dict[str, Any] = {"profiles": {}, "runs": [], "knee": {}}
+    rows: List[Dict[str, Any]] = []
+    for stage in stages:
+        if stage == "ontology":
+            shape = graph_shape(args.graph)
+            mix = ModelMix(stage, profiles[stage], parse_mix(args.ontology_mix))
+            if shape.frontier == 0 and shape.nodes > 1:
+                print(f"[warn] {args.graph} has no unexpanded node with importance >= {MIN_IMPORTANCE}; nothing to simulate", file=sys.stderr)
+            report["graph"] = {"nodes": shape.nodes, "frontier": shape.frontier, "mean_children": round(sum(shape.children) / len(shape.children), 2), "checkpoint_ms_per_1k_nodes": round(shape.checkpoint_per_node * 1e6, 2)}
+            points = []
+            domains = 0
+            for w in workers:
+                res = simulate_ontology(shape, args.target_nodes, w, mix, RateLimiter(rpm), prices, args.error_rate, args.seed)
+                r = row(stage, w, 0, res)
+                rows.append(r)
+                points.append((w, r["throughput"]))
+                domains = max(domains, res["domains"])
+            report["graph"]["domains"] = domains
+            k = knee(points, args.knee)
+            capped = [w for w in workers if w <= domains]
+            if domains and workers[-1] >= domains and capped and (k is None or k > domains):
+                k = capped[-1]
+            report["knee"][stage] = k
+            if domains and workers[-1] > domains:
+                print(f"[shards] ontology: {domains} top-level domains; shard.py runs at most {domains} shards, so more workers add nothing", file=sys.stderr)
+        elif stage == "dataset":
+            items = args.items or dataset_items(args.order, args.state)
+            mix = ModelMix(stage, profiles[stage], parse_mix(args.dataset_mix))
+            for b in batches:
+                points = []
+                for w in workers:
+                    size = b or max(1, 2 * w)
+                    res = simulate_dataset(items, w, size, args.variants, args.max_attempts, mix, RateLimiter(rpm), prices, args.error_rate, args.seed)
+                    r = row(stage, w, size, res)
+                    rows.append(r)
+                    points.append((w, r["throughput"]))
+                report["knee"][f"{stage}@{b or '2xworkers'}"] = knee(points, args.knee)
+        else:
+            raise SystemExit(f"Unknown stage: {stage}")
+        report["profiles"][stage] = [p.summary() for p in mix.profiles]
+    report["runs"] = rows
+    for stage, profs in report["profiles"].items():
+        for p in profs:
+            print(f"[profile] stage={stage} model={p['model']} samples={p['samples']} fitted={p['fitted']} p50={p['p50_s']}s p95={p['p95_s']}s prompt={p['prompt_tokens']} completion={p['completion_tokens']} invalid={p['invalid_rate']}")
+    print_table(rows)
+    for key, w in report["knee"].items():
+        if w is None:
+            print(f"[knee] {key}: no knee up to {workers[-1]} workers")
+        else:
+            print(f"[knee] {key}: returns diminish beyond {w} workers")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
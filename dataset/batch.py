@@ -0,0 +1,313 @@
+import json
+import os
+import secrets
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from dataset.build_dataset import USAGE_PATH
+from dataset.dialogue_engine import DialogueRequest, dialogue_from_response, load_env, sample_request
+from dataset.make_topics_order import open_order
+from dataset.validation import validate_dialogue
+from telemetry import metrics
+from telemetry.usage import Ledger
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+TERMINAL = ("completed", "failed", "expired", "cancelled")
+
+Item = Tuple[int, str]
+
+
+class OpenAIBatchBackend:
+    def __init__(self) -> None:
+        from openai import OpenAI
+
+        load_env()
+        api_key = os.getenv("OPENAI_API_KEY")
+        base_url = os.getenv("OPENAI_BASE_URL")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY is not set")
+        self.client = OpenAI(api_key=api_key, base_url=base_url) if base_url else OpenAI(api_key=api_key)
+
+    def upload(self, path: str) -> str:
+        with open(path, "rb") as f:
+            return self.client.files.create(file=f, purpose="batch").id
+
+    def create(self, input_file_id: str, endpoint: str = BATCH_ENDPOINT, completion_window: str = COMPLETION_WINDOW, metadata: Optional[Dict[str, str]] = None) -> str:
+        batch = self.client.batches.create(
+            input_file_id=input_file_id,
+            endpoint=endpoint,
+            completion_window=completion_window,
+            metadata=metadata,
+        )
+        return batch.id
+
+    def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        return self.client.batches.retrieve(batch_id).model_dump()
+
+    def download(self, file_id: str, dest: str) -> None:
+        content = self.client.files.content(file_id)
+        with open(dest, "wb") as f:
+            f.write(content.content)
+
+
+def get_backend(name: str, batch_dir: str) -> Any:
+    if name == "openai":
+        return OpenAIBatchBackend()
+    if name == "local":
+        from bench.mock_batch import LocalBatchBackend
+
+        return LocalBatchBackend(
+            os.path.join(batch_dir, "local"),
+            per_poll=int(os.getenv("LOCAL_BATCH_PER_POLL", "0") or 0),
+            error_rate=float(os.getenv("LOCAL_BATCH_ERROR_RATE", "0") or 0),
+        )
+    raise ValueError(f"Unknown batch backend: {name}")
+
+
+def _write_json(path: str, obj: Any) -> None:
+    d = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("w", delete=False, dir=d, prefix=".tmp_job_", suffix=".json", encoding="utf-8") as tmp:
+        json.dump(obj, tmp, ensure_ascii=False, indent=2)
+        tmp_path = tmp.name
+    os.replace(tmp_path, path)
+
+
+def _size(path: Optional[str]) -> int:
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+
+def _rewind(path: Optional[str], size: int) -> None:
+    if path and _size(path) > size:
+        os.truncate(path, size)
+
+
+def _read_jsonl(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def prepare_round(job_dir: str, attempt: int, items: List[Item], topic_lookup: Dict[str, Dict[str, str]]) -> Dict[str, Any]:
+    requests_path = os.path.join(job_dir, f"round-{attempt}.requests.jsonl")
+    params_path = os.path.join(job_dir, f"round-{attempt}.params.jsonl")
+    count = 0
+    with open(requests_path, "w", encoding="utf-8") as req_file, open(params_path, "w", encoding="utf-8") as params_file:
+        for pos, rid in items:
+            rec = topic_lookup.get(rid)
+            if not rec:
+                continue
+            req = sample_request(rec["topic"], rec.get("path", ""))
+            custom_id = f"{pos}-{rid}-{attempt}"
+            req_file.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": req.body()}, ensure_ascii=False) + "\n")
+            params_file.write(json.dumps({"custom_id": custom_id, "pos": pos, "topic_id": rid, "depth": int(rec.get("depth", "0") or 0), "request": req.params()}, ensure_ascii=False) + "\n")
+            count += 1
+    return {
+        "attempt": attempt,
+        "requests": os.path.basename(requests_path),
+        "params": os.path.basename(params_path),
+        "items": count,
+        "input_file_id": None,
+        "batch_id": None,
+        "status": "prepared",
+        "ingested": False,
+    }
+
+
+def poll(backend: Any, batch_id: str, interval: float) -> Dict[str, Any]:
+    while True:
+        info = backend.retrieve(batch_id)
+        counts = info.get("request_counts") or {}
+        print(
+            f"[batch] id={batch_id} status={info.get('status')} completed={counts.get('completed', 0)} failed={counts.get('failed', 0)} total={counts.get('total', 0)}",
+            file=sys.stderr,
+            flush=True,
+        )
+        if info.get("status") in TERMINAL:
+            return info
+        time.sleep(interval)
+
+
+def _results(job_dir: str, attempt: int, backend: Any, info: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    for kind in ("error", "output"):
+        file_id = info.get(f"{kind}_file_id")
+        if not file_id:
+            continue
+        dest = os.path.join(job_dir, f"round-{attempt}.{kind}.jsonl")
+        if not os.path.exists(dest):
+            backend.download(file_id, dest + ".part")
+            os.replace(dest + ".part", dest)
+        for line in _read_jsonl(dest):
+            results[line.get("custom_id")] = line
+    return results
+
+
+def ingest_round(
+    job_dir: str,
+    rnd: Dict[str, Any],
+    info: Dict[str, Any],
+    backend: Any,
+    out_file: Any,
+    pool: ProcessPoolExecutor,
+    ledger: Optional[Ledger],
+) -> Tuple[int, List[Item]]:
+    attempt = rnd["attempt"]
+    params = _read_jsonl(os.path.join(job_dir, rnd["params"]))
+    results = _results(job_dir, attempt, backend, info)
+    created = info.get("created_at") or 0
+    completed = info.get("completed_at") or 0
+    latency = float(completed - created) if created and completed else 0.0
+    ok: List[Tuple[Dict[str, Any], Any]] = []
+    failed: List[Item] = []
+    for p in params:
+        line = results.get(p["custom_id"])
+        response = (line or {}).get("response") or {}
+        if line is None or line.get("error") or response.get("status_code") != 200:
+            reason = "missing" if line is None else f"http_{response.get('status_code')}"
+            metrics.inc("dataset_generation_errors_total", error=reason)
+            print(f"[generation_error] id={p['topic_id']} topic={p['request']['topic']} type=batch message={reason}", file=sys.stderr, flush=True)
+            failed.append((p["pos"], p["topic_id"]))
+            continue
+        req = DialogueRequest(**p["request"], system="", user="")
+        ok.append((p, dialogue_from_response(response["body"], req, latency)))
+    with metrics.span("validate"):
+        verdicts = list(pool.map(
+            validate_dialogue,
+            [d.text for _, d in ok],
+            [d.label_layout for _, d in ok],
+            [d.label_content for _, d in ok],
+            [int(d.max_words or 0) for _, d in ok],
+            [d.characters for _, d in ok],
+            chunksize=16,
+        ))
+    written = 0
+    for (p, res), reasons in sorted(zip(ok, verdicts), key=lambda x: x[0][0]["pos"]):
+        res.usage.topic_id = p["topic_id"]
+        res.usage.depth = p["depth"]
+        if reasons:
+            res.usage.status = "invalid"
+            if ledger is not None:
+                ledger.append(res.usage)
+            for reason in reasons:
+                metrics.inc("dataset_invalid_outputs_total", reason=reason.split(" ", 1)[0])
+            print(
+                f"[invalid_output] id={p['topic_id']} topic={p['request']['topic']} attempt={attempt} reason={'; '.join(reasons)}",
+                file=sys.stderr,
+                flush=True,
+            )
+            failed.append((p["pos"], p["topic_id"]))
+            continue
+        data_id = secrets.token_hex(4)
+        obj = res.row(data_id, p["request"]["topic"])
+        with metrics.span("write_row"):
+            out_file.write(json.dumps(obj, ensure_ascii=False) + "\n")
+        metrics.inc("dataset_rows_written_total")
+        res.usage.status = "ok"
+        res.usage.row_id = data_id
+        if ledger is not None:
+            ledger.append(res.usage)
+        written += 1
+    out_file.flush()
+    return written, sorted(failed)
+
+
+def run_batch(
+    csv_path: str = "data/topics.csv",
+    order_path: str = "data/topics.order.json",
+    output_path: str = "data/dataset.jsonl",
+    state_path: str = "data/dataset.state.json",
+    batch_dir: str = "data/batches",
+    batch_items: int = 1000,
+    backend: str = "openai",
+    poll_interval: float = 60.0,
+    max_attempts: int = 3,
+    usage_path: Optional[str] = USAGE_PATH,
+    validate_workers: Optional[int] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> Dict[str, Any]:
+    from dataset.build_dataset import ensure_order, load_cursor, load_topic_lookup, save_cursor
+
+    ensure_order(csv_path, order_path)
+    cursor = load_cursor(state_path)
+    with open_order(order_path) as order:
+        total = len(order)
+        start = cursor if start is None else max(0, int(start))
+        end = min(total, start + batch_items) if end is None else min(total, int(end))
+        ids = order.read(start, end)
+    job_dir = os.path.join(batch_dir, f"{start:09d}-{end:09d}")
+    job_path = os.path.join(job_dir, "job.json")
+    os.makedirs(job_dir, exist_ok=True)
+    if os.path.exists(job_path):
+        with open(job_path, "r", encoding="utf-8") as f:
+            job = json.load(f)
+    else:
+        job = {"order": order_path, "start": start, "end": end, "backend": backend, "rounds": [], "written": 0, "done": False}
+        _write_json(job_path, job)
+    if job["done"] or start >= end:
+        return job
+
+    topic_lookup = load_topic_lookup(csv_path)
+    client = get_backend(backend, batch_dir)
+    ledger = Ledger(usage_path) if usage_path else None
+    pending: List[Item] = [(pos, rid) for pos, rid in enumerate(ids, start=start)]
+    if job["rounds"]:
+        last = job["rounds"][-1]
+        pending = [tuple(x) for x in last.get("failed", [])] if last["ingested"] else []
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    pool = ProcessPoolExecutor(max_workers=validate_workers or min(4, os.cpu_count() or 1))
+    try:
+        with open(output_path, "a", encoding="utf-8") as out_file:
+            while True:
+                if not job["rounds"] or job["rounds"][-1]["ingested"]:
+                    attempt = len(job["rounds"]) + 1
+                    if not pending or attempt > max_attempts:
+                        break
+                    if attempt > 1:
+                        metrics.inc("dataset_requeued_total", len(pending))
+                    job["rounds"].append(prepare_round(job_dir, attempt, pending, topic_lookup))
+                    _write_json(job_path, job)
+                rnd = job["rounds"][-1]
+                if not rnd["items"]:
+                    rnd.update({"status": "completed", "ingested": True, "written": 0, "failed": []})
+                    _write_json(job_path, job)
+                    pending = []
+                    continue
+                if not rnd["batch_id"]:
+                    rnd["input_file_id"] = client.upload(os.path.join(job_dir, rnd["requests"]))
+                    rnd["batch_id"] = client.create(
+                        rnd["input_file_id"],
+                        metadata={"order": os.path.basename(order_path), "range": f"{start}-{end}", "attempt": str(rnd["attempt"])},
+                    )
+                    rnd["status"] = "submitted"
+                    _write_json(job_path, job)
+                metrics.set_gauge("dataset_batch_items", rnd["items"])
+                info = poll(client, rnd["batch_id"], poll_interval)
+                rnd["status"] = info.get("status")
+                marks = rnd.get("offsets")
+                if marks is None:
+                    out_file.flush()
+                    rnd["offsets"] = {"output": _size(output_path), "ledger": _size(usage_path)}
+                    _write_json(job_path, job)
+                else:
+                    # An earlier run stopped mid-ingest: drop its partial rows and usage before redoing the round.
+                    _rewind(output_path, int(marks["output"]))
+                    _rewind(usage_path, int(marks["ledger"]))
+                written, pending = ingest_round(job_dir, rnd, info, client, out_file, pool, ledger)
+                rnd.update({"ingested": True, "written": written, "failed": pending})
+                job["written"] += written
+                _write_json(job_path, job)
+        if pending:
+            metrics.inc("dataset_rejected_total", len(pending))
+        job["done"] = True
+        _write_json(job_path, job)
+        if load_cursor(state_path) >= start:
+            save_cursor(state_path, max(end, load_cursor(state_path)))
+    finally:
+        pool.shutdown()
+    return job
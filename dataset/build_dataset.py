@@ -4,24 +4,44 @@ import os
 import secrets
 import tempfile
 import sys
+import argparse
 import asyncio
-from dataset.dialogue_engine import generate_dialogue
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable
+from dataset.make_topics_order import open_order
+from dataset.validation import validate_dialogue
+from telemetry import metrics, profiling
+from telemetry.usage import Ledger
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+USAGE_PATH = os.path.join(ROOT_DIR, "data", "usage.jsonl")
 
 
 def generate_text(topic: str) -> str:
     return ""
 
 
-def load_order_ids(order_path: str) -> list[str]:
-    with open(order_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    ids = data.get("ids", [])
-    return [x for x in ids if isinstance(x, str) and x]
+async def generate_dialogue(topic: str, path: str):
+    from dataset.dialogue_engine import generate_dialogue as llm_generate_dialogue
+
+    return await llm_generate_dialogue(topic, path)
+
+
+async def generate_dialogues(topic: str, path: str, n: int):
+    from dataset.dialogue_engine import generate_dialogues as llm_generate_dialogues
+
+    return await llm_generate_dialogues(topic, path, n)
+
+
+async def generate_dialogue_stream(topic: str, path: str):
+    from dataset.dialogue_engine import generate_dialogue_stream as llm_generate_dialogue_stream
+
+    return await llm_generate_dialogue_stream(topic, path)
 
 
 def load_topic_lookup(csv_path: str) -> dict[str, dict[str, str]]:
     lookup: dict[str, dict[str, str]] = {}
-    with open(csv_path, "r", encoding="utf-8") as f:
+    with metrics.span("load_topic_lookup"), open(csv_path, "r", encoding="utf-8") as f:
         reader = csv.DictReader(f)
         for row in reader:
             rid = row.get("id")
@@ -34,7 +54,7 @@ def load_topic_lookup(csv_path: str) -> dict[str, dict[str, str]]:
             except ValueError:
                 continue
             if d >= 4:
-                lookup[rid] = {"topic": topic, "path": path or ""}
+                lookup[rid] = {"topic": topic, "path": path or "", "depth": str(d)}
     return lookup
 
 
@@ -54,7 +74,7 @@ def save_cursor(state_path: str, cursor: int) -> None:
     state_dir = os.path.dirname(state_path)
     os.makedirs(state_dir, exist_ok=True)
     payload = {"cursor": cursor}
-    with tempfile.NamedTemporaryFile("w", delete=False, dir=state_dir, prefix=".tmp_state_", suffix=".json", encoding="utf-8") as tmp:
+    with metrics.span("save_cursor"), tempfile.NamedTemporaryFile("w", delete=False, dir=state_dir, prefix=".tmp_state_", suffix=".json", encoding="utf-8") as tmp:
         json.dump(payload, tmp, ensure_ascii=False)
         tmp_path = tmp.name
     os.replace(tmp_path, state_path)
@@ -73,51 +93,129 @@ def ensure_order(csv_path: str, order_path: str) -> None:
         )
 
 
-def build_dataset(
+async def build_dataset_async(
     csv_path: str = "data/topics.csv",
     order_path: str = "data/topics.order.json",
     output_path: str = "data/dataset.jsonl",
     state_path: str = "data/dataset.state.json",
     workers: int = 8,
     batch_size: int | None = None,
+    usage_path: str | None = USAGE_PATH,
+    max_attempts: int = 3,
+    validate_workers: int | None = None,
+    stream: bool = False,
+    variants: int = 1,
+    topic_lookup: dict[str, dict[str, str]] | None = None,
+    follow: Callable[[int], Awaitable[int]] | None = None,
+    slots: Any = None,
+    charge: Callable[[Any], None] | None = None,
 ) -> None:
-    ensure_order(csv_path, order_path)
-    ids = load_order_ids(order_path)
-    topic_lookup = load_topic_lookup(csv_path)
+    if stream and variants > 1:
+        raise ValueError("Streaming does not support more than one variant per request")
+    if topic_lookup is None:
+        ensure_order(csv_path, order_path)
+        topic_lookup = load_topic_lookup(csv_path)
+    order = open_order(order_path)
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     cursor = load_cursor(state_path)
-    total = len(ids)
-    if cursor >= total:
+    total = len(order)
+    if cursor >= total and follow is None:
+        order.close()
         return
     if batch_size is None:
         batch_size = max(1, workers * 2)
+    ledger = Ledger(usage_path) if usage_path else None
+
+    def log_usage(res, rid: str, rec: dict[str, str], status: str, row_id: str | None = None) -> None:
+        usage = getattr(res, "usage", None)
+        if charge is not None and usage is not None:
+            charge(usage)
+        if ledger is None or usage is None:
+            return
+        usage.topic_id = rid
+        usage.depth = int(rec.get("depth", "0") or 0)
+        usage.status = status
+        usage.row_id = row_id
+        ledger.append(usage)
+
+    async def validate(res) -> list[str]:
+        loop = asyncio.get_running_loop()
+        with metrics.span("validate"):
+            return await loop.run_in_executor(
+                pool,
+                validate_dialogue,
+                getattr(res, "text", None),
+                getattr(res, "label_layout", "inline"),
+                getattr(res, "label_content", "name_normal"),
+                int(getattr(res, "max_words", 0) or 0),
+                getattr(res, "characters", ""),
+            )
+
+    pool = ProcessPoolExecutor(max_workers=validate_workers or min(4, os.cpu_count() or 1))
 
     async def process() -> None:
-        nonlocal cursor
+        nonlocal cursor, total
         try:
             with open(output_path, "a", encoding="utf-8") as out_file:
                 i = cursor
-                while i < total:
+                while True:
+                    if follow is not None:
+                        total = min(await follow(i), order.refresh())
+                    if i >= total:
+                        break
                     end = min(i + batch_size, total)
                     meta: list[tuple[int, str, dict[str, str] | None]] = []
                     tasks: list[asyncio.Task] = []
-                    sem = asyncio.Semaphore(workers)
+                    sem = slots if slots is not None else asyncio.Semaphore(workers)
+
+                    async def generate(topic_value: str, path_value: str) -> list:
+                        if stream:
+                            return [await generate_dialogue_stream(topic_value, path_value)]
+                        if variants > 1:
+                            return await generate_dialogues(topic_value, path_value, variants)
+                        return [await generate_dialogue(topic_value, path_value)]
 
-                    async def run_one(topic_value: str, path_value: str):
-                        async with sem:
-                            return await generate_dialogue(topic_value, path_value)
+                    async def check(res) -> list[str]:
+                        aborted = getattr(res, "aborted", None)
+                        return [aborted] if aborted else await validate(res)
+
+                    def status_of(res) -> str:
+                        return "aborted" if getattr(res, "aborted", None) else "invalid"
+
+                    async def run_one(rid: str, rec: dict[str, str]):
+                        topic_value = rec["topic"]
+                        path_value = rec.get("path", "")
+                        for attempt in range(1, max_attempts + 1):
+                            async with sem:
+                                outputs = await generate(topic_value, path_value)
+                            checked = list(zip(outputs, await asyncio.gather(*(check(res) for res in outputs))))
+                            for res, reasons in checked:
+                                if not reasons:
+                                    continue
+                                for reason in reasons:
+                                    metrics.inc("dataset_invalid_outputs_total", reason=reason.split(" ", 1)[0])
+                                print(
+                                    f"[{status_of(res)}_output] id={rid} topic={topic_value} attempt={attempt} variant={getattr(res, 'variant', 0)} reason={'; '.join(reasons)}",
+                                    file=sys.stderr,
+                                    flush=True,
+                                )
+                            if attempt == max_attempts or any(not reasons for _, reasons in checked):
+                                return checked
+                            for res, _ in checked:
+                                log_usage(res, rid, rec, status_of(res))
+                            metrics.inc("dataset_requeued_total")
+                        return []
 
-                    for j in range(i, end):
-                        rid = ids[j]
+                    for j, rid in enumerate(order.read(i, end), start=i):
                         rec = topic_lookup.get(rid)
                         if not rec:
                             meta.append((j, rid, None))
                             continue
                         meta.append((j, rid, rec))
-                        topic_value = rec["topic"]
-                        path_value = rec.get("path", "")
-                        tasks.append(asyncio.create_task(run_one(topic_value, path_value)))
+                        tasks.append(asyncio.create_task(run_one(rid, rec)))
 
+                    metrics.set_gauge("dataset_queue_depth", len(tasks))
+                    metrics.set_gauge("dataset_cursor", i)
                     results = await asyncio.gather(*tasks, return_exceptions=True) if tasks else []
 
                     k = 0
@@ -136,40 +234,91 @@ def build_dataset(
                             )
                             continue
                         if isinstance(res, Exception):
+                            metrics.inc("dataset_generation_errors_total", error=type(res).__name__)
                             print(
                                 f"[generation_error] id={rid} topic={topic_value} type={type(res).__name__} message={res}",
                                 file=sys.stderr,
                                 flush=True,
                             )
                             continue
-                        if not isinstance(res, str) or res is None:
-                            print(
-                                f"[invalid_output] id={rid} topic={topic_value} reason=non_string_or_none",
-                                file=sys.stderr,
-                                flush=True,
-                            )
-                            continue
-                        words = [w for w in res.strip().split() if w]
-                        if len(words) < 50:
-                            print(
-                                f"[invalid_output] id={rid} topic={topic_value} reason=too_short word_count={len(words)}",
-                                file=sys.stderr,
-                                flush=True,
-                            )
-                            continue
-                        data_id = secrets.token_hex(4)
-                        obj = {"id": data_id, "topic": topic_value, "text": res}
-                        out_file.write(json.dumps(obj, ensure_ascii=False) + "\n")
-                        out_file.flush()
+                        if all(reasons for _, reasons in res):
+                            metrics.inc("dataset_rejected_total")
+                        for output, reasons in res:
+                            if reasons:
+                                log_usage(output, rid, rec, status_of(output))
+                                continue
+                            data_id = secrets.token_hex(4)
+                            obj = output.row(data_id, topic_value)
+                            with metrics.span("write_row"):
+                                out_file.write(json.dumps(obj, ensure_ascii=False) + "\n")
+                                out_file.flush()
+                            metrics.inc("dataset_rows_written_total")
+                            log_usage(output, rid, rec, "ok", data_id)
 
                     save_cursor(state_path, end)
                     i = end
         except KeyboardInterrupt:
             save_cursor(state_path, i if 'i' in locals() else cursor)
             raise
+        finally:
+            order.close()
+            pool.shutdown()
 
-    asyncio.run(process())
+    await process()
+
+
+def build_dataset(*args, **kwargs) -> None:
+    asyncio.run(build_dataset_async(*args, **kwargs))
 
 
 if __name__ == "__main__":
-    build_dataset()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", default="data/topics.csv")
+    parser.add_argument("--order", default="data/topics.order.json", help="*.json (legacy list) or fixed-width *.ids from make_topics_order")
+    parser.add_argument("--out", default="data/dataset.jsonl")
+    parser.add_argument("--state", default="data/dataset.state.json")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--max-attempts", type=int, default=3, help="generations per topic before an invalid item is dropped")
+    parser.add_argument("--validate-workers", type=int, default=None)
+    parser.add_argument("--variants", type=int, default=1, help="completions per request (n); each valid choice becomes its own row")
+    parser.add_argument("--stream", action="store_true", help="stream completions and abort/regenerate as soon as the output is clearly invalid or over length")
+    parser.add_argument("--batch", action="store_true", help="submit the next order range through the provider's Batch API instead of live requests")
+    parser.add_argument("--batch-dir", default="data/batches")
+    parser.add_argument("--batch-items", type=int, default=1000, help="order positions per batch job, starting at the saved cursor")
+    parser.add_argument("--batch-backend", choices=("openai", "local"), default="openai", help="local = file-based stand-in under <batch-dir>/local")
+    parser.add_argument("--poll-interval", type=float, default=60.0)
+    parser.add_argument("--usage-ledger", default=USAGE_PATH, help="append per-request token usage here; empty to disable")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure_from_env()
+    profiling.configure_from_args(args)
+    if args.batch:
+        from dataset.batch import run_batch
+
+        job = run_batch(
+            args.csv,
+            args.order,
+            args.out,
+            args.state,
+            batch_dir=args.batch_dir,
+            batch_items=args.batch_items,
+            backend=args.batch_backend,
+            poll_interval=args.poll_interval,
+            max_attempts=args.max_attempts,
+            usage_path=args.usage_ledger or None,
+            validate_workers=args.validate_workers,
+        )
+        print(json.dumps({k: job[k] for k in ("start", "end", "written", "done")}))
+        sys.exit(0)
+    build_dataset(
+        args.csv,
+        args.order,
+        args.out,
+        args.state,
+        workers=args.workers,
+        usage_path=args.usage_ledger or None,
+        max_attempts=args.max_attempts,
+        validate_workers=args.validate_workers,
+        stream=args.stream,
+        variants=args.variants,
+    )
\ No newline at end of file
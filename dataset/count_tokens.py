@@ -31,7 +31,11 @@ def get_tokenizer(model: str):
     try:
         return tiktoken.encoding_for_model(model)
     except Exception:
+        pass
+    try:
         return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
 
 
 def count_tokens_in_texts(texts: Iterable[str], tokenizer) -> int:
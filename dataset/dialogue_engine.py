@@ -1,42 +1,135 @@
 import os
+import time
+from dataclasses import dataclass, replace
 from random import choice
 from functools import lru_cache
-from openai import AsyncOpenAI
-from dotenv import load_dotenv
-from .population_builder import build_population
-from .prompts import build_messages
+from typing import TYPE_CHECKING, List, Optional
+from .prompts import LABEL_CONTENTS, LABEL_LAYOUTS, build_messages
+from .validation import StreamChecker
+from telemetry import metrics
+from telemetry.usage import UsageRecord, usage_from_response
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from providers.pool import Endpoint, EndpointPool
+    from .population_builder import PopulationPool
 
 
 root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 dotenv_path = os.path.join(root_dir, ".env")
-load_dotenv(dotenv_path=dotenv_path, override=False)
 
 
 @lru_cache(maxsize=1)
-def get_async_client() -> AsyncOpenAI:
-    api_key = os.getenv("OPENAI_API_KEY")
-    base_url = os.getenv("OPENAI_BASE_URL")
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY is not set")
-    return AsyncOpenAI(api_key=api_key, base_url=base_url) if base_url else AsyncOpenAI(api_key=api_key)
-
-
-async def generate_dialogue(topic: str, path: str):
-    sizes = [100, 200, 300, 400, 500]
-    max_words = choice(sizes)
-    characters = build_population()
-    label_layouts = ["inline", "script", "none"]
-    label_contents = [
-        "name_normal",
-        "generic_tagged_letter",
-        "generic_tagged_number",
-        "generic_letter",
-        "generic_number",
-        "role",
-    ]
-    label_layout = choice(label_layouts)
-    label_content = choice(label_contents)
-    client = get_async_client()
+def load_env() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv(dotenv_path=dotenv_path, override=False)
+
+
+@dataclass
+class Dialogue:
+    text: str
+    model: str
+    label_layout: str
+    label_content: str
+    max_words: int
+    characters: str
+    usage: UsageRecord
+    aborted: Optional[str] = None
+    variant: int = 0
+
+    def row(self, data_id: str, topic: str) -> dict:
+        return {
+            "id": data_id,
+            "topic": topic,
+            "text": self.text,
+            "variant": self.variant,
+            "label_layout": self.label_layout,
+            "label_content": self.label_content,
+        }
+
+
+@lru_cache(maxsize=1)
+def get_population_pool() -> "PopulationPool":
+    from .population_builder import PopulationPool, PopulationSampler
+
+    load_env()
+    seed = os.getenv("POPULATION_SEED", "").strip()
+    return PopulationPool(PopulationSampler(seed=int(seed) if seed else None))
+
+
+def make_async_client(endpoint: "Endpoint") -> "AsyncOpenAI":
+    from openai import AsyncOpenAI
+
+    kwargs: dict = {"api_key": endpoint.api_key}
+    if endpoint.base_url:
+        kwargs["base_url"] = endpoint.base_url
+    if endpoint.max_retries is not None:
+        kwargs["max_retries"] = endpoint.max_retries
+    return AsyncOpenAI(**kwargs)
+
+
+def get_pool() -> "EndpointPool":
+    from providers.pool import get_pool as get_endpoint_pool
+
+    load_env()
+    return get_endpoint_pool()
+
+
+def get_async_client(endpoint: Optional["Endpoint"] = None) -> "AsyncOpenAI":
+    if endpoint is None:
+        endpoint = get_pool().endpoints[0]
+    return endpoint.client("async", make_async_client)
+
+
+DIALOGUE_MODEL = "perplexity/sonar-reasoning"
+MAX_WORDS_CHOICES = (100, 200, 300, 400, 500)
+
+
+@dataclass
+class DialogueRequest:
+    topic: str
+    path: str
+    model: str
+    max_words: int
+    characters: str
+    label_layout: str
+    label_content: str
+    system: str
+    user: str
+
+    def body(self, n: int = 1) -> dict:
+        body = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system},
+                {"role": "user", "content": self.user},
+            ],
+            "temperature": 0.8,
+            "max_tokens": min(2000, self.max_words * 2),
+            "reasoning_effort": "medium",
+        }
+        if n > 1:
+            body["n"] = n
+        return body
+
+    def params(self) -> dict:
+        return {
+            "topic": self.topic,
+            "path": self.path,
+            "model": self.model,
+            "max_words": self.max_words,
+            "characters": self.characters,
+            "label_layout": self.label_layout,
+            "label_content": self.label_content,
+        }
+
+
+def sample_request(topic: str, path: str) -> DialogueRequest:
+    max_words = choice(MAX_WORDS_CHOICES)
+    characters = get_population_pool().take()
+    label_layout = choice(LABEL_LAYOUTS)
+    label_content = choice(LABEL_CONTENTS)
     system_msg, user_msg = build_messages(
         topic=topic,
         topic_path=path or "N/A",
@@ -45,15 +138,167 @@ async def generate_dialogue(topic: str, path: str):
         label_layout=label_layout,
         label_content=label_content,
     )
-    resp = await client.chat.completions.create(
-        model="perplexity/sonar-reasoning",
-        messages=[
-            {"role": "system", "content": system_msg},
-            {"role": "user", "content": user_msg},
-        ],
-        temperature=0.8,
-        max_tokens=min(2000, max_words * 2),
-        reasoning_effort='medium'
+    return DialogueRequest(
+        topic=topic,
+        path=path,
+        model=DIALOGUE_MODEL,
+        max_words=max_words,
+        characters=characters,
+        label_layout=label_layout,
+        label_content=label_content,
+        system=system_msg,
+        user=user_msg,
+    )
+
+
+def count_usage(usage: UsageRecord) -> None:
+    metrics.inc("llm_requests_total", stage="dataset", model=usage.model)
+    metrics.inc("llm_tokens_total", usage.total_tokens, stage="dataset", model=usage.model)
+    metrics.inc("llm_cached_tokens_total", usage.cached_tokens, stage="dataset", model=usage.model)
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4) if text else 0
+
+
+def split_usage(usage: UsageRecord, texts: List[str]) -> List[UsageRecord]:
+    if len(texts) <= 1:
+        return [usage]
+    weights = [estimate_tokens(t) or 1 for t in texts]
+    total = sum(weights)
+    records: List[UsageRecord] = []
+    given = [0, 0]
+    for i, w in enumerate(weights):
+        last = i == len(weights) - 1
+        completion = usage.completion_tokens - given[0] if last else usage.completion_tokens * w // total
+        reasoning = usage.reasoning_tokens - given[1] if last else usage.reasoning_tokens * w // total
+        given[0] += completion
+        given[1] += reasoning
+        records.append(replace(
+            usage,
+            prompt_tokens=usage.prompt_tokens if i == 0 else 0,
+            cached_tokens=usage.cached_tokens if i == 0 else 0,
+            completion_tokens=completion,
+            reasoning_tokens=reasoning,
+            variant=i,
+        ))
+    return records
+
+
+def dialogues_from_response(resp, req: DialogueRequest, latency: float, endpoint: Optional[str] = None) -> List[Dialogue]:
+    usage = usage_from_response(
+        resp,
+        stage="dataset",
+        model=req.model,
+        latency=latency,
+        label_layout=req.label_layout,
+        label_content=req.label_content,
+        max_words=req.max_words,
+        endpoint=endpoint,
+    )
+    count_usage(usage)
+    choices = resp["choices"] if isinstance(resp, dict) else resp.choices
+    texts: List[str] = []
+    for c in choices:
+        message = c["message"] if isinstance(c, dict) else c.message
+        content = message.get("content") if isinstance(message, dict) else message.content
+        texts.append((content or "").strip())
+    return [
+        Dialogue(
+            text=text,
+            model=usage.model,
+            label_layout=req.label_layout,
+            label_content=req.label_content,
+            max_words=req.max_words,
+            characters=req.characters,
+            usage=part,
+            variant=i,
+        )
+        for i, (text, part) in enumerate(zip(texts, split_usage(usage, texts)))
+    ]
+
+
+def dialogue_from_response(resp, req: DialogueRequest, latency: float) -> Dialogue:
+    return dialogues_from_response(resp, req, latency)[0]
+
+
+async def generate_dialogues(topic: str, path: str, n: int = 1) -> List[Dialogue]:
+    req = sample_request(topic, path)
+
+    async def attempt(endpoint: "Endpoint") -> List[Dialogue]:
+        t0 = time.perf_counter()
+        resp = await get_async_client(endpoint).chat.completions.create(**req.body(n))
+        return dialogues_from_response(resp, req, time.perf_counter() - t0, endpoint.name)
+
+    with metrics.span("generate_dialogue", model=req.model, label_layout=req.label_layout):
+        return await get_pool().acall(attempt, req.model)
+
+
+async def generate_dialogue(topic: str, path: str) -> Dialogue:
+    return (await generate_dialogues(topic, path, 1))[0]
+
+
+async def generate_dialogue_stream(topic: str, path: str) -> Dialogue:
+    req = sample_request(topic, path)
+    with metrics.span("generate_dialogue", model=req.model, label_layout=req.label_layout):
+        return await get_pool().acall(lambda endpoint: stream_dialogue(req, endpoint), req.model)
+
+
+async def stream_dialogue(req: DialogueRequest, endpoint: "Endpoint") -> Dialogue:
+    client = get_async_client(endpoint)
+    checker = StreamChecker(req.label_layout, req.label_content, req.max_words, req.characters)
+    parts: list = []
+    reason: Optional[str] = None
+    resp_usage = None
+    model = req.model
+    chunks = 0
+    t0 = time.perf_counter()
+    stream = await client.chat.completions.create(**req.body(), stream=True, stream_options={"include_usage": True})
+    try:
+        async for chunk in stream:
+            model = getattr(chunk, "model", None) or model
+            if getattr(chunk, "usage", None) is not None:
+                resp_usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            if not delta:
+                continue
+            chunks += 1
+            parts.append(delta)
+            reason = checker.feed(delta)
+            if reason:
+                break
+    finally:
+        await stream.close()
+    latency = time.perf_counter() - t0
+    text = "".join(parts)
+    if resp_usage is None:
+        resp_usage = {
+            "prompt_tokens": estimate_tokens(req.system) + estimate_tokens(req.user),
+            "completion_tokens": max(chunks, estimate_tokens(text)),
+        }
+    usage = usage_from_response(
+        {"model": model, "usage": resp_usage},
+        stage="dataset",
+        model=req.model,
+        latency=latency,
+        label_layout=req.label_layout,
+        label_content=req.label_content,
+        max_words=req.max_words,
+        endpoint=endpoint.name,
+    )
+    count_usage(usage)
+    if reason:
+        metrics.inc("dataset_stream_aborts_total", reason=reason.split(" ", 1)[0])
+        metrics.inc("dataset_stream_aborted_tokens_total", usage.completion_tokens)
+    return Dialogue(
+        text=text.strip(),
+        model=usage.model,
+        label_layout=req.label_layout,
+        label_content=req.label_content,
+        max_words=req.max_words,
+        characters=req.characters,
+        usage=usage,
+        aborted=reason,
     )
-    content = resp.choices[0].message.content.strip()
-    return content
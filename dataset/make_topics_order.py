@@ -1,13 +1,30 @@
+import argparse
 import csv
 import json
 import os
 import random
 import secrets
-from typing import List
+import tempfile
+from collections import deque
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+
+ORDER_SUFFIX = ".ids"
+META_SUFFIX = ".meta.json"
+STRATEGIES = ("stratified", "uniform")
+
+Stratum = Tuple[str, int]
 
 
 def load_eligible_ids(csv_path: str, min_depth: int) -> List[str]:
     ids: List[str] = []
+    for stratum_ids in load_strata(csv_path, min_depth).values():
+        ids.extend(stratum_ids)
+    return ids
+
+
+def load_strata(csv_path: str, min_depth: int) -> Dict[Stratum, List[str]]:
+    strata: Dict[Stratum, List[str]] = {}
     with open(csv_path, "r", encoding="utf-8") as f:
         reader = csv.DictReader(f)
         for row in reader:
@@ -15,37 +32,283 @@ def load_eligible_ids(csv_path: str, min_depth: int) -> List[str]:
                 d = int(row.get("depth", "0"))
             except ValueError:
                 continue
-            if d >= min_depth:
-                rid = row.get("id")
-                if isinstance(rid, str) and rid:
-                    ids.append(rid)
-    return ids
+            if d < min_depth:
+                continue
+            rid = row.get("id")
+            if not isinstance(rid, str) or not rid:
+                continue
+            domain = (row.get("path") or "").split(" > ", 1)[0]
+            strata.setdefault((domain, d), []).append(rid)
+    return strata
+
+
+def stratified_order(strata: Dict[Stratum, List[str]], seed_int: int) -> Iterator[str]:
+    rng = random.Random(seed_int)
+    domains: Dict[str, deque] = {}
+    for domain, depth in sorted(strata):
+        ids = list(strata[(domain, depth)])
+        rng.shuffle(ids)
+        domains.setdefault(domain, deque()).append(iter(ids))
+    active = sorted(domains)
+    while active:
+        rng.shuffle(active)
+        exhausted: List[str] = []
+        for domain in active:
+            depths = domains[domain]
+            while depths:
+                it = depths.popleft()
+                rid = next(it, None)
+                if rid is None:
+                    continue
+                depths.append(it)
+                yield rid
+                break
+            if not depths:
+                exhausted.append(domain)
+        for domain in exhausted:
+            active.remove(domain)
+
+
+def uniform_order(strata: Dict[Stratum, List[str]], seed_int: int) -> Iterator[str]:
+    ids = [rid for key in sorted(strata) for rid in strata[key]]
+    random.Random(seed_int).shuffle(ids)
+    return iter(ids)
 
 
 essential_fields = ["seed", "min_depth", "ids"]
 
 
-def shuffle_and_save(ids: List[str], output_path: str, seed_int: int, min_depth: int) -> None:
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    rng = random.Random(seed_int)
-    rng.shuffle(ids)
-    data = {"seed": format(seed_int, "016x"), "min_depth": int(min_depth), "ids": ids}
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False)
+def meta_path_for(order_path: str) -> str:
+    return order_path + META_SUFFIX
+
+
+def write_meta(order_path: str, meta: Dict[str, Any]) -> None:
+    meta_path = meta_path_for(order_path)
+    out_dir = os.path.dirname(meta_path) or "."
+    with tempfile.NamedTemporaryFile("w", delete=False, dir=out_dir, prefix=".tmp_order_", suffix=".json", encoding="utf-8") as tmp:
+        json.dump(meta, tmp, ensure_ascii=False, indent=2)
+        tmp_path = tmp.name
+    os.replace(tmp_path, meta_path)
+
+
+def write_fixed_width(ids: Iterator[str], output_path: str, width: int) -> int:
+    out_dir = os.path.dirname(output_path) or "."
+    os.makedirs(out_dir, exist_ok=True)
+    count = 0
+    with tempfile.NamedTemporaryFile("wb", delete=False, dir=out_dir, prefix=".tmp_order_", suffix=ORDER_SUFFIX) as tmp:
+        for rid in ids:
+            tmp.write(rid.ljust(width).encode("ascii") + b"\n")
+            count += 1
+        tmp_path = tmp.name
+    os.replace(tmp_path, output_path)
+    return count
+
+
+def truncate_records(order_path: str, width: int) -> int:
+    size = os.path.getsize(order_path) if os.path.exists(order_path) else 0
+    keep = size - size % (width + 1)
+    if keep < size:
+        os.truncate(order_path, keep)
+    return keep // (width + 1)
+
+
+def append_fixed_width(order_path: str, ids: List[str], width: int) -> int:
+    for rid in ids:
+        if len(rid) > width:
+            raise ValueError(f"Id {rid!r} is wider than the order's fixed width {width}")
+    start = truncate_records(order_path, width)
+    with open(order_path, "ab") as f:
+        f.write(b"".join(rid.ljust(width).encode("ascii") + b"\n" for rid in ids))
+        f.flush()
+        os.fsync(f.fileno())
+    return start
+
+
+def save_order(
+    strata: Dict[Stratum, List[str]],
+    output_path: str,
+    seed_int: int,
+    min_depth: int,
+    strategy: str = "stratified",
+) -> int:
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown ordering strategy: {strategy}")
+    order = stratified_order(strata, seed_int) if strategy == "stratified" else uniform_order(strata, seed_int)
+    meta = {
+        "seed": format(seed_int, "016x"),
+        "min_depth": int(min_depth),
+        "strategy": strategy,
+        "strata": {f"{domain}|{depth}": len(ids) for (domain, depth), ids in sorted(strata.items())},
+    }
+    if output_path.endswith(".json"):
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        meta["ids"] = list(order)
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        return len(meta["ids"])
+    width = max((len(rid) for ids in strata.values() for rid in ids), default=1)
+    count = write_fixed_width(order, output_path, width)
+    meta.update({"width": width, "count": count})
+    write_meta(output_path, meta)
+    return count
+
+
+class OrderReader:
+    def __init__(self, order_path: str) -> None:
+        self.path = order_path
+        self._ids: List[str] | None = None
+        self._file = None
+        if order_path.endswith(".json"):
+            with open(order_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._ids = [x for x in data.get("ids", []) if isinstance(x, str) and x]
+            self.width = 0
+            self.count = len(self._ids)
+            return
+        self._file = open(order_path, "rb")
+        meta_path = meta_path_for(order_path)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self.width = int(json.load(f)["width"])
+        else:
+            self.width = len(self._file.readline().rstrip(b"\n"))
+        self.count = os.fstat(self._file.fileno()).st_size // (self.width + 1)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def refresh(self) -> int:
+        if self._file is not None:
+            self.count = os.fstat(self._file.fileno()).st_size // (self.width + 1)
+        return self.count
+
+    def read(self, start: int, end: int) -> List[str]:
+        start = max(0, start)
+        end = min(end, self.count)
+        if start >= end:
+            return []
+        if self._ids is not None:
+            return self._ids[start:end]
+        record = self.width + 1
+        self._file.seek(start * record)
+        raw = self._file.read((end - start) * record)
+        return [raw[k : k + self.width].decode("ascii").strip() for k in range(0, len(raw), record)]
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "OrderReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def open_order(order_path: str) -> OrderReader:
+    return OrderReader(order_path)
+
+
+def read_meta(order_path: str) -> Dict[str, Any]:
+    if order_path.endswith(".json"):
+        with open(order_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        data.pop("ids", None)
+        return data
+    meta_path = meta_path_for(order_path)
+    if not os.path.exists(meta_path):
+        return {}
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_order_ids(order_path: str, block: int = 65536) -> Set[str]:
+    seen: Set[str] = set()
+    with open_order(order_path) as order:
+        for start in range(0, len(order), block):
+            seen.update(order.read(start, start + block))
+    return seen
+
+
+def append_order(
+    csv_path: str,
+    order_path: str,
+    min_depth: int | None = None,
+    seed: int | None = None,
+    strategy: str | None = None,
+) -> int:
+    meta = read_meta(order_path)
+    min_depth = int(meta.get("min_depth", 4)) if min_depth is None else int(min_depth)
+    strategy = strategy or meta.get("strategy", "stratified")
+    existing = read_order_ids(order_path)
+    strata: Dict[Stratum, List[str]] = {}
+    for key, ids in load_strata(csv_path, min_depth).items():
+        fresh = [rid for rid in ids if rid not in existing]
+        if fresh:
+            strata[key] = fresh
+    if not strata:
+        return 0
+    if seed is None:
+        base = int(str(meta.get("seed", "0")), 16) if meta.get("seed") else secrets.randbits(64)
+        seed = base ^ len(existing)
+    order = stratified_order(strata, seed) if strategy == "stratified" else uniform_order(strata, seed)
+    segment = {
+        "start": len(existing),
+        "seed": format(seed, "016x"),
+        "min_depth": min_depth,
+        "strata": {f"{domain}|{depth}": len(ids) for (domain, depth), ids in sorted(strata.items())},
+    }
+    if order_path.endswith(".json"):
+        with open(order_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        added = list(order)
+        data["ids"] = list(data.get("ids", [])) + added
+        data.setdefault("segments", []).append({**segment, "count": len(added)})
+        out_dir = os.path.dirname(order_path) or "."
+        with tempfile.NamedTemporaryFile("w", delete=False, dir=out_dir, prefix=".tmp_order_", suffix=".json", encoding="utf-8") as tmp:
+            json.dump(data, tmp, ensure_ascii=False)
+            tmp_path = tmp.name
+        os.replace(tmp_path, order_path)
+        return len(added)
+    with open_order(order_path) as reader:
+        width = reader.width
+    ids = list(order)
+    segment["start"] = append_fixed_width(order_path, ids, width)
+    added = len(ids)
+    meta.setdefault("width", width)
+    meta["count"] = segment["start"] + added
+    meta.setdefault("segments", []).append({**segment, "count": added})
+    write_meta(order_path, meta)
+    return added
 
 
 def main(
     csv_path: str = "data/topics.csv",
     order_path: str = "data/topics.order.json",
-    min_depth: int = 4,
+    min_depth: int | None = None,
     seed: int | None = None,
-) -> None:
+    strategy: str | None = None,
+    incremental: bool = False,
+) -> int:
     if os.path.exists(order_path):
-        return
-    ids = load_eligible_ids(csv_path, min_depth)
+        if not incremental:
+            return 0
+        return append_order(csv_path, order_path, min_depth=min_depth, seed=seed, strategy=strategy)
+    min_depth = 4 if min_depth is None else min_depth
+    strata = load_strata(csv_path, min_depth)
     seed_int = int(seed) if seed is not None else secrets.randbits(64)
-    shuffle_and_save(ids, order_path, seed_int, min_depth)
+    return save_order(strata, order_path, seed_int, min_depth, strategy or "stratified")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", default="data/topics.csv")
+    parser.add_argument("--out", default="data/topics.order.json", help="*.json for the legacy list (the build_dataset default), *.ids for fixed-width lines")
+    parser.add_argument("--min-depth", type=int, default=None, help="default: 4, or the existing order's min_depth with --incremental")
+    parser.add_argument("--seed", type=lambda s: int(s, 0), default=None)
+    parser.add_argument("--strategy", choices=STRATEGIES, default=None, help="default: stratified, or the existing order's strategy with --incremental")
+    parser.add_argument("--incremental", action="store_true", help="append eligible ids missing from an existing order instead of leaving it untouched")
+    args = parser.parse_args()
+    written = main(args.csv, args.out, args.min_depth, args.seed, args.strategy, args.incremental)
+    print(f"{args.out}: {'appended' if args.incremental else 'wrote'} {written} ids")
@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import sys
+import time
+from typing import Any
+
+from dataset.build_dataset import build_dataset_async
+from dataset.make_topics_order import open_order, read_meta, read_order_ids, truncate_records, write_meta
+from telemetry import metrics
+
+ONTOLOGY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ontology")
+if ONTOLOGY_DIR not in sys.path:
+    sys.path.insert(0, ONTOLOGY_DIR)
+
+import ontology_tree  # noqa: E402
+
+ONTOLOGY_PRIORITY = 0
+DATASET_PRIORITY = 1
+
+
+class RequestSlots:
+    def __init__(self, limit: int) -> None:
+        self.limit = max(1, int(limit))
+        self.used = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    async def acquire(self, priority: int = DATASET_PRIORITY) -> None:
+        if self.used < self.limit and not self._waiters:
+            self.used += 1
+            metrics.set_gauge("pipeline_slots_used", self.used)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.used -= 1
+        metrics.set_gauge("pipeline_slots_used", self.used)
+
+    async def __aenter__(self) -> "RequestSlots":
+        await self.acquire(DATASET_PRIORITY)
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        self.release()
+
+
+class FusedQueue:
+    def __init__(self, path: str, width: int, min_depth: int) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        meta = read_meta(path) if exists else {}
+        if "width" not in meta and exists:
+            with open_order(path) as order:
+                meta["width"] = order.width
+        self.width = int(meta.get("width", width))
+        self.min_depth = int(meta.get("min_depth", min_depth))
+        self.count = truncate_records(path, self.width) if exists else 0
+        self.ids = read_order_ids(path) if exists else set()
+        self._write_meta()
+        self._file = open(path, "ab")
+
+    def _write_meta(self) -> None:
+        write_meta(self.path, {"strategy": "fused", "min_depth": self.min_depth, "width": self.width, "count": self.count})
+
+    def push(self, rid: str) -> bool:
+        if rid in self.ids:
+            return False
+        if len(rid) > self.width:
+            raise ValueError(f"Id {rid!r} is wider than the order's fixed width {self.width}")
+        self._file.write(rid.ljust(self.width).encode("ascii") + b"\n")
+        self._file.flush()
+        self.ids.add(rid)
+        self.count += 1
+        return True
+
+    def close(self) -> None:
+        self._file.close()
+        self._write_meta()
+
+
+def topic_record(G: Any, nid: str, depth: int) -> dict[str, str]:
+    return {
+        "topic": str(G.nodes[nid].get("topic", "")),
+        "path": " > ".join(ontology_tree.hierarchy_of(G, nid)[1:]),
+        "depth": str(depth),
+    }
+
+
+async def run_pipeline(args: argparse.Namespace) -> dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    slots = RequestSlots(args.workers)
+
+    def gated_expand(topic: str, hierarchy: list[str], model: str | None, timeout: float | None = None) -> Any:
+        asyncio.run_coroutine_threadsafe(slots.acquire(ONTOLOGY_PRIORITY), loop).result()
+        try:
+            return ontology_tree.expand(topic, hierarchy, model, timeout)
+        finally:
+            loop.call_soon_threadsafe(slots.release)
+
+    scheduler, engine = ontology_tree.configure_builder(args, expand_fn=gated_expand, best_first=True)
+    G = ontology_tree.load_graph(args.csv)
+    ontology_tree.ensure_root(G)
+    width = max((len(str(n)) for n in G.nodes()), default=8)
+    queue = FusedQueue(args.order, max(8, width), args.min_depth)
+    lookup: dict[str, dict[str, str]] = {}
+    for nid, data in G.nodes(data=True):
+        depth = int(data.get("depth", 0) or 0)
+        if depth >= queue.min_depth:
+            lookup[str(nid)] = topic_record(G, str(nid), depth)
+    backfilled = 0
+    if args.backfill:
+        for nid in lookup:
+            backfilled += queue.push(nid)
+    started = time.perf_counter()
+    first_dialogue: list[float] = []
+
+    def enqueue(nid: str, data: dict[str, Any]) -> None:
+        depth = int(data.get("depth", 0) or 0)
+        if depth < queue.min_depth:
+            return
+        lookup[nid] = topic_record(G, nid, depth)
+        if queue.push(nid):
+            metrics.inc("pipeline_enqueued_total")
+            metrics.set_gauge("pipeline_queue_length", queue.count)
+
+    def charge(usage: Any) -> None:
+        if not first_dialogue:
+            first_dialogue.append(time.perf_counter() - started)
+        scheduler.charge(usage.total_tokens, calls=1 if not usage.variant else 0)
+
+    ontology = asyncio.ensure_future(
+        asyncio.to_thread(
+            ontology_tree.update_csv_tree,
+            args.csv,
+            max_nodes=args.max_nodes,
+            scheduler=scheduler,
+            engine=engine,
+            stats=True,
+            graph=G,
+            on_node=enqueue,
+        )
+    )
+    batch_size = max(1, args.workers * 2)
+
+    async def follow(i: int) -> int:
+        waited = loop.time()
+        while not ontology.done() and not scheduler.exhausted():
+            ready = queue.count - i
+            if ready >= batch_size or (ready > 0 and loop.time() - waited >= args.linger):
+                break
+            await asyncio.sleep(0.1)
+        if scheduler.exhausted():
+            return i
+        return queue.count
+
+    try:
+        await build_dataset_async(
+            order_path=args.order,
+            output_path=args.out,
+            state_path=args.state,
+            workers=args.workers,
+            batch_size=batch_size,
+            usage_path=args.usage_ledger or None,
+            max_attempts=args.max_attempts,
+            validate_workers=args.validate_workers,
+            stream=args.stream,
+            variants=args.variants,
+            topic_lookup=lookup,
+            follow=follow,
+            slots=slots,
+            charge=charge,
+        )
+        nodes = await ontology
+    finally:
+        if not ontology.done():
+            scheduler.max_calls = scheduler.calls
+            await asyncio.wait([ontology])
+        if engine is not None:
+            engine.close()
+        queue.close()
+    return {
+        "nodes": len(nodes),
+        "queued": queue.count,
+        "backfilled": backfilled,
+        "seconds": round(time.perf_counter() - started, 2),
+        "first_dialogue_seconds": round(first_dialogue[0], 2) if first_dialogue else None,
+        "scheduler": scheduler.stats(),
+        "expansion": engine.stats if engine is not None else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", default=ontology_tree.CSV_PATH, help="ontology graph handle; the graph itself is <csv>.pkl")
+    parser.add_argument("--max-nodes", type=int, default=ontology_tree.MAX_NODES)
+    parser.add_argument("--order", default="data/topics.fused.ids", help="append-only queue of eligible node ids, consumed like any other order")
+    parser.add_argument("--out", default="data/dataset.jsonl")
+    parser.add_argument("--state", default="data/dataset.state.fused.json")
+    parser.add_argument("--min-depth", type=int, default=4)
+    parser.add_argument("--backfill", action="store_true", help="also queue eligible nodes already in the graph")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent LLM requests shared by both stages")
+    parser.add_argument("--linger", type=float, default=2.0, help="seconds to wait for a full dataset batch before starting a partial one")
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--validate-workers", type=int, default=None)
+    parser.add_argument("--variants", type=int, default=1)
+    parser.add_argument("--stream", action="store_true")
+    ontology_tree.add_builder_arguments(parser)
+    args = parser.parse_args()
+    result = asyncio.run(run_pipeline(args))
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 import argparse
+from collections import deque
 from math import exp
 from random import choices
 from functools import lru_cache
+from typing import Deque, List, Optional, Sequence
+import numpy as np
 from faker import Faker
 from faker.config import AVAILABLE_LOCALES
 
@@ -37,10 +40,17 @@ english_locales = [l for l in AVAILABLE_LOCALES if l.startswith("en_")]
 if not english_locales:
     english_locales = ["en_US"]
 
+genders = ("male", "female")
+name_formats = ("first", "last", "full")
+population_sizes = (2, 3)
+population_size_weights = (0.8, 0.2)
+world_age_weights = (0.125, 0.205, 0.217, 0.137, 0.137, 0.113, 0.070, 0.035, 0.016, 0.005)
+neighbor_sigma = 1.0
+
 
 def build_population():
-    values = [2, 3]
-    weights = [0.8, 0.2]
+    values = list(population_sizes)
+    weights = list(population_size_weights)
     size = choices(values, weights=weights, k=1)[0]
     group_ids = assign_age_groups(size)
     if not isinstance(group_ids, list):
@@ -53,24 +63,13 @@ def build_population():
 
 def assign_age_groups(count: int):
     n = 10
-    world_weights = [
-        0.125,
-        0.205,
-        0.217,
-        0.137,
-        0.137,
-        0.113,
-        0.070,
-        0.035,
-        0.016,
-        0.005,
-    ]
+    world_weights = list(world_age_weights)
 
     first_idx = choices(range(n), weights=world_weights, k=1)[0]
     if count == 1:
         return first_idx
 
-    sigma = 1.0
+    sigma = neighbor_sigma
     neighbor_weights = [exp(-((i - first_idx) ** 2) / (2 * (sigma ** 2))) for i in range(n)]
     rest_idx = choices(range(n), weights=neighbor_weights, k=count - 1)
     return [first_idx, *rest_idx]
@@ -81,10 +80,10 @@ def get_faker(locale: str) -> Faker:
     return Faker(locale)
 
 
-def generate_name(gender: str) -> str:
-    locale = choices(english_locales, k=1)[0]
+def generate_name(gender: str, locale: Optional[str] = None, fmt: Optional[str] = None) -> str:
+    locale = locale or choices(english_locales, k=1)[0]
     fake = get_faker(locale)
-    fmt = choices(["first", "last", "full"], k=1)[0]
+    fmt = fmt or choices(list(name_formats), k=1)[0]
     if fmt == "first":
         if gender == "male" and hasattr(fake, "first_name_male"):
             return fake.first_name_male()
@@ -100,7 +99,87 @@ def generate_name(gender: str) -> str:
     return f"{fake.first_name()} {fake.last_name()}"
 
 
+def _cdf(weights: Sequence[float]) -> np.ndarray:
+    w = np.asarray(weights, dtype=np.float64)
+    c = np.cumsum(w / w.sum())
+    c[-1] = 1.0
+    return c
+
+
+def build_name_pools(locales: Sequence[str], per_pool: int, seed: Optional[int] = None) -> np.ndarray:
+    pools = np.empty((len(locales), len(genders), len(name_formats), per_pool), dtype=object)
+    for li, locale in enumerate(locales):
+        fake = get_faker(locale)
+        if seed is not None:
+            fake.seed_instance(seed + li)
+        for gi, sex in enumerate(genders):
+            for fi, fmt in enumerate(name_formats):
+                pools[li, gi, fi, :] = [generate_name(sex, locale, fmt) for _ in range(per_pool)]
+    return pools
+
+
+class PopulationSampler:
+    def __init__(self, seed: Optional[int] = None, names_per_pool: int = 256, locales: Optional[Sequence[str]] = None) -> None:
+        self.rng = np.random.default_rng(seed)
+        self.locales = list(locales or english_locales)
+        self.sizes = np.asarray(population_sizes)
+        self.size_cdf = _cdf(population_size_weights)
+        self.world_cdf = _cdf(world_age_weights)
+        n = len(world_age_weights)
+        idx = np.arange(n)
+        neighbor = np.exp(-((idx[None, :] - idx[:, None]) ** 2) / (2 * neighbor_sigma ** 2))
+        self.neighbor_cdf = np.vstack([_cdf(row) for row in neighbor])
+        self.age_labels = np.asarray([age_labels[sex] for sex in genders], dtype=object)
+        self.pools = build_name_pools(self.locales, names_per_pool, seed)
+
+    def sample(self, k: int) -> List[str]:
+        rng = self.rng
+        width = int(self.sizes.max())
+        sizes = self.sizes[np.searchsorted(self.size_cdf, rng.random(k), side="right")]
+        first = np.searchsorted(self.world_cdf, rng.random(k), side="right")
+        rows = self.neighbor_cdf[first]
+        u = rng.random((k, width - 1))
+        rest = (rows[:, None, :] <= u[:, :, None]).sum(axis=2)
+        groups = np.concatenate([first[:, None], rest], axis=1)
+        sex = rng.integers(0, len(genders), (k, width))
+        loc = rng.integers(0, len(self.locales), (k, width))
+        fmt = rng.integers(0, len(name_formats), (k, width))
+        pick = rng.integers(0, self.pools.shape[3], (k, width))
+        names = self.pools[loc, sex, fmt, pick]
+        labels = self.age_labels[sex, groups]
+        out: List[str] = []
+        for r in range(k):
+            n = int(sizes[r])
+            out.append("\n".join(f"{names[r, c]} ({labels[r, c]})" for c in range(n)))
+        return out
+
+
+class PopulationPool:
+    def __init__(self, sampler: PopulationSampler, batch: int = 2048) -> None:
+        self.sampler = sampler
+        self.batch = int(batch)
+        self._ready: Deque[str] = deque()
+
+    def __len__(self) -> int:
+        return len(self._ready)
+
+    def prefetch(self, k: Optional[int] = None) -> None:
+        self._ready.extend(self.sampler.sample(k or self.batch))
+
+    def take(self) -> str:
+        if not self._ready:
+            self.prefetch()
+        return self._ready.popleft()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=None)
     args = parser.parse_args()
-    print(build_population())
+    if args.n <= 1 and args.seed is None:
+        print(build_population())
+    else:
+        for population in PopulationSampler(seed=args.seed).sample(args.n):
+            print(population)
+            print()
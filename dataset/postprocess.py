@@ -0,0 +1,343 @@
+import argparse
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import re
+import tempfile
+import time
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, BinaryIO, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from dataset.validation import CHECKS, Candidate
+from telemetry import profiling
+
+
+SPLITS = ("train", "validation")
+REQUIRED_FIELDS = ("id", "topic", "text")
+# Checks that need only the text; the others also need the request's max_words
+# and characters, which dataset rows do not carry.
+ROW_CHECKS = ("non_string_or_none", "forbidden")
+_WS_RE = re.compile(r"\s+")
+
+Row = Tuple[str, str, bytes]
+
+
+def loads(raw: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def open_binary(path: str) -> BinaryIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, mode="rb")
+    return open(path, mode="rb")
+
+
+def text_hash(text: str) -> str:
+    return hashlib.blake2b(_WS_RE.sub(" ", text.strip()).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def split_of(row_id: str, val_fraction: float) -> str:
+    bucket = int.from_bytes(hashlib.sha256(row_id.encode("utf-8")).digest()[:8], "big") % 1_000_000
+    return "validation" if bucket < val_fraction * 1_000_000 else "train"
+
+
+def check_names(checks: Iterable[str]) -> Tuple[str, ...]:
+    registered = [name for name, _ in CHECKS]
+    for name in checks:
+        if name not in registered:
+            raise ValueError(f"Unknown check {name!r}; registered: {', '.join(registered)}")
+        if name not in ROW_CHECKS:
+            raise ValueError(f"Check {name!r} needs request parameters that rows do not carry; usable here: {', '.join(ROW_CHECKS)}")
+    return tuple(checks)
+
+
+def filter_row(obj: Any, opts: Dict[str, Any]) -> Optional[str]:
+    if not isinstance(obj, dict):
+        return "not_object"
+    for name in REQUIRED_FIELDS:
+        if not isinstance(obj.get(name), str) or not obj[name].strip():
+            return f"missing_{name}"
+    words = len(obj["text"].split())
+    if words < opts["min_words"]:
+        return "too_short"
+    if opts["max_words"] and words > opts["max_words"]:
+        return "too_long"
+    if opts["checks"]:
+        candidate = Candidate(obj["text"])
+        for name, check in CHECKS:
+            if name in opts["checks"]:
+                reason = check(candidate)
+                if reason:
+                    return reason.split(" ", 1)[0]
+    return None
+
+
+def process_chunk(lines: List[bytes], opts: Dict[str, Any]) -> Tuple[List[Row], Counter]:
+    rows: List[Row] = []
+    dropped: Counter = Counter()
+    for raw in lines:
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            obj = loads(raw)
+        except ValueError:
+            dropped["invalid_json"] += 1
+            continue
+        reason = filter_row(obj, opts)
+        if reason:
+            dropped[reason] += 1
+            continue
+        key, split = text_hash(obj["text"]), split_of(obj["id"], opts["val_fraction"])
+        if opts["fields"]:
+            obj = {k: obj[k] for k in opts["fields"] if k in obj}
+        rows.append((key, split, dumps(obj)))
+    return rows, dropped
+
+
+def iter_chunks(paths: Iterable[str], chunk_lines: int) -> Iterator[List[bytes]]:
+    chunk: List[bytes] = []
+    for path in paths:
+        with open_binary(path) as f:
+            for line in f:
+                chunk.append(line)
+                if len(chunk) >= chunk_lines:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+def parallel_map(paths: List[str], opts: Dict[str, Any], workers: int, chunk_lines: int) -> Iterator[Tuple[List[Row], Counter]]:
+    if workers <= 1:
+        for chunk in iter_chunks(paths, chunk_lines):
+            yield process_chunk(chunk, opts)
+        return
+    window: Deque[Future] = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in iter_chunks(paths, chunk_lines):
+            window.append(pool.submit(process_chunk, chunk, opts))
+            if len(window) >= workers * 2:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+
+class ShardWriter:
+    def __init__(self, out_dir: str, split: str, shard_rows: int, compress: bool) -> None:
+        self.out_dir = out_dir
+        self.split = split
+        self.shard_rows = shard_rows
+        self.compress = compress
+        self.shards: List[Dict[str, Any]] = []
+        self.rows = 0
+        self._file: Optional[BinaryIO] = None
+        self._raw: Optional[BinaryIO] = None
+        self._count = 0
+        self._path = ""
+
+    def _open(self) -> None:
+        suffix = ".jsonl.gz" if self.compress else ".jsonl"
+        name = f"{self.split}-{len(self.shards):05d}{suffix}"
+        self._path = os.path.join(self.out_dir, name)
+        self._raw = open(self._path, "wb")
+        self._file = gzip.GzipFile(filename="", mode="wb", fileobj=self._raw, mtime=0) if self.compress else self._raw
+        self._count = 0
+
+    def _close(self) -> None:
+        if self._file is None:
+            return
+        if self.compress:
+            self._file.close()
+        self._raw.close()
+        digest = hashlib.sha256()
+        with open(self._path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        self.shards.append({
+            "path": os.path.basename(self._path),
+            "rows": self._count,
+            "bytes": os.path.getsize(self._path),
+            "sha256": digest.hexdigest(),
+        })
+        self._file = None
+        self._raw = None
+
+    def write(self, line: bytes) -> None:
+        if self._file is None:
+            self._open()
+        self._file.write(line + b"\n")
+        self._count += 1
+        self.rows += 1
+        if self._count >= self.shard_rows:
+            self._close()
+
+    def close(self) -> Dict[str, Any]:
+        self._close()
+        return {"rows": self.rows, "shards": self.shards}
+
+
+def _bucket_rows(path: str) -> Iterator[Tuple[int, str, str, bytes]]:
+    with open(path, "rb") as f:
+        for line in f:
+            seq, h, split, payload = line.rstrip(b"\n").split(b"\t", 3)
+            yield int(seq), h.decode("ascii"), split.decode("ascii"), payload
+
+
+def _dedup_bucket(src: str, dst: str) -> int:
+    first: Dict[str, Tuple[int, str, bytes]] = {}
+    for seq, h, split, payload in _bucket_rows(src):
+        if h not in first:
+            first[h] = (seq, split, payload)
+    kept = sorted(first.items(), key=lambda kv: kv[1][0])
+    with open(dst, "wb") as f:
+        for h, (seq, split, payload) in kept:
+            f.write(b"%d\t%s\t%s\t%s\n" % (seq, h.encode("ascii"), split.encode("ascii"), payload))
+    os.remove(src)
+    return len(kept)
+
+
+def postprocess(
+    inputs: List[str],
+    out_dir: str,
+    val_fraction: float = 0.05,
+    shard_rows: int = 50_000,
+    workers: int = 0,
+    chunk_lines: int = 2_000,
+    buckets: int = 64,
+    min_words: int = 50,
+    max_words: int = 0,
+    checks: Tuple[str, ...] = (),
+    fields: Tuple[str, ...] = (),
+    compress: bool = False,
+    dedup: bool = True,
+) -> Dict[str, Any]:
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or (os.cpu_count() or 1)
+    opts = {
+        "val_fraction": float(val_fraction),
+        "min_words": int(min_words),
+        "max_words": int(max_words),
+        "checks": check_names(checks),
+        "fields": tuple(fields),
+    }
+    t0 = time.perf_counter()
+    dropped: Counter = Counter()
+    read = 0
+    seq = 0
+    with tempfile.TemporaryDirectory(dir=out_dir, prefix=".tmp_postprocess_") as tmp:
+        parts = [open(os.path.join(tmp, f"part-{b:04d}"), "wb") for b in range(buckets)]
+        try:
+            for rows, chunk_dropped in parallel_map(inputs, opts, workers, chunk_lines):
+                dropped.update(chunk_dropped)
+                read += len(rows) + sum(chunk_dropped.values())
+                for h, split, payload in rows:
+                    parts[int(h[:8], 16) % buckets].write(b"%d\t%s\t%s\t%s\n" % (seq, h.encode("ascii"), split.encode("ascii"), payload))
+                    seq += 1
+        finally:
+            for f in parts:
+                f.close()
+        kept_paths: List[str] = []
+        for b in range(buckets):
+            src = os.path.join(tmp, f"part-{b:04d}")
+            if dedup:
+                dst = os.path.join(tmp, f"kept-{b:04d}")
+                _dedup_bucket(src, dst)
+                kept_paths.append(dst)
+            else:
+                kept_paths.append(src)
+        writers = {s: ShardWriter(out_dir, s, shard_rows, compress) for s in SPLITS}
+        kept = 0
+        streams = [_bucket_rows(p) for p in kept_paths]
+        for _, _, split, payload in heapq.merge(*streams, key=lambda r: r[0]):
+            writers[split].write(payload)
+            kept += 1
+        splits = {s: w.close() for s, w in writers.items()}
+    manifest = {
+        "created": int(time.time()),
+        "inputs": [{"path": p, "bytes": os.path.getsize(p)} for p in inputs],
+        "params": {
+            "val_fraction": val_fraction,
+            "shard_rows": shard_rows,
+            "min_words": min_words,
+            "max_words": max_words,
+            "checks": list(checks),
+            "fields": list(fields),
+            "dedup": dedup,
+            "compress": compress,
+            "json": "orjson" if orjson is not None else "json",
+        },
+        "rows_read": read,
+        "rows_filtered": sum(dropped.values()),
+        "filtered": dict(sorted(dropped.items())),
+        "duplicates": seq - kept,
+        "rows_written": kept,
+        "splits": splits,
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="*", default=[os.path.join("data", "dataset.jsonl")], help="JSONL or JSONL.gz files, merged in the given order")
+    parser.add_argument("--out", default=os.path.join("data", "release"))
+    parser.add_argument("--val-fraction", type=float, default=0.05)
+    parser.add_argument("--shard-rows", type=int, default=50_000)
+    parser.add_argument("--workers", type=int, default=0, help="0 = one per CPU")
+    parser.add_argument("--chunk-lines", type=int, default=2_000)
+    parser.add_argument("--buckets", type=int, default=64, help="dedup partitions; memory is bounded by one partition")
+    parser.add_argument("--min-words", type=int, default=50)
+    parser.add_argument("--max-words", type=int, default=0)
+    parser.add_argument("--checks", default="", help=f"comma-separated dataset.validation checks: {', '.join(ROW_CHECKS)}")
+    parser.add_argument("--fields", default="", help="comma-separated fields to keep (default: all)")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--no-dedup", action="store_true")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure_from_args(args)
+    checks = tuple(c.strip() for c in args.checks.split(",") if c.strip())
+    try:
+        check_names(checks)
+    except ValueError as e:
+        parser.error(str(e))
+    manifest = postprocess(
+        args.inputs,
+        args.out,
+        val_fraction=args.val_fraction,
+        shard_rows=args.shard_rows,
+        workers=args.workers,
+        chunk_lines=args.chunk_lines,
+        buckets=args.buckets,
+        min_words=args.min_words,
+        max_words=args.max_words,
+        checks=checks,
+        fields=tuple(f.strip() for f in args.fields.split(",") if f.strip()),
+        compress=args.gzip,
+        dedup=not args.no_dedup,
+    )
+    summary = {k: manifest[k] for k in ("rows_read", "rows_filtered", "duplicates", "rows_written", "seconds")}
+    summary["splits"] = {s: v["rows"] for s, v in manifest["splits"].items()}
+    print(json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
-from typing import Tuple
+from typing import Dict, Tuple
 from random import random
 
 
-def build_messages(topic: str, topic_path: str, characters: str, max_words: int, label_layout: str, label_content: str) -> Tuple[str, str]:
-    char_lines = [ln for ln in characters.splitlines() if ln.strip()]
-    format_block = _compose_format_rules(label_layout, label_content, len(char_lines))
-    system_msg = f"""
+LABEL_LAYOUTS = ("inline", "script", "none")
+LABEL_CONTENTS = (
+    "name_normal",
+    "generic_tagged_letter",
+    "generic_tagged_number",
+    "generic_letter",
+    "generic_number",
+    "role",
+)
+
+SYSTEM_PREFIX = """
 You draft realistic and meaningful multiturn dialogues on given topic, with implicit reasoning chain unfolding in the dialogue.
 Use all provided characters. Keep it coherent and self-contained. Output only the dialogue, strictly following the requested format and length.
 Actively deep research the given topic on web and find relevant sources, Q/A, forum discussions, etc.
@@ -16,49 +23,68 @@ Use brief inline LaTeX ($...$) or inline code only when the topic genuinely requ
 Treat all characters as equally intellectual, no condescension or caricature. Ensure each character contributes with arguments, collaborations, ideas, or questions of similar depth.
 Characters should probe, challenge, and verify each other's claims, propose small thought experiments or examples, and elucidate their reasoning, and update positions when counter-evidence arises.
 
-Format:
-{format_block}
-
 Additional Notes:
 - Do not use the phrases 'Wait...', 'So you're saying...', 'I'm still <verb>...'
 - Do not start with this cliche 'one person is having a problem or is confused'. you did that a lot before. don't use it now.
 - Do not use university related premises, labs, clubs, coffee shops as settings. that is overdone for now.
 """
+
+USER_PREFIX = """
+Use the Topic to guide specificity. Integrate concrete factual particulars and reasoning patterns you found in sources, without citing or naming sources.
+Pick a fitting setting suitable for the character demographic, including place, time period, and a light plot hook that naturally emerges from the topic and characters.
+Keep the tone aligned with the topic. Avoid vague generalities; prefer concrete details that move the reasoning forward.
+"""
+
+SETTING_DIRECTIVES = (
+    "Begin with one ultra-brief setting line (<=12 words), then the dialogue.",
+    "Do not include any setting line; start directly with the dialogue.",
+)
+
+
+def compile_system_message(label_layout: str, label_content: str) -> str:
+    return f"""{SYSTEM_PREFIX}
+Format:
+{_compose_format_rules(label_layout, label_content)}
+"""
+
+
+def system_message(label_layout: str, label_content: str) -> str:
+    msg = SYSTEM_VARIANTS.get((label_layout, label_content))
+    if msg is None:
+        msg = compile_system_message(label_layout, label_content)
+    return msg
+
+
+def build_messages(topic: str, topic_path: str, characters: str, max_words: int, label_layout: str, label_content: str) -> Tuple[str, str]:
+    system_msg = system_message(label_layout, label_content)
     show_setting = random() < 0.3
-    setting_directive = (
-        "Begin with one ultra-brief setting line (<=12 words), then the dialogue."
-        if show_setting
-        else "Do not include any setting line; start directly with the dialogue."
-    )
+    setting_directive = SETTING_DIRECTIVES[0] if show_setting else SETTING_DIRECTIVES[1]
+
+    user_msg = f"""{USER_PREFIX}{setting_directive}
 
-    user_msg = f"""
 Topic: {topic}
 Context of the topic: {topic_path or 'N/A'}
 Characters :
 {characters}
 
 Maximum length: {max_words} words.
-Use the Topic to guide specificity. Integrate concrete factual particulars and reasoning patterns you found in sources, without citing or naming sources.
-Pick a fitting setting suitable for the character demographic, including place, time period, and a light plot hook that naturally emerges from the topic and characters.
-{setting_directive}
-Keep the tone aligned with the topic. Avoid vague generalities; prefer concrete details that move the reasoning forward.
 """
     return system_msg, user_msg
 
 
-def _compose_format_rules(label_layout: str, label_content: str, count: int) -> str:
+def _compose_format_rules(label_layout: str, label_content: str) -> str:
     if label_layout == "none":
         return (
             "no speaker labels; output only utterance lines, one per line, strictly alternating speakers. Keep speaker identity consistent across turns implicitly."
         )
     if label_layout == "inline":
-        return _inline_rules(label_content, count)
+        return _inline_rules(label_content)
     if label_layout == "script":
-        return _script_rules(label_content, count)
-    return _inline_rules("name_normal", count)
+        return _script_rules(label_content)
+    return _inline_rules("name_normal")
 
 
-def _inline_rules(label_content: str, count: int) -> str:
+def _inline_rules(label_content: str) -> str:
     if label_content == "name_normal":
         return (
             "use provided character names exactly as given. One line per turn as 'Name: text'. Keep names' original capitalization."
@@ -86,7 +112,7 @@ def _inline_rules(label_content: str, count: int) -> str:
     return "one line per turn as 'Name: text'."
 
 
-def _script_rules(label_content: str, count: int) -> str:
+def _script_rules(label_content: str) -> str:
     if label_content == "name_normal":
         return (
             "script style using provided names. Each turn uses two lines: 'Name' on its own line (original capitalization), next line is the text. Insert a blank line between turns."
@@ -114,3 +140,10 @@ def _script_rules(label_content: str, count: int) -> str:
     return (
         "script style using provided names. Each turn uses two lines: 'Name' then text, with a blank line between turns."
     )
+
+
+SYSTEM_VARIANTS: Dict[Tuple[str, str], str] = {
+    (layout, content): compile_system_message(layout, content)
+    for layout in LABEL_LAYOUTS
+    for content in LABEL_CONTENTS
+}
@@ -0,0 +1,300 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import random
+import re
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+INDEX_VERSION = 2
+OFFSETS_SUFFIX = ".offsets.npy"
+IDS_SUFFIX = ".ids.npy"
+META_SUFFIX = ".index.json"
+HEAD_BYTES = 4096
+_ID_RE = re.compile(rb'^\s*\{\s*"id"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def loads(raw: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(bytes(raw))
+
+
+def id_hash(row_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(row_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def row_id_of(line: bytes) -> Optional[str]:
+    m = _ID_RE.match(line)
+    if m is not None:
+        raw = m.group(1)
+        return raw.decode("utf-8") if b"\\" not in raw else json.loads(b'"' + raw + b'"')
+    try:
+        obj = loads(line)
+    except ValueError:
+        return None
+    rid = obj.get("id") if isinstance(obj, dict) else None
+    return rid if isinstance(rid, str) else None
+
+
+def head_digest(path: str, length: int) -> str:
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(length), digest_size=16).hexdigest()
+
+
+def tail_digest(path: str, end: int, length: int) -> str:
+    with open(path, "rb") as f:
+        f.seek(max(0, end - length))
+        return hashlib.blake2b(f.read(min(end, length)), digest_size=16).hexdigest()
+
+
+def scan_lines(buf: Any, start: int, end: int) -> Tuple[np.ndarray, np.ndarray, int]:
+    view = np.frombuffer(buf, dtype=np.uint8, count=end - start, offset=start)
+    newlines = np.flatnonzero(view == 0x0A).astype(np.uint64) + np.uint64(start)
+    if not len(newlines):
+        return np.empty(0, np.uint64), np.empty(0, np.uint64), start
+    starts = np.concatenate(([np.uint64(start)], newlines[:-1] + np.uint64(1)))
+    offsets: List[int] = []
+    hashes: List[int] = []
+    for s, e in zip(starts.tolist(), newlines.tolist()):
+        line = buf[s:e]
+        if not line.strip():
+            continue
+        rid = row_id_of(line)
+        offsets.append(s)
+        hashes.append(id_hash(rid) if rid is not None else 0)
+    return np.array(offsets, dtype=np.uint64), np.array(hashes, dtype=np.uint64), int(newlines[-1]) + 1
+
+
+def _save_npy(path: str, arr: np.ndarray) -> None:
+    d = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("wb", delete=False, dir=d, prefix=".tmp_index_", suffix=".npy") as tmp:
+        np.save(tmp, arr)
+        tmp_path = tmp.name
+    os.replace(tmp_path, path)
+
+
+def _save_json(path: str, obj: Any) -> None:
+    d = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", delete=False, dir=d, prefix=".tmp_index_", suffix=".json") as tmp:
+        json.dump(obj, tmp)
+        tmp_path = tmp.name
+    os.replace(tmp_path, path)
+
+
+def _close_map(mm: Optional[mmap.mmap]) -> None:
+    if mm is None:
+        return
+    try:
+        mm.close()
+    except BufferError:
+        pass
+
+
+class DatasetReader:
+    def __init__(self, path: str, persist: bool = True) -> None:
+        self.path = path
+        self.persist = persist
+        self.offsets = np.empty(0, np.uint64)
+        self.ends = np.empty(0, np.uint64)
+        self.hashes = np.empty(0, np.uint64)
+        self.indexed = 0
+        self.head = ""
+        self.tail = ""
+        self.inode = 0
+        self._mm: Optional[mmap.mmap] = None
+        self._file = None
+        self._sorted: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._first: Optional[Dict[int, int]] = None
+        self._load_index()
+        self.refresh()
+
+    def _paths(self) -> Tuple[str, str, str]:
+        return self.path + OFFSETS_SUFFIX, self.path + IDS_SUFFIX, self.path + META_SUFFIX
+
+    def _load_index(self) -> None:
+        offsets_path, ids_path, meta_path = self._paths()
+        if not all(os.path.exists(p) for p in self._paths()):
+            return
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if int(meta.get("version", 0)) != INDEX_VERSION:
+                return
+            offsets = np.load(offsets_path, mmap_mode="r")
+            hashes = np.load(ids_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return
+        if len(offsets) != len(hashes) or len(offsets) != int(meta.get("rows", -1)):
+            return
+        self.offsets = offsets
+        self.hashes = hashes
+        self.indexed = int(meta["indexed"])
+        self.head = str(meta.get("head", ""))
+        self.tail = str(meta.get("tail", ""))
+        self.inode = int(meta.get("inode", 0))
+
+    def _save_index(self) -> None:
+        offsets_path, ids_path, meta_path = self._paths()
+        _save_npy(offsets_path, np.ascontiguousarray(self.offsets))
+        _save_npy(ids_path, np.ascontiguousarray(self.hashes))
+        meta = {"version": INDEX_VERSION, "rows": len(self.offsets), "indexed": self.indexed, "head": self.head, "tail": self.tail, "inode": self.inode}
+        _save_json(meta_path, meta)
+
+    def _remap(self, size: int) -> None:
+        if self._file is not None and self._mm is not None and len(self._mm) == size:
+            return
+        _close_map(self._mm)
+        self._mm = None
+        if self._file is None:
+            self._file = open(self.path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ) if size else None
+
+    def _unchanged(self, inode: int) -> bool:
+        if self.inode and inode != self.inode:
+            return False
+        if head_digest(self.path, min(HEAD_BYTES, self.indexed)) != self.head:
+            return False
+        return tail_digest(self.path, self.indexed, HEAD_BYTES) == self.tail
+
+    def refresh(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        st = os.stat(self.path)
+        size = st.st_size
+        stale = size < self.indexed or (self.indexed > 0 and not self._unchanged(st.st_ino))
+        if stale:
+            self.offsets = np.empty(0, np.uint64)
+            self.hashes = np.empty(0, np.uint64)
+            self.indexed = 0
+            self._first = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        self._remap(size)
+        before = len(self.offsets)
+        if size > self.indexed:
+            offsets, hashes, indexed = scan_lines(self._mm, self.indexed, size)
+            if indexed != self.indexed:
+                self.offsets = np.concatenate((self.offsets, offsets))
+                self.hashes = np.concatenate((self.hashes, hashes))
+                self.indexed = indexed
+                self.head = head_digest(self.path, min(HEAD_BYTES, indexed))
+                self.tail = tail_digest(self.path, indexed, HEAD_BYTES)
+                self.inode = st.st_ino
+        added = len(self.offsets) - before
+        if added or stale:
+            self._sorted = None
+            if self._first is not None:
+                self._index_first(before)
+            if self.persist:
+                self._save_index()
+        self.ends = np.append(self.offsets[1:], np.uint64(self.indexed)) if len(self.offsets) else np.empty(0, np.uint64)
+        return added
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def raw(self, i: int) -> memoryview:
+        n = len(self.offsets)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(f"row {i} out of range for {n} rows")
+        start = int(self.offsets[i])
+        end = int(self.ends[i])
+        return memoryview(self._mm)[start:end]
+
+    def row(self, i: int) -> Any:
+        return loads(self.raw(i))
+
+    def __getitem__(self, i: int) -> Any:
+        return self.row(i)
+
+    def __iter__(self) -> Iterator[Any]:
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def rows_of(self, row_id: str) -> List[int]:
+        if self._sorted is None:
+            order = np.argsort(self.hashes, kind="stable")
+            self._sorted = (order, np.asarray(self.hashes)[order])
+        order, keys = self._sorted
+        h = np.uint64(id_hash(row_id))
+        lo = int(np.searchsorted(keys, h, side="left"))
+        hi = int(np.searchsorted(keys, h, side="right"))
+        return [i for i in sorted(order[lo:hi].tolist()) if row_id_of(bytes(self.raw(i))) == row_id]
+
+    def _index_first(self, start: int) -> None:
+        first = self._first if self._first is not None else {}
+        for i, h in enumerate(np.asarray(self.hashes[start:]).tolist(), start):
+            first.setdefault(h, i)
+        self._first = first
+
+    def by_id(self, row_id: str) -> Optional[Any]:
+        if self._first is None:
+            self._index_first(0)
+        i = self._first.get(id_hash(row_id))
+        if i is None:
+            return None
+        if row_id_of(bytes(self.raw(i))) == row_id:
+            return self.row(i)
+        rows = self.rows_of(row_id)
+        return self.row(rows[0]) if rows else None
+
+    def sample(self, k: int, seed: Optional[int] = None) -> List[int]:
+        return sorted(random.Random(seed).sample(range(len(self)), min(k, len(self))))
+
+    def close(self) -> None:
+        _close_map(self._mm)
+        self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "DatasetReader":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def open_dataset(path: str, persist: bool = True) -> DatasetReader:
+    return DatasetReader(path, persist=persist)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default=os.path.join("data", "dataset.jsonl"))
+    parser.add_argument("--row", type=int, action="append", default=[], help="row index (negative counts from the end); repeatable")
+    parser.add_argument("--id", action="append", default=[], help="row id; repeatable")
+    parser.add_argument("--sample", type=int, default=0, help="print N random rows")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--no-persist", action="store_true", help="do not write the index next to the dataset")
+    args = parser.parse_args()
+    t0 = time.perf_counter()
+    with open_dataset(args.path, persist=not args.no_persist) as reader:
+        opened = time.perf_counter() - t0
+        out: Dict[str, Any] = {"path": args.path, "rows": len(reader), "open_ms": round(opened * 1000, 2)}
+        if args.row:
+            out["by_row"] = {str(i): reader.row(i) for i in args.row}
+        if args.id:
+            out["by_id"] = {rid: reader.by_id(rid) for rid in args.id}
+        if args.sample:
+            out["sample"] = {str(i): reader.row(i) for i in reader.sample(args.sample, args.seed)}
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+MIN_WORDS = 50
+MAX_WORDS_SLACK = 1.15
+LAYOUT_MIN_SHARE = 0.9
+SETTING_LINE_MAX_WORDS = 16
+STREAM_PROBE_LINES = 4
+STREAM_LAYOUT_MIN_SHARE = 0.5
+
+FORBIDDEN_PHRASES: Tuple[Tuple[str, str, "re.Pattern[str]"], ...] = (
+    ("wait", "wait", re.compile(r"\bWait\s*(?:\.\.\.|…)", re.IGNORECASE)),
+    ("so_youre_saying", "saying", re.compile(r"\bSo you(?:'|’)re saying\b", re.IGNORECASE)),
+    ("im_still", "still", re.compile(r"\bI(?:'|’)m still \w+ing\b", re.IGNORECASE)),
+)
+URL_HINTS = ("://", "www.", ".com", ".org", ".net", ".edu", ".gov", ".io")
+URL_RE = re.compile(r"https?://|\bwww\.\S+|\b[\w-]+\.(?:com|org|net|edu|gov|io)(?:/\S*)?\b", re.IGNORECASE)
+CITATION_HINTS = ("[", "source", "reference")
+CITATION_RE = re.compile(r"\[\d+(?:\s*[,\-–]\s*\d+)*\]|\[\^\d+\]|\b(?:Sources?|References?)\s*:", re.IGNORECASE)
+BLOCK_RE = re.compile(r"```|\$\$")
+
+INLINE_LABELS: Dict[str, "re.Pattern[str]"] = {
+    "generic_tagged_letter": re.compile(r"^Person [A-Z]$"),
+    "generic_tagged_number": re.compile(r"^Person \d+$"),
+    "generic_letter": re.compile(r"^[A-Z]$"),
+    "generic_number": re.compile(r"^\d+$"),
+    "role": re.compile(r"^[A-Z][\w.'’ -]{0,39}$"),
+}
+SCRIPT_LABELS: Dict[str, "re.Pattern[str]"] = {
+    "generic_tagged_letter": re.compile(r"^PERSON [A-Z]$"),
+    "generic_tagged_number": re.compile(r"^PERSON \d+$"),
+    "generic_letter": re.compile(r"^[A-Z]$"),
+    "generic_number": re.compile(r"^\d+$"),
+    "role": re.compile(r"^[A-Z][A-Z.'’ -]{0,39}$"),
+}
+INLINE_RE = re.compile(r"^([^:]{1,40}):\s+\S")
+
+
+@dataclass
+class Candidate:
+    text: Optional[str]
+    label_layout: str = "inline"
+    label_content: str = "name_normal"
+    max_words: int = 0
+    characters: str = ""
+    names: List[str] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.names = parse_names(self.characters)
+
+
+Check = Callable[[Candidate], Optional[str]]
+
+CHECKS: List[Tuple[str, Check]] = []
+
+
+def register_check(name: str) -> Callable[[Check], Check]:
+    def decorator(fn: Check) -> Check:
+        CHECKS.append((name, fn))
+        return fn
+
+    return decorator
+
+
+def parse_names(characters: str) -> List[str]:
+    names: List[str] = []
+    for line in (characters or "").splitlines():
+        name = line.split(" (", 1)[0].strip()
+        if name:
+            names.append(name)
+    return names
+
+
+def _lines(text: str) -> List[str]:
+    return [ln.strip() for ln in text.splitlines() if ln.strip()]
+
+
+def _name_label(label: str, names: List[str]) -> bool:
+    if not names:
+        return True
+    return any(label == n or label in n.split() for n in names)
+
+
+def _share(good: int, total: int) -> float:
+    return good / total if total else 0.0
+
+
+@register_check("non_string_or_none")
+def check_text(c: Candidate) -> Optional[str]:
+    if not isinstance(c.text, str) or not c.text.strip():
+        return "non_string_or_none"
+    return None
+
+
+@register_check("length")
+def check_length(c: Candidate) -> Optional[str]:
+    words = len(c.text.split())
+    if words < MIN_WORDS:
+        return f"too_short word_count={words}"
+    if c.max_words and words > c.max_words * MAX_WORDS_SLACK:
+        return f"too_long word_count={words} max_words={c.max_words}"
+    return None
+
+
+@register_check("forbidden")
+def check_forbidden(c: Candidate) -> Optional[str]:
+    lowered = c.text.lower()
+    for name, hint, pattern in FORBIDDEN_PHRASES:
+        if hint in lowered and pattern.search(c.text):
+            return f"forbidden_phrase phrase={name}"
+    if any(h in lowered for h in URL_HINTS) and URL_RE.search(c.text):
+        return "url"
+    if any(h in lowered for h in CITATION_HINTS) and CITATION_RE.search(c.text):
+        return "citation"
+    if BLOCK_RE.search(c.text):
+        return "block_markup"
+    return None
+
+
+@register_check("label_layout")
+def check_layout(c: Candidate) -> Optional[str]:
+    lines = _lines(c.text)
+    if c.label_layout == "inline":
+        good = _inline_conforming(lines, c)
+        if good < len(lines) and len(lines[0].split()) <= SETTING_LINE_MAX_WORDS and not INLINE_RE.match(lines[0]):
+            lines = lines[1:]
+        if _share(good, len(lines)) < LAYOUT_MIN_SHARE:
+            return f"label_layout expected=inline share={_share(good, len(lines)):.2f}"
+    elif c.label_layout == "script":
+        share = _script_share(c.text, c)
+        if share < LAYOUT_MIN_SHARE:
+            return f"label_layout expected=script share={share:.2f}"
+    elif c.label_layout == "none":
+        labelled = sum(1 for ln in lines if _is_label(INLINE_RE.match(ln), c, inline=True))
+        if len(lines) > 1 and _share(labelled, len(lines)) > 1.0 - LAYOUT_MIN_SHARE:
+            return f"label_layout expected=none labelled={labelled}"
+    return None
+
+
+@register_check("label_content")
+def check_content(c: Candidate) -> Optional[str]:
+    if c.label_layout == "none" or c.label_content == "name_normal":
+        return None
+    for name in c.names:
+        if len(name.split()) > 1 and name in c.text:
+            return "label_content name_leak"
+    return None
+
+
+def _is_label(m: Optional["re.Match[str]"], c: Candidate, inline: bool) -> bool:
+    if m is None:
+        return False
+    label = m.group(1).strip() if inline else m.group(0).strip()
+    if c.label_content == "name_normal":
+        return _name_label(label, c.names)
+    pattern = (INLINE_LABELS if inline else SCRIPT_LABELS).get(c.label_content)
+    return bool(pattern and pattern.match(label))
+
+
+def _inline_conforming(lines: List[str], c: Candidate) -> int:
+    return sum(1 for ln in lines if _is_label(INLINE_RE.match(ln), c, inline=True))
+
+
+def _script_share(text: str, c: Candidate) -> float:
+    blocks = [b for b in re.split(r"\n\s*\n", text.strip()) if b.strip()]
+    if not blocks:
+        return 0.0
+    good = 0
+    for block in blocks:
+        lines = _lines(block)
+        if len(lines) >= 2 and _is_label(re.match(r"^.{1,40}$", lines[0]), c, inline=False):
+            good += 1
+    if good < len(blocks) and len(_lines(blocks[0])) == 1 and len(blocks[0].split()) <= SETTING_LINE_MAX_WORDS:
+        return _share(good, len(blocks) - 1)
+    return _share(good, len(blocks))
+
+
+def validate(candidate: Candidate) -> List[str]:
+    failures: List[str] = []
+    for _, check in CHECKS:
+        reason = check(candidate)
+        if reason:
+            failures.append(reason)
+            if not isinstance(candidate.text, str) or not candidate.text.strip():
+                break
+    return failures
+
+
+def validate_dialogue(text: Optional[str], label_layout: str, label_content: str, max_words: int, characters: str) -> List[str]:
+    return validate(Candidate(text, label_layout, label_content, max_words, characters))
+
+
+class StreamChecker:
+    def __init__(self, label_layout: str = "inline", label_content: str = "name_normal", max_words: int = 0, characters: str = "") -> None:
+        self.candidate = Candidate("", label_layout, label_content, max_words, characters)
+        self.text = ""
+        self.words = 0
+        self._done = 0
+        self._lines: List[str] = []
+
+    def feed(self, delta: str) -> Optional[str]:
+        self.text += delta
+        cut = self.text.rfind("\n")
+        if cut < self._done:
+            return self._check_budget(self.text[self._done :])
+        fresh = self.text[self._done : cut]
+        self._done = cut + 1
+        self.words += len(fresh.split())
+        for line in fresh.splitlines():
+            reason = self._check_line(line)
+            if reason:
+                return reason
+        return self._check_budget(self.text[self._done :]) or self._check_layout()
+
+    def _check_budget(self, tail: str) -> Optional[str]:
+        c = self.candidate
+        words = self.words + len(tail.split())
+        if c.max_words and words > c.max_words * MAX_WORDS_SLACK:
+            return f"too_long word_count={words} max_words={c.max_words}"
+        return None
+
+    def _check_line(self, line: str) -> Optional[str]:
+        if not line.strip():
+            self._lines.append("")
+            return None
+        self._lines.append(line.strip())
+        c = Candidate(line, self.candidate.label_layout, self.candidate.label_content, 0, "")
+        c.names = self.candidate.names
+        return check_forbidden(c) or check_content(c)
+
+    def _check_layout(self) -> Optional[str]:
+        c = self.candidate
+        lines = [ln for ln in self._lines if ln]
+        if c.label_layout == "script":
+            blocks = [b for b in re.split(r"\n\s*\n", "\n".join(self._lines).strip()) if b.strip()]
+            if len(blocks) <= STREAM_PROBE_LINES:
+                return None
+            share = _script_share("\n\n".join(blocks[:-1]), c)
+        elif len(lines) <= STREAM_PROBE_LINES:
+            return None
+        elif c.label_layout == "inline":
+            if len(lines[0].split()) <= SETTING_LINE_MAX_WORDS and not INLINE_RE.match(lines[0]):
+                lines = lines[1:]
+            share = _share(_inline_conforming(lines, c), len(lines))
+        else:
+            labelled = sum(1 for ln in lines if _is_label(INLINE_RE.match(ln), c, inline=True))
+            share = 1.0 - _share(labelled, len(lines))
+        if share < STREAM_LAYOUT_MIN_SHARE:
+            return f"label_layout expected={c.label_layout} share={share:.2f}"
+        return None
@@ -0,0 +1,415 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import pickle
+import tempfile
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+STATES = ("false", "true", "skipped")
+STATE_CODE = {s: i for i, s in enumerate(STATES)}
+METRICS = ("nodes", "leaves", "height", "frontier", "skipped", "expanded", "frontier_share", "skipped_share", "branching")
+CACHE_VERSION = 1
+
+
+def state_code(value: Any) -> int:
+    s = str(value).strip().lower()
+    if s in STATE_CODE:
+        return STATE_CODE[s]
+    return 1 if s in {"1", "t", "yes", "y"} else 0
+
+
+def cache_path_for(pkl_path: str) -> str:
+    base, _ = os.path.splitext(pkl_path)
+    return base + ".stats.npz"
+
+
+def source_signature(pkl_path: str) -> Tuple[int, int]:
+    st = os.stat(pkl_path)
+    return int(st.st_size), int(st.st_mtime_ns)
+
+
+class OntologyStats:
+    def __init__(self, capacity: int = 1024) -> None:
+        self.ids: List[str] = []
+        self.topics: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.n = 0
+        self._alloc(max(16, capacity))
+        self._layout_dirty = True
+        self._pre: Optional[np.ndarray] = None
+        self._order: Optional[np.ndarray] = None
+
+    def _alloc(self, cap: int) -> None:
+        old = getattr(self, "parent", None)
+
+        def grow(arr: Optional[np.ndarray], dtype: Any, fill: int = 0, cols: int = 0) -> np.ndarray:
+            shape = (cap, cols) if cols else (cap,)
+            out = np.full(shape, fill, dtype=dtype)
+            if arr is not None:
+                out[: self.n] = arr[: self.n]
+            return out
+
+        self.parent = grow(old, np.int64, -1)
+        self.depth = grow(getattr(self, "depth", None), np.int32)
+        self.state = grow(getattr(self, "state", None), np.int8)
+        self.children = grow(getattr(self, "children", None), np.int64)
+        self.size = grow(getattr(self, "size", None), np.int64)
+        self.leaves = grow(getattr(self, "leaves", None), np.int64)
+        self.max_depth = grow(getattr(self, "max_depth", None), np.int32)
+        self.states = grow(getattr(self, "states", None), np.int64, cols=len(STATES))
+
+    @classmethod
+    def from_graph(cls, G: "nx.DiGraph") -> "OntologyStats":
+        stats = cls(capacity=G.number_of_nodes() * 5 // 4 + 16)
+        parents: List[Optional[str]] = []
+        for nid, data in G.nodes(data=True):
+            sid = str(nid)
+            stats.index[sid] = stats.n
+            stats.ids.append(sid)
+            stats.topics.append(str(data.get("topic", "")))
+            stats.depth[stats.n] = int(data.get("depth", 0) or 0)
+            stats.state[stats.n] = state_code(data.get("expanded", "false"))
+            pid = data.get("parentid")
+            parents.append(None if pid in (None, "", "None") else str(pid))
+            stats.n += 1
+        n = stats.n
+        stats.parent[:n] = [stats.index.get(p, -1) if p is not None else -1 for p in parents]
+        stats.recompute()
+        return stats
+
+    @classmethod
+    def view(cls, ids: Any, topics: Any, index: Any, arrays: Dict[str, np.ndarray]) -> "OntologyStats":
+        stats = cls.__new__(cls)
+        stats.ids = ids
+        stats.topics = topics
+        stats.index = index
+        stats.n = len(arrays["parent"])
+        for name in ("parent", "depth", "state", "children", "size", "leaves", "max_depth", "states"):
+            setattr(stats, name, arrays[name])
+        stats._pre = arrays["pre"]
+        stats._order = arrays["order"]
+        stats._layout_dirty = False
+        return stats
+
+    def recompute(self) -> None:
+        n = self.n
+        parent = self.parent[:n]
+        has_parent = parent >= 0
+        self.children[:n] = np.bincount(parent[has_parent], minlength=n)[:n] if n else 0
+        self.size[:n] = 1
+        self.leaves[:n] = (self.children[:n] == 0).astype(np.int64)
+        self.max_depth[:n] = self.depth[:n]
+        self.states[:n] = 0
+        self.states[np.arange(n), self.state[:n]] = 1
+        levels = self._levels()
+        for idx in reversed(levels):
+            idx = idx[parent[idx] >= 0]
+            if not len(idx):
+                continue
+            p = parent[idx]
+            np.add.at(self.size, p, self.size[idx])
+            np.add.at(self.leaves, p, self.leaves[idx])
+            np.maximum.at(self.max_depth, p, self.max_depth[idx])
+            for s in range(len(STATES)):
+                np.add.at(self.states[:, s], p, self.states[idx, s])
+        self._layout_dirty = True
+
+    def _levels(self) -> List[np.ndarray]:
+        n = self.n
+        parent = self.parent[:n]
+        level = np.full(n, -1, dtype=np.int64)
+        frontier = np.flatnonzero(parent < 0)
+        level[frontier] = 0
+        order = np.argsort(parent, kind="stable")
+        sorted_parent = parent[order]
+        out: List[np.ndarray] = []
+        d = 0
+        while len(frontier):
+            out.append(frontier)
+            lo = np.searchsorted(sorted_parent, frontier, side="left")
+            hi = np.searchsorted(sorted_parent, frontier, side="right")
+            counts = hi - lo
+            if not counts.sum():
+                break
+            nxt = order[np.repeat(lo, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))]
+            nxt = nxt[level[nxt] < 0]
+            d += 1
+            level[nxt] = d
+            frontier = nxt
+        return out
+
+    def _ensure_layout(self) -> None:
+        if not self._layout_dirty and self._pre is not None:
+            return
+        n = self.n
+        parent = self.parent[:n]
+        kids: Dict[int, List[int]] = {}
+        for child in np.flatnonzero(parent >= 0).tolist():
+            kids.setdefault(int(parent[child]), []).append(child)
+        order = np.empty(n, dtype=np.int64)
+        pos = 0
+        stack = list(reversed(np.flatnonzero(parent < 0).tolist()))
+        while stack:
+            v = stack.pop()
+            order[pos] = v
+            pos += 1
+            stack.extend(reversed(kids.get(v, ())))
+        order = order[:pos]
+        pre = np.full(n, -1, dtype=np.int64)
+        pre[order] = np.arange(pos)
+        self._order = order
+        self._pre = pre
+        self._layout_dirty = False
+
+    def add_node(self, nid: str, parentid: Optional[str], depth: int, expanded: Any = "false", topic: str = "") -> None:
+        if nid in self.index:
+            return
+        if self.n >= len(self.parent):
+            self._alloc(len(self.parent) * 2)
+        i = self.n
+        self.index[nid] = i
+        self.ids.append(nid)
+        self.topics.append(topic)
+        self.n += 1
+        p = self.index.get(parentid, -1) if parentid is not None else -1
+        code = state_code(expanded)
+        self.parent[i] = p
+        self.depth[i] = int(depth)
+        self.state[i] = code
+        self.children[i] = 0
+        self.size[i] = 1
+        self.leaves[i] = 1
+        self.max_depth[i] = int(depth)
+        self.states[i] = 0
+        self.states[i, code] = 1
+        self._layout_dirty = True
+        if p < 0:
+            return
+        leaf_delta = 0 if self.children[p] == 0 else 1
+        self.children[p] += 1
+        cur = p
+        while cur >= 0:
+            self.size[cur] += 1
+            self.leaves[cur] += leaf_delta
+            self.states[cur, code] += 1
+            if self.max_depth[cur] < depth:
+                self.max_depth[cur] = depth
+            cur = int(self.parent[cur])
+
+    def set_state(self, nid: str, expanded: Any) -> None:
+        i = self.index.get(nid)
+        if i is None:
+            return
+        new = state_code(expanded)
+        old = int(self.state[i])
+        if new == old:
+            return
+        self.state[i] = new
+        cur = i
+        while cur >= 0:
+            self.states[cur, old] -= 1
+            self.states[cur, new] += 1
+            cur = int(self.parent[cur])
+
+    def sync(self, G: "nx.DiGraph") -> int:
+        added = 0
+        for nid, data in G.nodes(data=True):
+            sid = str(nid)
+            i = self.index.get(sid)
+            if i is None:
+                pid = data.get("parentid")
+                self.add_node(sid, None if pid in (None, "", "None") else str(pid), int(data.get("depth", 0) or 0), data.get("expanded", "false"), str(data.get("topic", "")))
+                added += 1
+            elif self.state[i] != state_code(data.get("expanded", "false")):
+                self.set_state(sid, data.get("expanded", "false"))
+        return added
+
+    def _metric_array(self, metric: str) -> np.ndarray:
+        n = self.n
+        size = self.size[:n]
+        if metric == "nodes":
+            return size
+        if metric == "leaves":
+            return self.leaves[:n]
+        if metric == "height":
+            return self.max_depth[:n] - self.depth[:n]
+        if metric == "frontier":
+            return self.states[:n, STATE_CODE["false"]]
+        if metric == "skipped":
+            return self.states[:n, STATE_CODE["skipped"]]
+        if metric == "expanded":
+            return self.states[:n, STATE_CODE["true"]]
+        if metric == "frontier_share":
+            return self.states[:n, STATE_CODE["false"]] / size
+        if metric == "skipped_share":
+            return self.states[:n, STATE_CODE["skipped"]] / size
+        if metric == "branching":
+            internal = size - self.leaves[:n]
+            return np.divide(size - 1, internal, out=np.zeros(n), where=internal > 0)
+        raise ValueError(f"Unknown metric: {metric}")
+
+    def metric(self, metric: str) -> Dict[str, float]:
+        values = self._metric_array(metric).tolist()
+        return dict(zip(self.ids, values))
+
+    def depth_distribution(self, nid: str) -> Dict[int, int]:
+        self._ensure_layout()
+        i = self.index[nid]
+        start = int(self._pre[i])
+        members = self._order[start : start + int(self.size[i])]
+        counts = np.bincount(self.depth[members])
+        return {int(d): int(c) for d, c in enumerate(counts) if c}
+
+    def branching_distribution(self, nid: str) -> Dict[int, int]:
+        self._ensure_layout()
+        i = self.index[nid]
+        start = int(self._pre[i])
+        members = self._order[start : start + int(self.size[i])]
+        kids = self.children[members]
+        counts = np.bincount(kids[kids > 0]) if len(kids) else np.zeros(0, dtype=np.int64)
+        return {int(k): int(c) for k, c in enumerate(counts) if c}
+
+    def subtree(self, nid: str, distributions: bool = True) -> Dict[str, Any]:
+        i = self.index[nid]
+        size = int(self.size[i])
+        leaves = int(self.leaves[i])
+        internal = size - leaves
+        out: Dict[str, Any] = {
+            "id": nid,
+            "topic": self.topics[i],
+            "depth": int(self.depth[i]),
+            "nodes": size,
+            "leaves": leaves,
+            "internal": internal,
+            "height": int(self.max_depth[i] - self.depth[i]),
+            "children": int(self.children[i]),
+            "branching": (size - 1) / internal if internal else 0.0,
+            "states": {s: int(self.states[i, k]) for k, s in enumerate(STATES)},
+        }
+        if distributions:
+            out["depths"] = self.depth_distribution(nid)
+            out["branching_factors"] = self.branching_distribution(nid)
+        return out
+
+    def top(self, metric: str = "nodes", depth: Optional[int] = 1, limit: int = 20) -> List[Dict[str, Any]]:
+        values = self._metric_array(metric)
+        candidates = np.arange(self.n) if depth is None else np.flatnonzero(self.depth[: self.n] == depth)
+        if not len(candidates):
+            return []
+        ranked = candidates[np.argsort(-values[candidates], kind="stable")][:limit]
+        return [dict(self.subtree(self.ids[i], distributions=False), value=float(values[i])) for i in ranked.tolist()]
+
+    def find(self, topic: str) -> Optional[str]:
+        needle = topic.strip().lower()
+        for i, t in enumerate(self.topics):
+            if t.lower() == needle:
+                return self.ids[i]
+        return None
+
+    def roots(self) -> List[str]:
+        return [self.ids[i] for i in np.flatnonzero(self.parent[: self.n] < 0).tolist()]
+
+    def save(self, path: str, signature: Tuple[int, int]) -> None:
+        n = self.n
+        self._ensure_layout()
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        with tempfile.NamedTemporaryFile("wb", delete=False, dir=d, prefix=".tmp_stats_", suffix=".npz") as tmp:
+            np.savez(
+                tmp,
+                version=np.array([CACHE_VERSION]),
+                signature=np.array(signature, dtype=np.int64),
+                ids=np.array(self.ids, dtype=object),
+                topics=np.array(self.topics, dtype=object),
+                parent=self.parent[:n],
+                depth=self.depth[:n],
+                state=self.state[:n],
+                children=self.children[:n],
+                size=self.size[:n],
+                leaves=self.leaves[:n],
+                max_depth=self.max_depth[:n],
+                states=self.states[:n],
+                pre=self._pre,
+                order=self._order,
+            )
+            tmp_path = tmp.name
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, signature: Optional[Tuple[int, int]] = None) -> Optional["OntologyStats"]:
+        if not os.path.exists(path):
+            return None
+        try:
+            z = np.load(path, allow_pickle=True)
+            if int(z["version"][0]) != CACHE_VERSION:
+                return None
+            if signature is not None and tuple(int(x) for x in z["signature"]) != tuple(signature):
+                return None
+            n = len(z["ids"])
+            stats = cls(capacity=n * 5 // 4 + 16)
+            stats.ids = z["ids"].tolist()
+            stats.topics = z["topics"].tolist()
+            stats.index = {nid: i for i, nid in enumerate(stats.ids)}
+            stats.n = n
+            for name in ("parent", "depth", "state", "children", "size", "leaves", "max_depth", "states"):
+                getattr(stats, name)[:n] = z[name]
+            stats._pre = z["pre"]
+            stats._order = z["order"]
+            stats._layout_dirty = False
+            return stats
+        except Exception:
+            return None
+
+
+def load_stats(pkl_path: str, use_cache: bool = True) -> OntologyStats:
+    signature = source_signature(pkl_path)
+    cache = cache_path_for(pkl_path)
+    if use_cache:
+        stats = OntologyStats.load(cache, signature)
+        if stats is not None:
+            return stats
+    with open(pkl_path, "rb") as f:
+        G = pickle.load(f)
+    stats = OntologyStats.from_graph(G)
+    if use_cache:
+        try:
+            stats.save(cache, signature)
+        except OSError:
+            pass
+    return stats
+
+
+def main() -> None:
+    root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pkl", default=os.path.join(root_dir, "data", "ontology", "tree.pkl"))
+    parser.add_argument("--node", default="", help="node id to summarize (default: root)")
+    parser.add_argument("--topic", default="", help="summarize the node with this exact topic")
+    parser.add_argument("--top", type=int, default=0, help="rank subtrees at --depth by --by")
+    parser.add_argument("--depth", type=int, default=1)
+    parser.add_argument("--by", choices=METRICS, default="nodes")
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+    t0 = time.perf_counter()
+    stats = load_stats(args.pkl, use_cache=not args.no_cache)
+    loaded = time.perf_counter() - t0
+    t1 = time.perf_counter()
+    if args.top:
+        result: Any = stats.top(args.by, args.depth, args.top)
+    else:
+        nid = args.node or (stats.find(args.topic) if args.topic else None) or (stats.roots() or [""])[0]
+        if nid not in stats.index:
+            raise SystemExit(f"Unknown node: {args.node or args.topic}")
+        result = stats.subtree(nid)
+    print(json.dumps({"result": result, "load_ms": round(loaded * 1000, 2), "query_ms": round((time.perf_counter() - t1) * 1000, 2)}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
 import argparse
 import csv
+import json
 import os
 import pickle
-from typing import Dict, List
+import tempfile
+from typing import Any, Dict, List, Tuple
 
 import networkx as nx
 
+from telemetry import metrics, profiling
+
 
 def load_graph(pkl_path: str) -> nx.DiGraph:
     with open(pkl_path, "rb") as f:
@@ -42,7 +46,46 @@ def path_from_root(node_id: str, parent: Dict[str, str], topic: Dict[str, str])
     return chain
 
 
-def export_topics_csv(pkl_path: str, csv_path: str) -> None:
+def read_snapshot(csv_path: str) -> Dict[str, Tuple[str, str, int]]:
+    snap: Dict[str, Tuple[str, str, int]] = {}
+    if not os.path.exists(csv_path):
+        return snap
+    with open(csv_path, "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            rid = row.get("id")
+            if not rid:
+                continue
+            try:
+                depth = int(row.get("depth", "0") or 0)
+            except ValueError:
+                depth = 0
+            snap[rid] = (row.get("topic", ""), row.get("path", ""), depth)
+    return snap
+
+
+def diff_snapshots(old: Dict[str, Tuple[str, str, int]], rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    added: List[str] = []
+    changed: List[str] = []
+    seen = set()
+    for row in rows:
+        rid = row["id"]
+        seen.add(rid)
+        prev = old.get(rid)
+        if prev is None:
+            added.append(rid)
+        elif prev != (row["topic"], row["path"], int(row["depth"])):
+            changed.append(rid)
+    removed = [rid for rid in old if rid not in seen]
+    return {
+        "previous_rows": len(old),
+        "rows": len(rows),
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+    }
+
+
+def export_topics_csv(pkl_path: str, csv_path: str) -> Dict[str, Any]:
     G = load_graph(pkl_path)
     parent = build_parent_index(G)
     topic = build_topic_index(G)
@@ -64,11 +107,16 @@ def export_topics_csv(pkl_path: str, csv_path: str) -> None:
             "path": " > ".join(topics),
             "depth": depth,
         })
-    os.makedirs(os.path.dirname(os.path.abspath(csv_path)), exist_ok=True)
-    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+    diff = diff_snapshots(read_snapshot(csv_path), rows)
+    out_dir = os.path.dirname(os.path.abspath(csv_path))
+    os.makedirs(out_dir, exist_ok=True)
+    with metrics.span("write_topics_csv", rows=len(rows)), tempfile.NamedTemporaryFile("w", delete=False, dir=out_dir, prefix=".tmp_topics_", suffix=".csv", newline="", encoding="utf-8") as f:
         w = csv.DictWriter(f, fieldnames=["id", "topic", "path", "depth"])
         w.writeheader()
         w.writerows(rows)
+        tmp_path = f.name
+    os.replace(tmp_path, csv_path)
+    return diff
 
 
 def main() -> None:
@@ -78,9 +126,16 @@ def main() -> None:
     default_out = os.path.join(root_dir, "data", "topics.csv")
     parser.add_argument("--pkl", default=default_pkl)
     parser.add_argument("--out", default=default_out)
+    parser.add_argument("--diff", default="", help="write added/removed/changed ids vs the previous export to this JSON file")
+    profiling.add_arguments(parser)
     args = parser.parse_args()
-    export_topics_csv(args.pkl, args.out)
-    print(f"Wrote {args.out}")
+    metrics.configure_from_env()
+    profiling.configure_from_args(args)
+    diff = export_topics_csv(args.pkl, args.out)
+    if args.diff:
+        with open(args.diff, "w", encoding="utf-8") as f:
+            json.dump(diff, f, ensure_ascii=False)
+    print(f"Wrote {args.out} (+{len(diff['added'])} -{len(diff['removed'])} ~{len(diff['changed'])} vs previous export)")
 
 
 if __name__ == "__main__":
@@ -1,5 +1,8 @@
 from typing import Optional, Iterable, Any, Type
 import os
+import sys
+import threading
+import time
 from pathlib import Path
 import uuid
 import random
@@ -7,6 +10,12 @@ from openai import OpenAI
 from pydantic import BaseModel, Field
 import instructor
 from prompts import build_expand_prompt
+try:
+    from telemetry import metrics, usage as usage_ledger
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from telemetry import metrics, usage as usage_ledger
+from providers.pool import Endpoint, get_pool
 try:
     from dotenv import load_dotenv as _load_dotenv
 except Exception:
@@ -20,15 +29,19 @@ def _find_env_path() -> Optional[Path]:
             return envp
     return None
 
-def openai_client() -> OpenAI:
+def openai_client(endpoint: Optional[Endpoint] = None) -> OpenAI:
     env_path = _find_env_path()
     if _load_dotenv is not None and env_path is not None:
         _load_dotenv(dotenv_path=env_path, override=False)
-    api_key = os.getenv("OPENAI_API_KEY", "").strip()
-    base_url = os.getenv("OPENAI_BASE_URL", "").strip() or None
+    if endpoint is None:
+        endpoint = get_pool().endpoints[0]
+    api_key = endpoint.api_key
+    base_url = endpoint.base_url
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY is required")
     kwargs: dict[str, Any] = {"api_key": api_key}
+    if endpoint.max_retries is not None:
+        kwargs["max_retries"] = endpoint.max_retries
     if base_url:
         kwargs["base_url"] = base_url
         if "openrouter.ai" in base_url:
@@ -37,29 +50,21 @@ def openai_client() -> OpenAI:
             kwargs["default_headers"] = {"HTTP-Referer": referer, "X-Title": title}
     return instructor.patch(OpenAI(**kwargs))
 
-_CLIENT: Optional[OpenAI] = None
-_MODEL: Optional[str] = None
+_LAST = threading.local()
 
 def candidate_models() -> list[str]:
     s = os.getenv("MODEL_LIST", "").strip()
     if s:
-        return [m.strip() for m in s.split(",") if m.strip()]
-    single = os.getenv("OPENAI_MODEL", "").strip()
-    if single:
-        return [single]
-    return [
-        "anthropic/claude-sonnet-4",
-        "openai/gpt-5",
-        "qwen/qwen3-max"
-    ]
-
-def session() -> tuple[OpenAI, str]:
-    global _CLIENT, _MODEL
-    if _CLIENT is None:
-        _CLIENT = openai_client()
-    pool = candidate_models()
-    _MODEL = random.choice(pool) if pool else "openai/gpt-4o-mini"
-    return _CLIENT, _MODEL
+        models = [m.strip() for m in s.split(",") if m.strip()]
+    elif os.getenv("OPENAI_MODEL", "").strip():
+        models = [os.getenv("OPENAI_MODEL", "").strip()]
+    else:
+        models = [
+            "anthropic/claude-sonnet-4",
+            "openai/gpt-5",
+            "qwen/qwen3-max"
+        ]
+    return get_pool().serving(models) or models
 
 class RootTopic(BaseModel):
     topic: str = Field(min_length=1)
@@ -71,21 +76,53 @@ class Subtopic(BaseModel):
 class Subtopics(BaseModel):
     subtopics: list[Subtopic] = Field(default_factory=list)
 
-def chat_request(client: OpenAI, model: str, prompt: str, response_model: Type[BaseModel]) -> Any:
+def chat_request(client: OpenAI, model: str, prompt: str, response_model: Type[BaseModel], timeout: Optional[float] = None) -> Any:
     msgs = [{"role": "user", "content": prompt}]
+    kwargs: dict[str, Any] = {"timeout": timeout} if timeout else {}
     return client.chat.completions.create(
         model=model,
         messages=msgs,
         reasoning_effort='minimal',
         response_model=response_model,
-        max_tokens=512
+        max_tokens=512,
+        **kwargs
     )
 
-def expand(topic: str, hierarchy: list[str]) -> Optional[Iterable[Any]]:
-    client, model = session()
+def last_usage() -> Optional[usage_ledger.UsageRecord]:
+    return getattr(_LAST, "usage", None)
+
+def last_call_tokens() -> int:
+    rec = last_usage()
+    return rec.total_tokens if rec is not None else 0
+
+def expand(topic: str, hierarchy: list[str], model: Optional[str] = None, timeout: Optional[float] = None) -> Optional[Iterable[Any]]:
+    _LAST.usage = None
+    if not model:
+        models = candidate_models()
+        model = random.choice(models) if models else "openai/gpt-4o-mini"
     path = " > ".join(hierarchy)
     prompt = build_expand_prompt(topic, path)
-    resp = chat_request(client, model, prompt, response_model=Subtopics)
+    used: dict[str, Any] = {}
+
+    def attempt(ep: Endpoint) -> Any:
+        used["endpoint"] = ep.name
+        used["t0"] = time.perf_counter()
+        return chat_request(ep.client("instructor", openai_client), model, prompt, response_model=Subtopics, timeout=timeout)
+
+    with metrics.span("expand", model=model, depth=len(hierarchy) - 1):
+        resp = get_pool().call(attempt, model)
+    rec = usage_ledger.usage_from_response(
+        getattr(resp, "_raw_response", None),
+        stage="ontology",
+        model=model,
+        latency=time.perf_counter() - used["t0"],
+        depth=len(hierarchy) - 1,
+        endpoint=used["endpoint"],
+    )
+    _LAST.usage = rec
+    usage_ledger.record(rec)
+    metrics.inc("llm_requests_total", stage="ontology", model=rec.model)
+    metrics.inc("llm_tokens_total", rec.total_tokens, stage="ontology", model=rec.model)
     if not resp.subtopics:
         return []
     result: list[tuple[str, str, int]] = []
@@ -0,0 +1,203 @@
+from __future__ import annotations
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+ExpandFn = Callable[[str, List[str], Optional[str], Optional[float]], Any]
+TokensFn = Callable[[], int]
+
+try:
+    from telemetry import metrics
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from telemetry import metrics
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200, min_samples: int = 20, quantile: float = 0.95) -> None:
+        self.min_samples = int(min_samples)
+        self.quantile = float(quantile)
+        self._samples: Deque[float] = deque(maxlen=int(window))
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(float(seconds))
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def threshold(self) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            s = sorted(self._samples)
+        return s[min(len(s) - 1, int(round((len(s) - 1) * self.quantile)))]
+
+
+class ExpansionEngine:
+    def __init__(
+        self,
+        expand_fn: ExpandFn,
+        tokens_fn: TokensFn,
+        models: Optional[List[str]] = None,
+        hedge: bool = True,
+        prefetch: int = 0,
+        tracker: Optional[LatencyTracker] = None,
+        seed: Optional[int] = None,
+        timeout_factor: float = 4.0,
+    ) -> None:
+        self.expand_fn = expand_fn
+        self.tokens_fn = tokens_fn
+        self.models = list(models or [])
+        self.hedge = hedge
+        self.prefetch_depth = max(0, int(prefetch))
+        self.max_pending = 4 * self.prefetch_depth
+        self.tracker = tracker if tracker is not None else LatencyTracker()
+        self.timeout_factor = float(timeout_factor)
+        self._rng = random.Random(seed)
+        # Hedged calls run on their own threads: a losing call that is still running
+        # must not hold a slot that the next primary or backup needs.
+        self._coord = ThreadPoolExecutor(max_workers=self.prefetch_depth + 1, thread_name_prefix="hedge")
+        self._pending: Dict[str, Future] = {}
+        self._abandoned: List[Future] = []
+        self._lock = threading.Lock()
+        self._used_calls = 0
+        self._used_tokens = 0
+        self.stats: Dict[str, int] = {"calls": 0, "hedges": 0, "hedge_wins": 0, "prefetched": 0, "prefetch_hits": 0, "prefetch_wasted": 0}
+
+    def _pick(self, avoid: Optional[str] = None) -> Optional[str]:
+        if not self.models:
+            return None
+        choices = [m for m in self.models if m != avoid] or self.models
+        with self._lock:
+            return self._rng.choice(choices)
+
+    def _call(self, topic: str, hierarchy: List[str], model: Optional[str], timeout: Optional[float] = None) -> Tuple[Any, float]:
+        t0 = time.perf_counter()
+        try:
+            return self.expand_fn(topic, hierarchy, model, timeout), time.perf_counter() - t0
+        finally:
+            with self._lock:
+                self._used_calls += 1
+                self._used_tokens += int(self.tokens_fn() or 0)
+                self.stats["calls"] += 1
+
+    def _spawn(self, *args: Any) -> Future:
+        fut: Future = Future()
+
+        def run() -> None:
+            if not fut.set_running_or_notify_cancel():
+                return
+            try:
+                fut.set_result(self._call(*args))
+            except BaseException as e:
+                fut.set_exception(e)
+
+        threading.Thread(target=run, name="expand", daemon=True).start()
+        return fut
+
+    def _hedged(self, topic: str, hierarchy: List[str]) -> Any:
+        model = self._pick()
+        after = self.tracker.threshold() if self.hedge else None
+        if after is None:
+            result, latency = self._call(topic, hierarchy, model)
+            self.tracker.record(latency)
+            return result
+        timeout = after * self.timeout_factor if self.timeout_factor > 0 else None
+        primary = self._spawn(topic, hierarchy, model, timeout)
+        done, _ = wait([primary], timeout=after)
+        if done:
+            result, latency = primary.result()
+            self.tracker.record(latency)
+            return result
+        backup = self._spawn(topic, hierarchy, self._pick(avoid=model), timeout)
+        with self._lock:
+            self.stats["hedges"] += 1
+        metrics.inc("ontology_hedges_total")
+        pending = {primary, backup}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    result, latency = fut.result()
+                except Exception as e:
+                    error = e
+                    continue
+                self.tracker.record(latency)
+                if fut is backup:
+                    with self._lock:
+                        self.stats["hedge_wins"] += 1
+                    metrics.inc("ontology_hedge_wins_total")
+                return result
+        raise error if error is not None else RuntimeError("hedged expand produced no result")
+
+    def submit(self, topic: str, hierarchy: List[str]) -> Future:
+        return self._coord.submit(self._hedged, topic, list(hierarchy))
+
+    def prefetch(self, items: Iterable[Tuple[str, str, List[str]]]) -> None:
+        if self.prefetch_depth <= 0:
+            return
+        for nid, topic, hierarchy in items:
+            with self._lock:
+                self._abandoned = [f for f in self._abandoned if not f.done()]
+                in_flight = len(self._abandoned) + sum(1 for f in self._pending.values() if not f.done())
+                if nid in self._pending or in_flight >= self.prefetch_depth:
+                    continue
+            fut = self.submit(topic, hierarchy)
+            with self._lock:
+                self._pending[nid] = fut
+                self.stats["prefetched"] += 1
+            metrics.inc("ontology_prefetch_total")
+        while len(self._pending) > self.max_pending:
+            self.discard(next(iter(self._pending)))
+
+    def expand(self, nid: str, topic: str, hierarchy: List[str], lookahead: Iterable[Tuple[str, str, List[str]]] = ()) -> Any:
+        with self._lock:
+            fut = self._pending.pop(nid, None)
+            if fut is not None:
+                self.stats["prefetch_hits"] += 1
+        if fut is None:
+            fut = self.submit(topic, hierarchy)
+        else:
+            metrics.inc("ontology_prefetch_hits_total")
+        self.prefetch(lookahead)
+        return fut.result()
+
+    def discard(self, nid: str) -> None:
+        with self._lock:
+            fut = self._pending.pop(nid, None)
+        if fut is not None:
+            with self._lock:
+                self.stats["prefetch_wasted"] += 1
+                # A prefetch that already started still runs to the end and holds a _coord worker.
+                if not fut.cancel() and not fut.done():
+                    self._abandoned.append(fut)
+
+    def take_usage(self) -> Tuple[int, int]:
+        with self._lock:
+            calls, tokens = self._used_calls, self._used_tokens
+            self._used_calls = 0
+            self._used_tokens = 0
+        return calls, tokens
+
+    def close(self) -> None:
+        with self._lock:
+            pending = list(self._pending.values())
+            self.stats["prefetch_wasted"] += len(pending)
+            self._pending.clear()
+        for fut in pending:
+            fut.cancel()
+        self._coord.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self) -> "ExpansionEngine":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
@@ -1,15 +1,40 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import List, Optional, Iterable, Dict, Any, Tuple
+from typing import TYPE_CHECKING, Callable, List, Optional, Iterable, Dict, Any, Tuple
+import argparse
 import os
 import pickle
+import sys
 import networkx as nx
-from generator import expand
-from flask_socketio import SocketIO
+from topic_index import TopicIndex, normalize_topic
+from scheduler import ExpansionScheduler, parse_depth_quota
+try:
+    from telemetry import metrics, profiling, usage as usage_ledger
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from telemetry import metrics, profiling, usage as usage_ledger
+from hedging import ExpandFn, ExpansionEngine, LatencyTracker
+from analytics import OntologyStats, cache_path_for, source_signature
+from snapshot import snapshot_path_for, write_snapshot
+
+if TYPE_CHECKING:
+    from flask_socketio import SocketIO
 
 ROOT_TOPIC = "Knowledge"
 
 
+def expand(topic: str, hierarchy: List[str], model: Optional[str] = None, timeout: Optional[float] = None) -> Optional[Iterable[Any]]:
+    from generator import expand as llm_expand
+
+    return llm_expand(topic, hierarchy, model, timeout)
+
+
+def last_call_tokens() -> int:
+    from generator import last_call_tokens as llm_last_call_tokens
+
+    return llm_last_call_tokens()
+
+
 @dataclass
 class Node:
     id: str
@@ -60,7 +85,7 @@ def load_graph(csv_path: str) -> nx.DiGraph:
     gpath = graph_path_from_csv(csv_path)
     if os.path.exists(gpath) and os.path.getsize(gpath) > 0:
         try:
-            with open(gpath, "rb") as f:
+            with metrics.span("load_graph"), open(gpath, "rb") as f:
                 G = pickle.load(f)
             if not isinstance(G, nx.DiGraph):
                 G = nx.DiGraph(G)
@@ -73,8 +98,9 @@ def load_graph(csv_path: str) -> nx.DiGraph:
 def persist_graph(G: nx.DiGraph, csv_path: str) -> None:
     gpath = graph_path_from_csv(csv_path)
     ensure_parent_dir(gpath)
-    with open(gpath, "wb") as f:
-        pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with metrics.span("persist_graph", nodes=G.number_of_nodes()):
+        with open(gpath, "wb") as f:
+            pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 
 def nodes_from_graph(G: nx.DiGraph) -> List[Node]:
@@ -148,7 +174,7 @@ def index_by_id(nodes: List[Node]) -> Dict[str, Node]:
 def index_by_topic_ci(nodes: List[Node]) -> Dict[str, Node]:
     idx: Dict[str, Node] = {}
     for n in nodes:
-        key = n.topic.strip().lower()
+        key = normalize_topic(n.topic)
         if key and key not in idx:
             idx[key] = n
     return idx
@@ -172,15 +198,93 @@ def first_unexpanded(nodes: List[Node]) -> Optional[Node]:
     return None
 
 
-def build_topic_index(G: nx.DiGraph) -> Dict[str, str]:
-    idx: Dict[str, str] = {}
+def build_topic_index(G: nx.DiGraph) -> TopicIndex:
+    idx = TopicIndex()
     for nid, data in G.nodes(data=True):
-        key = str(data.get("topic", "")).strip().lower()
-        if key and key not in idx:
-            idx[key] = str(nid)
+        idx.add(str(data.get("topic", "")), str(nid))
     return idx
 
 
+def next_unexpanded(G: nx.DiGraph, scheduler: Optional[ExpansionScheduler] = None) -> Optional[str]:
+    if scheduler is not None:
+        return scheduler.pop()
+    for nid, data in G.nodes(data=True):
+        if normalize_expanded(data.get("expanded", "false")) == "false":
+            return str(nid)
+    return None
+
+
+def peek_frontier(G: nx.DiGraph, scheduler: Optional[ExpansionScheduler], k: int, exclude: str) -> List[str]:
+    if k <= 0:
+        return []
+    if scheduler is not None:
+        return [nid for nid in scheduler.peek(k + 1) if nid != exclude][:k]
+    out: List[str] = []
+    for nid, data in G.nodes(data=True):
+        sid = str(nid)
+        if sid != exclude and normalize_expanded(data.get("expanded", "false")) == "false" and int(data.get("importance", 0) or 0) >= 6:
+            out.append(sid)
+            if len(out) >= k:
+                break
+    return out
+
+
+def hierarchy_of(G: nx.DiGraph, nid: str) -> List[str]:
+    chain: List[str] = []
+    cur: Optional[str] = nid
+    seen = set()
+    while cur is not None and cur not in seen and G.has_node(cur):
+        seen.add(cur)
+        chain.append(str(G.nodes[cur].get("topic", "")))
+        pid = G.nodes[cur].get("parentid")
+        cur = None if pid in (None, "", "None") else str(pid)
+    return list(reversed(chain))
+
+
+def expand_node(G: nx.DiGraph, nid: str, engine: Optional[ExpansionEngine], scheduler: Optional[ExpansionScheduler]) -> Optional[Iterable[Any]]:
+    topic = str(G.nodes[nid].get("topic", ""))
+    hierarchy = hierarchy_of(G, nid)
+    if engine is None:
+        return expand(topic, hierarchy)
+    lookahead = [(p, str(G.nodes[p].get("topic", "")), hierarchy_of(G, p)) for p in peek_frontier(G, scheduler, engine.prefetch_depth, nid)]
+    return engine.expand(nid, topic, hierarchy, lookahead)
+
+
+def charge_usage(engine: Optional[ExpansionEngine], scheduler: Optional[ExpansionScheduler]) -> None:
+    if scheduler is None:
+        return
+    if engine is None:
+        scheduler.charge(last_call_tokens())
+        return
+    calls, tokens = engine.take_usage()
+    scheduler.charge(tokens, calls=calls)
+
+
+def make_engine(hedge: bool, prefetch: int, min_samples: int = 20, quantile: float = 0.95, expand_fn: Optional[ExpandFn] = None, timeout_factor: float = 4.0) -> Optional[ExpansionEngine]:
+    if expand_fn is None and not hedge and prefetch <= 0:
+        return None
+    from generator import candidate_models
+
+    return ExpansionEngine(
+        expand_fn or expand,
+        lambda: last_call_tokens(),
+        models=candidate_models(),
+        hedge=hedge,
+        prefetch=prefetch,
+        tracker=LatencyTracker(min_samples=min_samples, quantile=quantile),
+        timeout_factor=timeout_factor,
+    )
+
+
+def seed_scheduler(G: nx.DiGraph, scheduler: Optional[ExpansionScheduler]) -> List[str]:
+    if scheduler is None:
+        return []
+    rejected = scheduler.seed(G)
+    for nid in rejected:
+        G.nodes[nid]["expanded"] = "skipped"
+    return rejected
+
+
 def ensure_root(G: nx.DiGraph) -> None:
     if G.number_of_nodes() == 0:
         G.add_node("root", topic=ROOT_TOPIC, parentid=None, expanded="false", depth=0, importance=10)
@@ -238,7 +342,7 @@ def add_children(nodes: List[Node], parent: Node, children: Iterable[Any]) -> in
         normalized = normalize_node(child, parentid=parent.id, parentdepth=parent.depth)
         if not normalized:
             continue
-        key = normalized.topic.strip().lower()
+        key = normalize_topic(normalized.topic)
         existing = by_topic.get(key)
         if existing:
             # Node with same topic exists, only ensure parentid on first link if child has no primary parent
@@ -253,10 +357,11 @@ def add_children(nodes: List[Node], parent: Node, children: Iterable[Any]) -> in
     return added
 
 
-def generate_tree_live(socketio: SocketIO, csv_path: str, max_nodes: int = 1000) -> None:
+def generate_tree_live(socketio: SocketIO, csv_path: str, max_nodes: int = 1000, scheduler: Optional[ExpansionScheduler] = None, engine: Optional[ExpansionEngine] = None) -> None:
     G = load_graph(csv_path)
     ensure_root(G)
     topic_idx = build_topic_index(G)
+    seed_scheduler(G, scheduler)
     socketio.emit('existing_nodes', [n.__dict__ for n in nodes_from_graph(G)])
     existing_edges = [
         {"parentid": str(u), "childid": str(v), "relation": d.get("relation", "is_a"), "order": int(d.get("order", 0) or 0)}
@@ -269,11 +374,7 @@ def generate_tree_live(socketio: SocketIO, csv_path: str, max_nodes: int = 1000)
     while total_added < max_nodes:
         if G.number_of_nodes() >= max_nodes:
             break
-        current_id = None
-        for nid, data in G.nodes(data=True):
-            if normalize_expanded(data.get("expanded", "false")) == "false":
-                current_id = str(nid)
-                break
+        current_id = next_unexpanded(G, scheduler)
         if current_id is None:
             break
 
@@ -294,12 +395,12 @@ def generate_tree_live(socketio: SocketIO, csv_path: str, max_nodes: int = 1000)
             children = None
         else:
             try:
-                nodes_by_id = {str(nid): Node(id=str(nid), topic=str(d.get("topic", "")), parentid=d.get("parentid"), expanded=normalize_expanded(d.get("expanded", "false")), depth=int(d.get("depth", 0) or 0), importance=int(d.get("importance", 0) or 0)) for nid, d in G.nodes(data=True)}
-                hierarchy = get_hierarchy(current, nodes_by_id)
-                children = expand(current.topic, hierarchy)
+                children = expand_node(G, current.id, engine, scheduler)
             except Exception as e:
                 print(f"Failed to expand {current.topic}: {e}")
+                metrics.inc("ontology_expand_failures_total", error=type(e).__name__)
                 children = None
+            charge_usage(engine, scheduler)
 
         new_nodes: List[Node] = []
         new_edges: List[Edge] = []
@@ -309,10 +410,9 @@ def generate_tree_live(socketio: SocketIO, csv_path: str, max_nodes: int = 1000)
                 normalized = normalize_node(child, parentid=current.id, parentdepth=current.depth)
                 if not normalized:
                     continue
-                key = normalized.topic.strip().lower()
-                existing_id = topic_idx.get(key)
+                existing_id = topic_idx.lookup(normalized.topic)
                 if existing_id:
-                    if not G.has_edge(current.id, existing_id):
+                    if existing_id != current.id and not G.has_edge(current.id, existing_id):
                         G.add_edge(current.id, existing_id, relation="is_a", order=0)
                         new_edges.append(Edge(parentid=current.id, childid=existing_id))
                 else:
@@ -327,13 +427,19 @@ def generate_tree_live(socketio: SocketIO, csv_path: str, max_nodes: int = 1000)
                         depth=current.depth + 1,
                         importance=int(getattr(normalized, "importance", 0) or 0),
                     )
-                    topic_idx[key] = normalized.id
+                    topic_idx.add(normalized.topic, normalized.id)
                     new_nodes.append(Node(id=normalized.id, topic=normalized.topic, parentid=current.id, expanded="false", depth=current.depth + 1, importance=int(getattr(normalized, "importance", 0) or 0)))
+                    if scheduler is not None and not scheduler.push(normalized.id, int(getattr(normalized, "importance", 0) or 0), current.depth + 1, current.id):
+                        G.nodes[normalized.id]["expanded"] = "skipped"
                     G.add_edge(current.id, normalized.id, relation="is_a", order=0)
                     new_edges.append(Edge(parentid=current.id, childid=normalized.id))
 
             G.nodes[current.id]["expanded"] = "true"
+            if scheduler is not None:
+                scheduler.mark_expanded(current.id)
             total_added += len(new_nodes)
+            metrics.inc("ontology_nodes_added_total", len(new_nodes))
+            metrics.set_gauge("ontology_nodes", G.number_of_nodes())
             persist_graph(G, csv_path)
             if reached_limit:
                 break
@@ -357,20 +463,46 @@ def generate_tree_live(socketio: SocketIO, csv_path: str, max_nodes: int = 1000)
             persist_graph(G, csv_path)
             socketio.emit('batch_ready', {"parentid": current.id, "children": []})
 
-def update_csv_tree(csv_path: str, max_nodes: int = 1000) -> List[Node]:
-    G = load_graph(csv_path)
+def update_stats_cache(G: nx.DiGraph, csv_path: str) -> OntologyStats:
+    gpath = graph_path_from_csv(csv_path)
+    cache = cache_path_for(gpath)
+    stats = OntologyStats.load(cache)
+    if stats is None:
+        stats = OntologyStats.from_graph(G)
+    else:
+        stats.sync(G)
+    stats.save(cache, source_signature(gpath))
+    return stats
+
+
+def update_csv_tree(
+    csv_path: str,
+    max_nodes: int = 1000,
+    scheduler: Optional[ExpansionScheduler] = None,
+    engine: Optional[ExpansionEngine] = None,
+    stats: bool = False,
+    graph: Optional[nx.DiGraph] = None,
+    journal: Any = None,
+    on_node: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+) -> List[Node]:
+    G = graph if graph is not None else load_graph(csv_path)
     ensure_root(G)
     topic_idx = build_topic_index(G)
+    for nid in seed_scheduler(G, scheduler):
+        if journal is not None:
+            journal.state(nid, "skipped")
+
+    def checkpoint() -> None:
+        if journal is not None:
+            journal.flush()
+        else:
+            persist_graph(G, csv_path)
 
     total_added = 0
     while total_added < max_nodes:
         if G.number_of_nodes() >= max_nodes:
             break
-        current_id = None
-        for nid, data in G.nodes(data=True):
-            if normalize_expanded(data.get("expanded", "false")) == "false":
-                current_id = str(nid)
-                break
+        current_id = next_unexpanded(G, scheduler)
         if current_id is None:
             break
 
@@ -380,16 +512,17 @@ def update_csv_tree(csv_path: str, max_nodes: int = 1000) -> List[Node]:
 
         if int(current_importance or 0) < 6:
             G.nodes[current_id]["expanded"] = "skipped"
-            persist_graph(G, csv_path)
+            if journal is not None:
+                journal.state(current_id, "skipped")
+            checkpoint()
             continue
         try:
-            nodes_by_id = {str(nid): Node(id=str(nid), topic=str(d.get("topic", "")), parentid=d.get("parentid"), expanded=normalize_expanded(d.get("expanded", "false")), depth=int(d.get("depth", 0) or 0), importance=int(d.get("importance", 0) or 0)) for nid, d in G.nodes(data=True)}
-            current_node = nodes_by_id[current_id]
-            hierarchy = get_hierarchy(current_node, nodes_by_id)
-            children = expand(current_topic, hierarchy)
+            children = expand_node(G, current_id, engine, scheduler)
         except Exception as e:
             print(f"Failed to expand {current_topic}: {e}")
+            metrics.inc("ontology_expand_failures_total", error=type(e).__name__)
             children = None
+        charge_usage(engine, scheduler)
 
         new_nodes_count = 0
         if isinstance(children, list) and len(children) > 0:
@@ -398,11 +531,12 @@ def update_csv_tree(csv_path: str, max_nodes: int = 1000) -> List[Node]:
                 normalized = normalize_node(child, parentid=current_id, parentdepth=current_depth)
                 if not normalized:
                     continue
-                key = normalized.topic.strip().lower()
-                existing_id = topic_idx.get(key)
+                existing_id = topic_idx.lookup(normalized.topic)
                 if existing_id:
-                    if not G.has_edge(current_id, existing_id):
+                    if existing_id != current_id and not G.has_edge(current_id, existing_id):
                         G.add_edge(current_id, existing_id, relation="is_a", order=0)
+                        if journal is not None:
+                            journal.edge(current_id, existing_id, "is_a")
                 else:
                     if G.number_of_nodes() >= max_nodes:
                         reached_limit = True
@@ -415,37 +549,107 @@ def update_csv_tree(csv_path: str, max_nodes: int = 1000) -> List[Node]:
                         depth=current_depth + 1,
                         importance=int(getattr(normalized, "importance", 0) or 0),
                     )
-                    topic_idx[key] = normalized.id
+                    topic_idx.add(normalized.topic, normalized.id)
                     G.add_edge(current_id, normalized.id, relation="is_a", order=0)
                     new_nodes_count += 1
+                    if scheduler is not None and not scheduler.push(normalized.id, int(getattr(normalized, "importance", 0) or 0), current_depth + 1, current_id):
+                        G.nodes[normalized.id]["expanded"] = "skipped"
+                    if journal is not None:
+                        journal.node(normalized.id, G.nodes[normalized.id])
+                    if on_node is not None:
+                        on_node(normalized.id, G.nodes[normalized.id])
 
             G.nodes[current_id]["expanded"] = "true"
+            if journal is not None:
+                journal.state(current_id, "true")
+            if scheduler is not None:
+                scheduler.mark_expanded(current_id)
             total_added += new_nodes_count
-            persist_graph(G, csv_path)
+            metrics.inc("ontology_nodes_added_total", new_nodes_count)
+            metrics.set_gauge("ontology_nodes", G.number_of_nodes())
+            if scheduler is not None:
+                metrics.set_gauge("ontology_frontier", len(scheduler))
+            checkpoint()
             if reached_limit:
                 break
         elif isinstance(children, list) and len(children) == 0:
             G.nodes[current_id]["expanded"] = "skipped"
-            persist_graph(G, csv_path)
+            if journal is not None:
+                journal.state(current_id, "skipped")
+            checkpoint()
         else:
             if normalize_expanded(G.nodes[current_id].get("expanded", "false")) == "skipped":
                 G.nodes[current_id]["expanded"] = "skipped"
             else:
                 G.nodes[current_id]["expanded"] = "true"
-            persist_graph(G, csv_path)
+            if journal is not None:
+                journal.state(current_id, G.nodes[current_id]["expanded"])
+            checkpoint()
 
+    if stats and os.path.exists(graph_path_from_csv(csv_path)):
+        gpath = graph_path_from_csv(csv_path)
+        write_snapshot(G, update_stats_cache(G, csv_path), snapshot_path_for(gpath), source_signature(gpath))
     return nodes_from_graph(G)
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))
 CSV_PATH = os.path.join(ROOT_DIR, "data", "ontology", "tree.csv")
+USAGE_PATH = os.path.join(ROOT_DIR, "data", "usage.jsonl")
 MAX_NODES = 30000
 
 
+def add_builder_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--best-first", action="store_true")
+    parser.add_argument("--max-calls", type=int, default=None)
+    parser.add_argument("--max-tokens", type=int, default=None)
+    parser.add_argument("--depth-quota", default="", help="comma-separated depth:limit pairs, e.g. 3:200,4:800")
+    parser.add_argument("--subtree-quota", type=int, default=None)
+    parser.add_argument("--depth-penalty", type=float, default=0.5)
+    parser.add_argument("--sibling-penalty", type=float, default=0.25)
+    parser.add_argument("--usage-ledger", default=USAGE_PATH, help="append per-request token usage here; empty to disable")
+    parser.add_argument("--hedge", action="store_true", help="duplicate expansions slower than the observed p95 to another candidate model")
+    parser.add_argument("--hedge-quantile", type=float, default=0.95)
+    parser.add_argument("--hedge-min-samples", type=int, default=20)
+    parser.add_argument("--hedge-timeout", type=float, default=4.0, help="per-request timeout of hedged calls, as a multiple of the hedge threshold; 0 to disable")
+    parser.add_argument("--prefetch", type=int, default=0, help="speculatively expand up to N likely-next frontier nodes")
+    profiling.add_arguments(parser)
+
+
+def configure_builder(args: argparse.Namespace, expand_fn: Optional[ExpandFn] = None, best_first: bool = False) -> Tuple[Optional[ExpansionScheduler], Optional[ExpansionEngine]]:
+    metrics.configure_from_env()
+    profiling.configure_from_args(args)
+    usage_ledger.configure(args.usage_ledger or None)
+    scheduler = None
+    if best_first or args.best_first or args.max_calls or args.max_tokens or args.depth_quota or args.subtree_quota:
+        scheduler = ExpansionScheduler(
+            depth_penalty=args.depth_penalty,
+            sibling_penalty=args.sibling_penalty,
+            depth_quota=parse_depth_quota(args.depth_quota),
+            subtree_quota=args.subtree_quota,
+            max_calls=args.max_calls,
+            max_tokens=args.max_tokens,
+        )
+    return scheduler, make_engine(args.hedge, args.prefetch, args.hedge_min_samples, args.hedge_quantile, expand_fn, args.hedge_timeout)
+
+
 def main() -> None:
-    nodes = update_csv_tree(CSV_PATH, max_nodes=MAX_NODES)
-    print(f"Wrote {len(nodes)} nodes to {CSV_PATH}")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", default=CSV_PATH)
+    parser.add_argument("--max-nodes", type=int, default=MAX_NODES)
+    add_builder_arguments(parser)
+    args = parser.parse_args()
+    scheduler, engine = configure_builder(args)
+    try:
+        nodes = update_csv_tree(args.csv, max_nodes=args.max_nodes, scheduler=scheduler, engine=engine, stats=True)
+    finally:
+        if engine is not None:
+            engine.close()
+    print(f"Wrote {len(nodes)} nodes to {args.csv}")
+    if scheduler is not None:
+        print(f"Scheduler: {scheduler.stats()}")
+    if engine is not None:
+        print(f"Expansion: {engine.stats}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+from __future__ import annotations
+import heapq
+import itertools
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+
+def parse_depth_quota(spec: str) -> Dict[int, int]:
+    quota: Dict[int, int] = {}
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        depth, _, limit = part.partition(":")
+        quota[int(depth)] = int(limit)
+    return quota
+
+
+class ExpansionScheduler:
+    def __init__(
+        self,
+        depth_penalty: float = 0.5,
+        sibling_penalty: float = 0.25,
+        min_importance: int = 6,
+        depth_quota: Optional[Dict[int, int]] = None,
+        subtree_quota: Optional[int] = None,
+        max_calls: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+    ) -> None:
+        self.depth_penalty = float(depth_penalty)
+        self.sibling_penalty = float(sibling_penalty)
+        self.min_importance = int(min_importance)
+        self.depth_quota = dict(depth_quota or {})
+        self.subtree_quota = subtree_quota
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.calls = 0
+        self.tokens = 0
+        self.dropped = 0
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._meta: Dict[str, Tuple[int, int, Optional[str]]] = {}
+        self._top: Dict[str, str] = {}
+        self._expanded_children: Dict[str, int] = {}
+        self._depth_used: Dict[int, int] = {}
+        self._subtree_used: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def priority(self, nid: str) -> float:
+        importance, depth, parentid = self._meta[nid]
+        siblings = self._expanded_children.get(parentid or "", 0)
+        return -importance + self.depth_penalty * depth + self.sibling_penalty * siblings
+
+    def top_level(self, nid: str) -> str:
+        return self._top.get(nid, nid)
+
+    def _register(self, nid: str, importance: int, depth: int, parentid: Optional[str]) -> None:
+        self._meta[nid] = (int(importance), int(depth), parentid)
+        if depth <= 1 or parentid is None:
+            self._top[nid] = nid
+        else:
+            self._top[nid] = self._top.get(parentid, parentid)
+
+    def push(self, nid: str, importance: int, depth: int, parentid: Optional[str]) -> bool:
+        self._register(nid, importance, depth, parentid)
+        if int(importance) < self.min_importance:
+            return False
+        heapq.heappush(self._heap, (self.priority(nid), next(self._seq), nid))
+        return True
+
+    def seed(self, G: nx.DiGraph) -> List[str]:
+        rejected: List[str] = []
+        order = sorted(G.nodes(data=True), key=lambda item: int(item[1].get("depth", 0) or 0))
+        for nid, data in order:
+            sid = str(nid)
+            pid = data.get("parentid")
+            pid = None if pid in (None, "", "None") else str(pid)
+            importance = int(data.get("importance", 0) or 0)
+            depth = int(data.get("depth", 0) or 0)
+            state = str(data.get("expanded", "false")).strip().lower()
+            if state == "false":
+                if not self.push(sid, importance, depth, pid):
+                    rejected.append(sid)
+            else:
+                self._register(sid, importance, depth, pid)
+                if state == "true" and pid is not None:
+                    self._expanded_children[pid] = self._expanded_children.get(pid, 0) + 1
+        return rejected
+
+    def exhausted(self) -> bool:
+        if self.max_calls is not None and self.calls >= self.max_calls:
+            return True
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return True
+        return False
+
+    def _within_quota(self, nid: str) -> bool:
+        _, depth, _ = self._meta[nid]
+        limit = self.depth_quota.get(depth)
+        if limit is not None and self._depth_used.get(depth, 0) >= limit:
+            return False
+        if self.subtree_quota is not None and depth >= 1:
+            if self._subtree_used.get(self.top_level(nid), 0) >= self.subtree_quota:
+                return False
+        return True
+
+    def pop(self) -> Optional[str]:
+        while self._heap and not self.exhausted():
+            prio, _, nid = heapq.heappop(self._heap)
+            current = self.priority(nid)
+            if current > prio:
+                heapq.heappush(self._heap, (current, next(self._seq), nid))
+                continue
+            if not self._within_quota(nid):
+                self.dropped += 1
+                continue
+            _, depth, _ = self._meta[nid]
+            self._depth_used[depth] = self._depth_used.get(depth, 0) + 1
+            if depth >= 1:
+                top = self.top_level(nid)
+                self._subtree_used[top] = self._subtree_used.get(top, 0) + 1
+            return nid
+        return None
+
+    def peek(self, k: int) -> List[str]:
+        return [nid for _, _, nid in heapq.nsmallest(k, self._heap)]
+
+    def charge(self, tokens: int = 0, calls: int = 1) -> None:
+        with self._lock:
+            self.calls += int(calls)
+            self.tokens += int(tokens or 0)
+
+    def mark_expanded(self, nid: str) -> None:
+        meta = self._meta.get(nid)
+        if meta is None or meta[2] is None:
+            return
+        self._expanded_children[meta[2]] = self._expanded_children.get(meta[2], 0) + 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "tokens": self.tokens,
+            "queued": len(self._heap),
+            "dropped": self.dropped,
+        }
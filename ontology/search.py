@@ -0,0 +1,238 @@
+from __future__ import annotations
+import argparse
+import bisect
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from analytics import OntologyStats, load_stats
+from topic_index import char_ngrams, normalize_topic, topic_tokens
+
+MIN_PREFIX = 2
+MIN_TRIGRAM_SCORE = 0.3
+MAX_PREFIX_TOKENS = 2000
+
+
+def csr(groups: Dict[str, List[int]]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    names = sorted(groups)
+    ptr = np.zeros(len(names) + 1, dtype=np.int64)
+    ptr[1:] = np.cumsum([len(groups[k]) for k in names])
+    post = np.array([i for k in names for i in groups[k]], dtype=np.int64)
+    return names, ptr, post
+
+
+class SearchIndex:
+    def __init__(
+        self,
+        ids: Sequence[str],
+        topics: Sequence[str],
+        keys: Sequence[str],
+        tokens: Sequence[str],
+        grams: Sequence[str],
+        index: Any,
+        arrays: Dict[str, np.ndarray],
+    ) -> None:
+        self.ids = ids
+        self.topics = topics
+        self.keys = keys
+        self.tokens = tokens
+        self.grams = grams
+        self.index = index
+        self.parent = arrays["parent"]
+        self.depth = arrays["depth"]
+        self.token_ptr = arrays["token_ptr"]
+        self.token_post = arrays["token_post"]
+        self.gram_ptr = arrays["gram_ptr"]
+        self.gram_post = arrays["gram_post"]
+        self.gram_counts = arrays["gram_counts"]
+        self.sorted_keys = arrays["sorted_keys"]
+        self.child_order = arrays["child_order"]
+        self.child_parent = arrays["child_parent"]
+
+    @classmethod
+    def build(cls, ids: List[str], topics: List[str], parent: np.ndarray, depth: np.ndarray) -> "SearchIndex":
+        keys = [normalize_topic(t) for t in topics]
+        by_token: Dict[str, List[int]] = {}
+        by_gram: Dict[str, List[int]] = {}
+        gram_counts = np.zeros(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            for tok in set(key.split()):
+                by_token.setdefault(tok, []).append(i)
+            grams = char_ngrams(key)
+            gram_counts[i] = len(grams)
+            for gram in grams:
+                by_gram.setdefault(gram, []).append(i)
+        tokens, token_ptr, token_post = csr(by_token)
+        grams, gram_ptr, gram_post = csr(by_gram)
+        parent = np.asarray(parent, dtype=np.int64)
+        order = np.argsort(parent, kind="stable")
+        child_order = order[parent[order] >= 0]
+        arrays = {
+            "parent": parent,
+            "depth": np.asarray(depth, dtype=np.int32),
+            "token_ptr": token_ptr,
+            "token_post": token_post,
+            "gram_ptr": gram_ptr,
+            "gram_post": gram_post,
+            "gram_counts": gram_counts,
+            "sorted_keys": np.array(sorted(range(len(keys)), key=keys.__getitem__), dtype=np.int64),
+            "child_order": child_order,
+            "child_parent": parent[child_order],
+        }
+        return cls(ids, topics, keys, tokens, grams, {nid: i for i, nid in enumerate(ids)}, arrays)
+
+    @classmethod
+    def from_stats(cls, stats: OntologyStats) -> "SearchIndex":
+        n = stats.n
+        return cls.build(list(stats.ids), list(stats.topics), stats.parent[:n].copy(), stats.depth[:n].copy())
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _token_matches(self, token: str, prefix: bool) -> np.ndarray:
+        lo = bisect.bisect_left(self.tokens, token)
+        if not prefix or len(token) < MIN_PREFIX:
+            hi = lo + 1 if lo < len(self.tokens) and self.tokens[lo] == token else lo
+        else:
+            hi = lo
+            while hi < len(self.tokens) and hi - lo < MAX_PREFIX_TOKENS and self.tokens[hi].startswith(token):
+                hi += 1
+        if hi == lo:
+            return np.empty(0, np.int64)
+        hits = self.token_post[int(self.token_ptr[lo]) : int(self.token_ptr[hi])]
+        return hits if hi == lo + 1 else np.unique(hits)
+
+    def _name_prefix(self, key: str) -> Set[int]:
+        lo = bisect.bisect_left(self.sorted_keys, key, key=self.keys.__getitem__)
+        out: Set[int] = set()
+        for j in range(lo, min(len(self.sorted_keys), lo + MAX_PREFIX_TOKENS)):
+            i = int(self.sorted_keys[j])
+            if not self.keys[i].startswith(key):
+                break
+            out.add(i)
+        return out
+
+    def _postings(self, gram: str) -> Optional[np.ndarray]:
+        k = bisect.bisect_left(self.grams, gram)
+        if k < len(self.grams) and self.grams[k] == gram:
+            return self.gram_post[int(self.gram_ptr[k]) : int(self.gram_ptr[k + 1])]
+        return None
+
+    def _trigram_scores(self, key: str) -> Dict[int, float]:
+        qgrams = char_ngrams(key)
+        postings = [p for p in (self._postings(g) for g in qgrams) if p is not None]
+        if not postings:
+            return {}
+        hits = np.bincount(np.concatenate(postings), minlength=len(self.ids))
+        cand = np.flatnonzero(hits)
+        sims = hits[cand] / (len(qgrams) + self.gram_counts[cand] - hits[cand])
+        keep = sims >= MIN_TRIGRAM_SCORE
+        return dict(zip(cand[keep].tolist(), sims[keep].tolist()))
+
+    def ancestors(self, i: int) -> List[int]:
+        out: List[int] = []
+        p = int(self.parent[i])
+        while p >= 0 and len(out) <= len(self.ids):
+            out.append(p)
+            p = int(self.parent[p])
+        out.reverse()
+        return out
+
+    def children(self, i: int) -> List[int]:
+        lo = int(np.searchsorted(self.child_parent, i, side="left"))
+        hi = int(np.searchsorted(self.child_parent, i, side="right"))
+        return self.child_order[lo:hi].tolist()
+
+    def node(self, i: int) -> Dict[str, Any]:
+        return {"id": self.ids[i], "topic": self.topics[i], "depth": int(self.depth[i])}
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        tokens = topic_tokens(query)
+        key = " ".join(tokens)
+        if not key:
+            return []
+        prefixed = self._name_prefix(key)
+        exact = {i for i in prefixed if self.keys[i] == key}
+        covered: Dict[int, int] = {}
+        matched: List[np.ndarray] = []
+        for k, tok in enumerate(tokens):
+            hits = self._token_matches(tok, prefix=k == len(tokens) - 1 or len(tokens) == 1)
+            matched.append(hits)
+            for i in hits.tolist():
+                covered[i] = covered.get(i, 0) + 1
+        trigram = self._trigram_scores(key)
+        candidates = set(covered) | set(trigram) | prefixed
+        if len(tokens) > 1:
+            token_sets = [set(h.tolist()) for h in matched]
+            for i in list(candidates):
+                if covered.get(i, 0) == len(tokens):
+                    continue
+                path = set(self.ancestors(i))
+                extra = sum(1 for s in token_sets if i not in s and s & path)
+                if extra:
+                    covered[i] = covered.get(i, 0) + 0.5 * extra
+        scored = []
+        for i in candidates:
+            score = (
+                3.0 * (i in exact)
+                + 1.5 * (i in prefixed)
+                + covered.get(i, 0) / len(tokens)
+                + 0.5 * trigram.get(i, 0.0)
+                - 0.01 * int(self.depth[i])
+            )
+            scored.append((-score, len(self.keys[i]), i))
+        scored.sort()
+        out = []
+        for neg, _, i in scored[:limit]:
+            item = self.node(i)
+            item["score"] = round(-neg, 4)
+            item["path"] = [self.node(a) for a in self.ancestors(i)]
+            out.append(item)
+        return out
+
+    def neighbourhood(self, nid: str, siblings: int = 20, children: int = 200) -> Optional[Dict[str, Any]]:
+        i = self.index.get(nid)
+        if i is None:
+            return None
+        chain = self.ancestors(i)
+        members = list(chain) + [i]
+        kids = self.children(i)
+        members += kids[:children]
+        if chain:
+            members += [s for s in self.children(chain[-1]) if s != i][:siblings]
+        seen: Set[int] = set()
+        nodes = []
+        links = []
+        for m in members:
+            if m in seen:
+                continue
+            seen.add(m)
+            p = int(self.parent[m])
+            nodes.append({"id": self.ids[m], "label": self.topics[m], "parentid": self.ids[p] if p >= 0 else None, "depth": int(self.depth[m])})
+        for m in seen:
+            p = int(self.parent[m])
+            if p in seen:
+                links.append({"source": self.ids[p], "target": self.ids[m]})
+        return {"id": nid, "nodes": nodes, "links": links, "children": len(kids)}
+
+
+def main() -> None:
+    root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("query")
+    parser.add_argument("--pkl", default=os.path.join(root_dir, "data", "ontology", "tree.pkl"))
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+    t0 = time.perf_counter()
+    index = SearchIndex.from_stats(load_stats(args.pkl))
+    built = time.perf_counter() - t0
+    t1 = time.perf_counter()
+    results = index.search(args.query, args.limit)
+    print(json.dumps({"results": results, "build_ms": round(built * 1000, 2), "query_ms": round((time.perf_counter() - t1) * 1000, 2)}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
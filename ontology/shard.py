@@ -0,0 +1,357 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import networkx as nx
+
+from ontology_tree import (
+    CSV_PATH,
+    add_builder_arguments,
+    configure_builder,
+    build_topic_index,
+    graph_path_from_csv,
+    load_graph,
+    normalize_expanded,
+    update_csv_tree,
+    update_stats_cache,
+)
+from analytics import source_signature
+from snapshot import snapshot_path_for, write_snapshot
+from telemetry import metrics
+
+STATE_RANK = {"false": 0, "skipped": 1, "true": 2}
+PLAN_FILE = "plan.json"
+JOURNAL_FILE = "journal.jsonl"
+
+
+def shard_dir_for(csv_path: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(csv_path)), "shards")
+
+
+def _write_json(path: str, obj: Any) -> None:
+    d = os.path.dirname(os.path.abspath(path))
+    os.makedirs(d, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", delete=False, dir=d, prefix=".tmp_plan_", suffix=".json", encoding="utf-8") as tmp:
+        json.dump(obj, tmp, ensure_ascii=False, indent=2)
+        tmp_path = tmp.name
+    os.replace(tmp_path, path)
+
+
+def parent_of(data: Dict[str, Any]) -> Optional[str]:
+    pid = data.get("parentid")
+    return None if pid in (None, "", "None") else str(pid)
+
+
+def tree_children(G: nx.DiGraph) -> Dict[str, List[str]]:
+    kids: Dict[str, List[str]] = {}
+    for nid, data in G.nodes(data=True):
+        pid = parent_of(data)
+        if pid is not None:
+            kids.setdefault(pid, []).append(str(nid))
+    return kids
+
+
+def subtree_ids(kids: Dict[str, List[str]], top: str) -> List[str]:
+    out: List[str] = []
+    stack = [top]
+    while stack:
+        nid = stack.pop()
+        out.append(nid)
+        stack.extend(kids.get(nid, ()))
+    return out
+
+
+def make_plan(G: nx.DiGraph, shards: int, signature: Tuple[int, int]) -> Dict[str, Any]:
+    kids = tree_children(G)
+    roots = [str(n) for n, d in G.nodes(data=True) if parent_of(d) is None]
+    domains = sorted(c for r in roots for c in kids.get(r, ()))
+    load: Dict[str, int] = {}
+    for dom in domains:
+        load[dom] = sum(1 for nid in subtree_ids(kids, dom) if normalize_expanded(G.nodes[nid].get("expanded", "false")) == "false")
+    assignment: Dict[str, int] = {}
+    totals = [0] * max(1, shards)
+    for dom in sorted(domains, key=lambda d: (-load[d], d)):
+        k = min(range(len(totals)), key=lambda i: (totals[i], i))
+        assignment[dom] = k
+        totals[k] += load[dom] or 1
+    return {
+        "shards": len(totals),
+        "signature": list(signature),
+        "created": time.time(),
+        "domains": {dom: {"shard": assignment[dom], "topic": str(G.nodes[dom].get("topic", "")), "frontier": load[dom]} for dom in domains},
+    }
+
+
+def load_plan(shard_dir: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(shard_dir, PLAN_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def shard_graph(G: nx.DiGraph, plan: Dict[str, Any], shard: int) -> nx.DiGraph:
+    kids = tree_children(G)
+    keep: List[str] = []
+    for dom, info in plan["domains"].items():
+        if info["shard"] == shard and G.has_node(dom):
+            keep.extend(subtree_ids(kids, dom))
+    ancestors = set()
+    for nid in list(keep):
+        pid = parent_of(G.nodes[nid])
+        while pid is not None and pid not in ancestors and G.has_node(pid):
+            ancestors.add(pid)
+            pid = parent_of(G.nodes[pid])
+    S = G.subgraph(set(keep) | ancestors).copy()
+    for nid in ancestors:
+        if normalize_expanded(S.nodes[nid].get("expanded", "false")) == "false":
+            S.nodes[nid]["expanded"] = "true"
+    return S
+
+
+def truncate_torn_tail(path: str, chunk: int = 1 << 16) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - chunk)
+            f.seek(start)
+            i = f.read(pos - start).rfind(b"\n")
+            if i >= 0:
+                keep = start + i + 1
+                break
+            pos = start
+        else:
+            keep = 0
+        if keep < end:
+            f.truncate(keep)
+    return end - keep
+
+
+class ShardJournal:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.torn = truncate_torn_tail(path)
+        self._file = open(path, "a", encoding="utf-8")
+        self.records = 0
+
+    def _write(self, rec: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self.records += 1
+
+    def node(self, nid: str, data: Dict[str, Any]) -> None:
+        self._write({
+            "op": "node",
+            "id": nid,
+            "topic": data.get("topic", ""),
+            "parentid": data.get("parentid"),
+            "depth": int(data.get("depth", 0) or 0),
+            "importance": int(data.get("importance", 0) or 0),
+            "expanded": normalize_expanded(data.get("expanded", "false")),
+        })
+
+    def edge(self, source: str, target: str, relation: str = "is_a") -> None:
+        self._write({"op": "edge", "source": source, "target": target, "relation": relation})
+
+    def state(self, nid: str, expanded: str) -> None:
+        self._write({"op": "state", "id": nid, "expanded": expanded})
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def read_journal(path: str) -> Iterator[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def _raise_state(G: nx.DiGraph, nid: str, expanded: str) -> None:
+    cur = normalize_expanded(G.nodes[nid].get("expanded", "false"))
+    new = normalize_expanded(expanded)
+    if STATE_RANK.get(new, 0) > STATE_RANK.get(cur, 0):
+        G.nodes[nid]["expanded"] = new
+
+
+def replay(G: nx.DiGraph, records: Iterator[Dict[str, Any]], topic_idx: Any = None, alias: Optional[Dict[str, str]] = None) -> Dict[str, int]:
+    alias = {} if alias is None else alias
+    counts = {"nodes": 0, "duplicates": 0, "edges": 0, "states": 0}
+    for rec in records:
+        op = rec.get("op")
+        if op == "node":
+            nid = str(rec["id"])
+            if G.has_node(nid) or nid in alias:
+                continue
+            pid = rec.get("parentid")
+            pid = alias.get(pid, pid) if pid is not None else None
+            if pid is not None and not G.has_node(pid):
+                continue
+            existing = topic_idx.lookup(rec["topic"]) if topic_idx is not None else None
+            if existing is not None and G.has_node(existing):
+                alias[nid] = existing
+                _raise_state(G, existing, rec.get("expanded", "false"))
+                if pid is not None and pid != existing and not G.has_edge(pid, existing):
+                    G.add_edge(pid, existing, relation="is_a", order=0)
+                counts["duplicates"] += 1
+                continue
+            depth = int(G.nodes[pid].get("depth", 0) or 0) + 1 if pid is not None else int(rec.get("depth", 0) or 0)
+            G.add_node(nid, topic=rec["topic"], parentid=pid, expanded=normalize_expanded(rec.get("expanded", "false")), depth=depth, importance=int(rec.get("importance", 0) or 0))
+            if pid is not None:
+                G.add_edge(pid, nid, relation="is_a", order=0)
+            if topic_idx is not None:
+                topic_idx.add(rec["topic"], nid)
+            counts["nodes"] += 1
+        elif op == "edge":
+            u = alias.get(rec["source"], rec["source"])
+            v = alias.get(rec["target"], rec["target"])
+            if u != v and G.has_node(u) and G.has_node(v) and not G.has_edge(u, v):
+                G.add_edge(u, v, relation=rec.get("relation", "is_a"), order=0)
+                counts["edges"] += 1
+        elif op == "state":
+            nid = alias.get(rec["id"], rec["id"])
+            if G.has_node(nid):
+                _raise_state(G, nid, rec["expanded"])
+                counts["states"] += 1
+    return counts
+
+
+def journal_path(shard_dir: str, shard: int) -> str:
+    return os.path.join(shard_dir, f"{shard:03d}", JOURNAL_FILE)
+
+
+def ensure_plan(csv_path: str, shard_dir: str, shards: int, force: bool = False) -> Dict[str, Any]:
+    plan = load_plan(shard_dir)
+    if plan is not None and not force:
+        return plan
+    gpath = graph_path_from_csv(csv_path)
+    G = load_graph(csv_path)
+    if G.number_of_nodes() == 0:
+        raise SystemExit(f"{gpath} is empty; build the first levels with ontology_tree.py before sharding")
+    plan = make_plan(G, shards, source_signature(gpath))
+    _write_json(os.path.join(shard_dir, PLAN_FILE), plan)
+    return plan
+
+
+def expand_shard(csv_path: str, shard_dir: str, shard: int, budget: int, scheduler: Any = None, engine: Any = None) -> Dict[str, Any]:
+    plan = load_plan(shard_dir)
+    if plan is None:
+        raise SystemExit(f"No {PLAN_FILE} in {shard_dir}; run `plan` first")
+    if not 0 <= shard < plan["shards"]:
+        raise SystemExit(f"Shard {shard} out of range for {plan['shards']} shards")
+    gpath = graph_path_from_csv(csv_path)
+    if list(source_signature(gpath)) != plan["signature"]:
+        raise SystemExit(f"{gpath} changed since the plan was made; merge the journals and plan again")
+    S = shard_graph(load_graph(csv_path), plan, shard)
+    jpath = journal_path(shard_dir, shard)
+    resumed = replay(S, read_journal(jpath))
+    base = S.number_of_nodes()
+    journal = ShardJournal(jpath)
+    t0 = time.perf_counter()
+    try:
+        with metrics.span("shard_expand", shard=str(shard)):
+            update_csv_tree(csv_path, max_nodes=base + budget, scheduler=scheduler, engine=engine, graph=S, journal=journal)
+    finally:
+        journal.close()
+    return {"shard": shard, "resumed": resumed["nodes"], "nodes": S.number_of_nodes(), "added": S.number_of_nodes() - base, "records": journal.records, "seconds": round(time.perf_counter() - t0, 2)}
+
+
+def merge_shards(csv_path: str, shard_dir: str, keep: bool = False) -> Dict[str, Any]:
+    plan = load_plan(shard_dir)
+    if plan is None:
+        raise SystemExit(f"No {PLAN_FILE} in {shard_dir}")
+    gpath = graph_path_from_csv(csv_path)
+    G = load_graph(csv_path)
+    topic_idx = build_topic_index(G)
+    alias: Dict[str, str] = {}
+    per_shard = []
+    for shard in range(plan["shards"]):
+        counts = replay(G, read_journal(journal_path(shard_dir, shard)), topic_idx, alias)
+        per_shard.append(dict(counts, shard=shard))
+    d = os.path.dirname(os.path.abspath(gpath))
+    with tempfile.NamedTemporaryFile("wb", delete=False, dir=d, prefix=".tmp_tree_", suffix=".pkl") as tmp:
+        pickle.dump(G, tmp, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path = tmp.name
+    os.replace(tmp_path, gpath)
+    write_snapshot(G, update_stats_cache(G, csv_path), snapshot_path_for(gpath), source_signature(gpath))
+    if not keep:
+        stamp = time.strftime("%Y%m%dT%H%M%S")
+        for shard in range(plan["shards"]):
+            jpath = journal_path(shard_dir, shard)
+            if os.path.exists(jpath):
+                os.replace(jpath, jpath[: -len(".jsonl")] + f".{stamp}.merged.jsonl")
+        os.replace(os.path.join(shard_dir, PLAN_FILE), os.path.join(shard_dir, f"plan.{stamp}.merged.json"))
+    return {"nodes": G.number_of_nodes(), "edges": G.number_of_edges(), "shards": per_shard}
+
+
+def run_local(csv_path: str, shard_dir: str, shards: int, budget: int, builder_args: List[str]) -> Dict[str, Any]:
+    plan = ensure_plan(csv_path, shard_dir, shards)
+    procs = []
+    for shard in range(plan["shards"]):
+        cmd = [sys.executable, os.path.abspath(__file__), "expand", "--csv", csv_path, "--shard-dir", shard_dir, "--shard", str(shard), "--max-nodes", str(budget)] + builder_args
+        procs.append(subprocess.Popen(cmd))
+    failed = [shard for shard, p in enumerate(procs) if p.wait() != 0]
+    if failed:
+        raise SystemExit(f"Shards {failed} failed; rerun them with `expand --shard N` (journals resume) before merging")
+    return merge_shards(csv_path, shard_dir)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_plan = sub.add_parser("plan", help="assign top-level domains to shards")
+    p_expand = sub.add_parser("expand", help="expand one shard, appending to its journal")
+    p_merge = sub.add_parser("merge", help="replay all shard journals into tree.pkl")
+    p_run = sub.add_parser("run", help="plan, expand every shard in a local subprocess, then merge")
+    for p in (p_plan, p_expand, p_merge, p_run):
+        p.add_argument("--csv", default=CSV_PATH)
+        p.add_argument("--shard-dir", default="")
+    for p in (p_plan, p_run):
+        p.add_argument("--shards", type=int, default=os.cpu_count() or 1)
+    p_plan.add_argument("--force", action="store_true", help="replace an existing plan")
+    p_expand.add_argument("--shard", type=int, required=True)
+    for p in (p_expand, p_run):
+        p.add_argument("--max-nodes", type=int, default=1000, help="new nodes per shard")
+    add_builder_arguments(p_expand)
+    p_merge.add_argument("--keep", action="store_true", help="leave journals and plan in place")
+    args, extra = parser.parse_known_args()
+    shard_dir = args.shard_dir or shard_dir_for(args.csv)
+    if args.cmd != "run" and extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    if args.cmd == "plan":
+        result: Any = ensure_plan(args.csv, shard_dir, args.shards, force=args.force)
+    elif args.cmd == "expand":
+        scheduler, engine = configure_builder(args)
+        try:
+            result = expand_shard(args.csv, shard_dir, args.shard, args.max_nodes, scheduler, engine)
+        finally:
+            if engine is not None:
+                engine.close()
+    elif args.cmd == "merge":
+        result = merge_shards(args.csv, shard_dir, keep=args.keep)
+    else:
+        result = run_local(args.csv, shard_dir, args.shards, args.max_nodes, extra)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+from __future__ import annotations
+import argparse
+import bisect
+import json
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from analytics import METRICS, OntologyStats, source_signature
+from search import SearchIndex
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+MAGIC = b"ONTSNAP1"
+SNAPSHOT_VERSION = 1
+ALIGN = 64
+_HEADER = struct.Struct("<8sQ")
+STATS_ARRAYS = ("parent", "depth", "state", "children", "size", "leaves", "max_depth", "states", "pre", "order")
+SEARCH_ARRAYS = ("token_ptr", "token_post", "gram_ptr", "gram_post", "gram_counts", "sorted_keys", "child_order", "child_parent")
+STRING_TABLES = ("ids", "topics", "keys", "tokens", "grams")
+
+
+def snapshot_path_for(pkl_path: str) -> str:
+    base, _ = os.path.splitext(pkl_path)
+    return base + ".snapshot"
+
+
+def pack_strings(strings: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [s.encode("utf-8") for s in strings]
+    ptr = np.zeros(len(encoded) + 1, dtype=np.int64)
+    ptr[1:] = np.cumsum([len(b) for b in encoded])
+    return ptr, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+class StringTable:
+    def __init__(self, ptr: np.ndarray, data: np.ndarray) -> None:
+        self.ptr = ptr
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.ptr) - 1
+
+    def __getitem__(self, i: Any) -> str:
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        return self.data[int(self.ptr[i]) : int(self.ptr[i + 1])].tobytes().decode("utf-8")
+
+    def __iter__(self) -> Any:
+        for i in range(len(self)):
+            yield self[i]
+
+
+class IdLookup:
+    def __init__(self, ids: StringTable, order: np.ndarray) -> None:
+        self.ids = ids
+        self.order = order
+
+    def get(self, nid: Any, default: Any = None) -> Any:
+        if not isinstance(nid, str):
+            return default
+        k = bisect.bisect_left(self.order, nid, key=self.ids.__getitem__)
+        if k < len(self.order) and self.ids[self.order[k]] == nid:
+            return int(self.order[k])
+        return default
+
+    def __getitem__(self, nid: str) -> int:
+        i = self.get(nid)
+        if i is None:
+            raise KeyError(nid)
+        return i
+
+    def __contains__(self, nid: Any) -> bool:
+        return self.get(nid) is not None
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+
+def graph_payload(G: "nx.DiGraph") -> Dict[str, Any]:
+    nodes = [
+        {
+            "id": str(nid),
+            "label": str(data.get("topic", "")),
+            "parentid": data.get("parentid"),
+            "depth": int(data.get("depth", 0) or 0),
+        }
+        for nid, data in G.nodes(data=True)
+    ]
+    links = [{"source": str(u), "target": str(v)} for u, v in G.edges()]
+    return {"nodes": nodes, "links": links}
+
+
+def _dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def write_snapshot(G: "nx.DiGraph", stats: OntologyStats, path: str, signature: Tuple[int, int]) -> str:
+    n = stats.n
+    stats._ensure_layout()
+    index = SearchIndex.from_stats(stats)
+    arrays: Dict[str, np.ndarray] = {name: np.ascontiguousarray(getattr(stats, name)[:n]) for name in STATS_ARRAYS if name not in ("pre", "order")}
+    arrays["pre"] = np.ascontiguousarray(stats._pre)
+    arrays["order"] = np.ascontiguousarray(stats._order)
+    for name in SEARCH_ARRAYS:
+        arrays[name] = np.ascontiguousarray(getattr(index, name))
+    for name, strings in (("ids", stats.ids[:n]), ("topics", stats.topics[:n]), ("keys", index.keys), ("tokens", index.tokens), ("grams", index.grams)):
+        arrays[f"{name}.ptr"], arrays[f"{name}.data"] = pack_strings(strings)
+    arrays["id_order"] = np.array(sorted(range(n), key=stats.ids.__getitem__), dtype=np.int64)
+    blobs: Dict[str, bytes] = {"data": _dumps(graph_payload(G))}
+    for metric in METRICS:
+        values = stats.metric(metric)
+        blobs[f"stats/{metric}"] = _dumps({"metric": metric, "values": values, "min": min(values.values(), default=0), "max": max(values.values(), default=0)})
+
+    sections: List[Tuple[str, bytes]] = [(name, arr.tobytes()) for name, arr in arrays.items()] + list(blobs.items())
+    header: Dict[str, Any] = {"version": SNAPSHOT_VERSION, "signature": list(signature), "nodes": n, "created": time.time(), "arrays": {}, "blobs": {}}
+    offset = 0
+    layout: List[Tuple[int, bytes]] = []
+    for name, raw in sections:
+        offset = (offset + ALIGN - 1) // ALIGN * ALIGN
+        if name in arrays:
+            arr = arrays[name]
+            header["arrays"][name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        else:
+            header["blobs"][name] = {"offset": offset, "length": len(raw)}
+        layout.append((offset, raw))
+        offset += len(raw)
+    head = json.dumps(header).encode("utf-8")
+    base = (_HEADER.size + len(head) + ALIGN - 1) // ALIGN * ALIGN
+
+    d = os.path.dirname(os.path.abspath(path))
+    os.makedirs(d, exist_ok=True)
+    with tempfile.NamedTemporaryFile("wb", delete=False, dir=d, prefix=".tmp_snapshot_", suffix=".snapshot") as tmp:
+        tmp.write(_HEADER.pack(MAGIC, len(head)))
+        tmp.write(head)
+        for off, raw in layout:
+            tmp.seek(base + off)
+            tmp.write(raw)
+        tmp.truncate(base + offset)
+        tmp.flush()
+        os.fsync(tmp.fileno())
+        tmp_path = tmp.name
+    os.replace(tmp_path, path)
+    return path
+
+
+def publish_snapshot(pkl_path: str, path: Optional[str] = None) -> str:
+    signature = source_signature(pkl_path)
+    with open(pkl_path, "rb") as f:
+        G = pickle.load(f)
+    return write_snapshot(G, OntologyStats.from_graph(G), path or snapshot_path_for(pkl_path), signature)
+
+
+def read_header(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "rb") as f:
+            magic, length = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != MAGIC:
+                return None
+            header = json.loads(f.read(length))
+    except (OSError, ValueError, struct.error):
+        return None
+    return header if header.get("version") == SNAPSHOT_VERSION else None
+
+
+class Snapshot:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.identity = (st.st_ino, st.st_mtime_ns)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, length = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an ontology snapshot")
+        header = json.loads(self._mm[_HEADER.size : _HEADER.size + length])
+        if header.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} has snapshot version {header.get('version')}, expected {SNAPSHOT_VERSION}")
+        self.header = header
+        self.signature = tuple(header["signature"])
+        base = (_HEADER.size + length + ALIGN - 1) // ALIGN * ALIGN
+        self.arrays: Dict[str, np.ndarray] = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            shape = tuple(spec["shape"])
+            count = int(np.prod(shape)) if shape else 1
+            self.arrays[name] = np.frombuffer(self._mm, dtype=dtype, count=count, offset=base + spec["offset"]).reshape(shape)
+        self._blobs = {name: (base + spec["offset"], spec["length"]) for name, spec in header["blobs"].items()}
+        self.tables = {name: StringTable(self.arrays[f"{name}.ptr"], self.arrays[f"{name}.data"]) for name in STRING_TABLES}
+        self.ids = self.tables["ids"]
+        self.topics = self.tables["topics"]
+        self.index = IdLookup(self.ids, self.arrays["id_order"])
+        self._stats: Optional[OntologyStats] = None
+        self._search: Optional[SearchIndex] = None
+
+    def __len__(self) -> int:
+        return int(self.header["nodes"])
+
+    def blob(self, name: str) -> Optional[memoryview]:
+        spec = self._blobs.get(name)
+        if spec is None:
+            return None
+        start, length = spec
+        return memoryview(self._mm)[start : start + length]
+
+    def stats(self) -> OntologyStats:
+        if self._stats is None:
+            self._stats = OntologyStats.view(self.ids, self.topics, self.index, {name: self.arrays[name] for name in STATS_ARRAYS})
+        return self._stats
+
+    def search(self) -> SearchIndex:
+        if self._search is None:
+            arrays = {name: self.arrays[name] for name in SEARCH_ARRAYS}
+            arrays["parent"] = self.arrays["parent"]
+            arrays["depth"] = self.arrays["depth"]
+            t = self.tables
+            self._search = SearchIndex(t["ids"], t["topics"], t["keys"], t["tokens"], t["grams"], self.index, arrays)
+        return self._search
+
+
+def open_snapshot(path: str) -> Snapshot:
+    return Snapshot(path)
+
+
+def main() -> None:
+    root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pkl", default=os.path.join(root_dir, "data", "ontology", "tree.pkl"))
+    parser.add_argument("--out", default="", help="default: <pkl>.snapshot")
+    args = parser.parse_args()
+    t0 = time.perf_counter()
+    path = publish_snapshot(args.pkl, args.out or None)
+    built = time.perf_counter() - t0
+    t1 = time.perf_counter()
+    snap = open_snapshot(path)
+    opened = time.perf_counter() - t1
+    print(json.dumps({"path": path, "nodes": len(snap), "bytes": os.path.getsize(path), "build_ms": round(built * 1000, 2), "open_ms": round(opened * 1000, 2)}))
+
+
+if __name__ == "__main__":
+    main()
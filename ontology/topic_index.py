@@ -0,0 +1,198 @@
+from __future__ import annotations
+import re
+import unicodedata
+import zlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+_QUALIFIER_RE = re.compile(r"\s+\([^()]*\)\s*$")
+_POSSESSIVE_RE = re.compile(r"['’]s\b")
+_SEPARATOR_RE = re.compile(r"[\s\-‐‑‒–—_/,.;:'\"`’‘()\[\]]+")
+_STOPWORDS = {"a", "an", "the", "of", "and", "in", "on", "for"}
+_MASK_SPACE = 1 << 32
+
+
+def _singular(token: str) -> str:
+    if token.endswith(("sses", "xes", "ches", "shes")):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+def topic_tokens(topic: str, qualifier: bool = True) -> List[str]:
+    s = unicodedata.normalize("NFKD", str(topic)).strip().lower()
+    s = "".join(c for c in s if not unicodedata.combining(c))
+    if not qualifier:
+        s = _QUALIFIER_RE.sub("", s)
+    s = _POSSESSIVE_RE.sub("", s)
+    s = s.replace("&", " and ")
+    tokens = [_singular(t) for t in _SEPARATOR_RE.split(s) if t]
+    kept = [t for t in tokens if t not in _STOPWORDS]
+    return kept or tokens
+
+
+def normalize_topic(topic: str) -> str:
+    return " ".join(topic_tokens(topic))
+
+
+def base_topic(topic: str) -> str:
+    return " ".join(topic_tokens(topic, qualifier=False))
+
+
+def char_ngrams(key: str, n: int = 3) -> Set[str]:
+    s = f" {key} "
+    if len(s) <= n:
+        return {s}
+    return {s[i : i + n] for i in range(len(s) - n + 1)}
+
+
+def one_insertion(a: str, b: str, min_pos: int = 4) -> bool:
+    if len(a) > len(b):
+        a, b = b, a
+    if len(b) - len(a) != 1:
+        return False
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return i >= min_pos and a[i:] == b[i + 1 :]
+
+
+def tokens_close(a: List[str], b: List[str], min_len: int = 6) -> bool:
+    if len(a) != len(b):
+        return False
+    for x, y in zip(a, b):
+        if x == y:
+            continue
+        if min(len(x), len(y)) < min_len or not one_insertion(x, y):
+            return False
+    return True
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    inter = len(a & b)
+    return inter / float(len(a) + len(b) - inter)
+
+
+class TopicIndex:
+    def __init__(self, threshold: float = 0.7, num_perm: int = 12, bands: int = 4, ngram: int = 3) -> None:
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = float(threshold)
+        self.num_perm = int(num_perm)
+        self.bands = int(bands)
+        self.rows = self.num_perm // self.bands
+        self.ngram = int(ngram)
+        self._exact: Dict[str, str] = {}
+        self._grams: Dict[str, Set[str]] = {}
+        self._tokens: Dict[str, List[str]] = {}
+        self._buckets: Dict[Tuple[int, int], List[str]] = {}
+        # Qualified topics ("Mercury (planet)") keep their qualifier in the exact key; their
+        # base is indexed separately so an unqualified mention can still find a unique one,
+        # and a qualified mention can fall back to a unique unqualified topic.
+        self._qualified: Dict[str, Set[str]] = {}
+        self._plain: Set[str] = set()
+        self._base_buckets: Dict[Tuple[int, int], List[str]] = {}
+        self._gram_hash: Dict[str, int] = {}
+        self._masks = [zlib.crc32(f"minhash-{i}".encode()) * 2654435761 % _MASK_SPACE for i in range(self.num_perm)]
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    def __contains__(self, topic: str) -> bool:
+        return normalize_topic(topic) in self._exact
+
+    def _signature(self, grams: Iterable[str]) -> List[int]:
+        cache = self._gram_hash
+        hashed = []
+        for g in grams:
+            h = cache.get(g)
+            if h is None:
+                h = cache[g] = zlib.crc32(g.encode("utf-8")) * 2654435761 % _MASK_SPACE
+            hashed.append(h)
+        return [min(map(m.__xor__, hashed)) for m in self._masks]
+
+    def _band_keys(self, sig: List[int]) -> List[Tuple[int, int]]:
+        r = self.rows
+        return [(i, hash(tuple(sig[i * r : (i + 1) * r]))) for i in range(self.bands)]
+
+    def add(self, topic: str, nid: str) -> bool:
+        key = normalize_topic(topic)
+        if not key or key in self._exact:
+            return False
+        self._exact[key] = nid
+        grams = char_ngrams(key, self.ngram)
+        self._grams[key] = grams
+        self._tokens[key] = key.split()
+        for band in self._band_keys(self._signature(grams)):
+            self._buckets.setdefault(band, []).append(key)
+        base = base_topic(topic)
+        if base == key:
+            self._plain.add(key)
+        elif base:
+            self._qualified.setdefault(base, set()).add(key)
+            if base not in self._grams:
+                self._grams[base] = char_ngrams(base, self.ngram)
+                self._tokens[base] = base.split()
+                for band in self._band_keys(self._signature(self._grams[base])):
+                    self._base_buckets.setdefault(band, []).append(base)
+        return True
+
+    def exact(self, topic: str) -> Optional[str]:
+        return self._exact.get(normalize_topic(topic))
+
+    def match(self, topic: str) -> Optional[Tuple[str, str, float]]:
+        key = normalize_topic(topic)
+        if not key:
+            return None
+        hit = self._exact.get(key)
+        if hit is not None:
+            return hit, key, 1.0
+        grams = char_ngrams(key, self.ngram)
+        bands = self._band_keys(self._signature(grams))
+        near = self._closest(key, grams, bands, self._buckets)
+        if near is not None:
+            return self._exact[near[0]], near[0], near[1]
+        base = base_topic(topic)
+        if base != key:
+            if not base:
+                return None
+            if base in self._plain:
+                return self._exact[base], base, 1.0
+            base_grams = char_ngrams(base, self.ngram)
+            plain = self._near(base, base_grams, self._band_keys(self._signature(base_grams)), self._buckets, self._plain)
+            if len(plain) != 1:
+                return None
+            return self._exact[plain[0][0]], plain[0][0], plain[0][1]
+        near = (key, 1.0) if key in self._qualified else self._closest(key, grams, bands, self._base_buckets)
+        keys = self._qualified.get(near[0], set()) if near is not None else set()
+        if len(keys) != 1:
+            return None
+        cand = next(iter(keys))
+        return self._exact[cand], cand, near[1]
+
+    def _near(self, key: str, grams: Set[str], bands: List[Tuple[int, int]], buckets: Dict[Tuple[int, int], List[str]], allowed: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        tokens = key.split()
+        found: List[Tuple[str, float]] = []
+        seen: Set[str] = set()
+        for band in bands:
+            for cand in buckets.get(band, ()):
+                if cand in seen:
+                    continue
+                seen.add(cand)
+                if allowed is not None and cand not in allowed:
+                    continue
+                if not tokens_close(tokens, self._tokens[cand]):
+                    continue
+                score = jaccard(grams, self._grams[cand])
+                if score >= self.threshold:
+                    found.append((cand, score))
+        return found
+
+    def _closest(self, key: str, grams: Set[str], bands: List[Tuple[int, int]], buckets: Dict[Tuple[int, int], List[str]]) -> Optional[Tuple[str, float]]:
+        return max(self._near(key, grams, bands, buckets), key=lambda f: f[1], default=None)
+
+    def lookup(self, topic: str) -> Optional[str]:
+        m = self.match(topic)
+        return m[0] if m else None
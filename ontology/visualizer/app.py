@@ -1,20 +1,66 @@
-from flask import Flask, render_template, jsonify
+from flask import Flask, Response, render_template, jsonify, request, abort
 import os
 import sys
+import threading
+import time
 
 try:
-    from ontology.ontology_tree import read_nodes, read_edges
+    from ontology.ontology_tree import graph_path_from_csv
+    from ontology.analytics import METRICS, source_signature
+    from ontology.snapshot import open_snapshot, publish_snapshot, read_header, snapshot_path_for
 except Exception:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from ontology_tree import read_nodes, read_edges
+    from ontology_tree import graph_path_from_csv
+    from analytics import METRICS, source_signature
+    from snapshot import open_snapshot, publish_snapshot, read_header, snapshot_path_for
 
 base_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(base_dir))
+nodes_csv = os.path.join(root_dir, 'data', 'ontology', 'tree.csv')
+SNAPSHOT_CHECK_INTERVAL = 1.0
 
 app = Flask(
     __name__,
     template_folder=os.path.join(base_dir, 'templates'),
     static_folder=os.path.join(base_dir, 'static'),
 )
+app.config.setdefault('SNAPSHOT_PATH', os.getenv('VISUALIZER_SNAPSHOT', '') or snapshot_path_for(graph_path_from_csv(nodes_csv)))
+app.config.setdefault('SNAPSHOT_PUBLISH', True)
+
+_snapshot_lock = threading.Lock()
+_snapshot = {'snap': None, 'checked': 0.0}
+
+
+def current_snapshot():
+    now = time.monotonic()
+    snap = _snapshot['snap']
+    if snap is not None and now - _snapshot['checked'] < SNAPSHOT_CHECK_INTERVAL:
+        return snap
+    with _snapshot_lock:
+        path = app.config['SNAPSHOT_PATH']
+        gpath = graph_path_from_csv(nodes_csv)
+        snap = _snapshot['snap']
+        if app.config['SNAPSHOT_PUBLISH'] and os.path.exists(gpath):
+            header = read_header(path)
+            if header is None or tuple(header['signature']) != source_signature(gpath):
+                publish_snapshot(gpath, path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if snap is None or snap.identity != (st.st_ino, st.st_mtime_ns):
+            snap = open_snapshot(path)
+            _snapshot['snap'] = snap
+        _snapshot['checked'] = now
+        return snap
+
+
+def blob_response(snap, name):
+    blob = snap.blob(name) if snap is not None else None
+    if blob is None:
+        return None
+    return Response(bytes(blob), mimetype='application/json')
+
 
 @app.route('/')
 def index():
@@ -22,27 +68,48 @@ def index():
 
 @app.route('/data')
 def data():
-    nodes_csv = os.path.join(os.path.dirname(base_dir), 'graph', 'tree.csv')
-    edges_csv = os.path.join(os.path.dirname(base_dir), 'graph', 'tree_edges.csv')
-    nodes = read_nodes(nodes_csv)
-    edges = read_edges(edges_csv)
-    nodes_payload = [
-        {
-            'id': n.id,
-            'label': n.topic,
-            'parentid': n.parentid,
-            'depth': int(getattr(n, 'depth', 0) or 0),
-        }
-        for n in nodes
-    ]
-    links_payload = [
-        {
-            'source': e.parentid,
-            'target': e.childid,
-        }
-        for e in edges
-    ]
-    return jsonify({'nodes': nodes_payload, 'links': links_payload})
+    resp = blob_response(current_snapshot(), 'data')
+    return resp if resp is not None else jsonify({'nodes': [], 'links': []})
+
+
+@app.route('/stats')
+def stats():
+    metric = request.args.get('metric', 'nodes')
+    if metric not in METRICS:
+        abort(400, f'unknown metric: {metric}')
+    resp = blob_response(current_snapshot(), f'stats/{metric}')
+    return resp if resp is not None else jsonify({'metric': metric, 'values': {}, 'min': 0, 'max': 0})
+
+
+@app.route('/stats/<nid>')
+def stats_node(nid):
+    snap = current_snapshot()
+    if snap is None or nid not in snap.index:
+        abort(404)
+    return jsonify(snap.stats().subtree(nid))
+
+
+@app.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    limit = max(1, min(100, request.args.get('limit', 20, type=int)))
+    snap = current_snapshot()
+    t0 = time.perf_counter()
+    results = snap.search().search(q, limit) if snap is not None and q else []
+    return jsonify({'query': q, 'results': results, 'took_ms': round((time.perf_counter() - t0) * 1000, 2)})
+
+
+@app.route('/neighbourhood/<nid>')
+def neighbourhood(nid):
+    snap = current_snapshot()
+    hood = snap.search().neighbourhood(
+        nid,
+        siblings=request.args.get('siblings', 20, type=int),
+        children=request.args.get('children', 200, type=int),
+    ) if snap is not None else None
+    if hood is None:
+        abort(404)
+    return jsonify(hood)
 
 
 def run(debug: bool = True):
@@ -0,0 +1,106 @@
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+
+from werkzeug.serving import make_server
+
+from ontology.visualizer.app import app, graph_path_from_csv, nodes_csv, publish_snapshot, read_header, snapshot_path_for, source_signature
+
+
+def publish_if_stale(gpath: str, path: str) -> bool:
+    if not os.path.exists(gpath):
+        return False
+    header = read_header(path)
+    if header is not None and tuple(header["signature"]) == source_signature(gpath):
+        return False
+    publish_snapshot(gpath, path)
+    print(f"[visualizer] published {path}", file=sys.stderr, flush=True)
+    return True
+
+
+def worker(sock: socket.socket, host: str, port: int, threads: bool) -> None:
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    server = make_server(host, port, app, threaded=threads, fd=sock.fileno())
+    server.serve_forever()
+
+
+def spawn(sock: socket.socket, host: str, port: int, threads: bool) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            worker(sock, host, port, threads)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def serve(host: str, port: int, workers: int, snapshot: str, watch: float, threads: bool = True) -> None:
+    gpath = graph_path_from_csv(nodes_csv)
+    publish_if_stale(gpath, snapshot)
+    app.config["SNAPSHOT_PATH"] = snapshot
+    app.config["SNAPSHOT_PUBLISH"] = False
+    sock = socket.create_server((host, port), backlog=1024, reuse_port=False)
+    sock.set_inheritable(True)
+    children = {spawn(sock, host, port, threads) for _ in range(max(1, workers))}
+    print(f"[visualizer] serving http://{host}:{port} workers={len(children)} snapshot={snapshot}", file=sys.stderr, flush=True)
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    next_check = time.monotonic() + watch
+    try:
+        while not stopping:
+            time.sleep(0.5)
+            while True:
+                try:
+                    pid, _ = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    pid = 0
+                if not pid:
+                    break
+                children.discard(pid)
+                if not stopping:
+                    print(f"[visualizer] worker {pid} exited; respawning", file=sys.stderr, flush=True)
+                    children.add(spawn(sock, host, port, threads))
+            if watch > 0 and time.monotonic() >= next_check:
+                next_check = time.monotonic() + watch
+                try:
+                    publish_if_stale(gpath, snapshot)
+                except Exception as e:
+                    print(f"[visualizer_error] type={type(e).__name__} message={e}", file=sys.stderr, flush=True)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        sock.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--snapshot", default=snapshot_path_for(graph_path_from_csv(nodes_csv)))
+    parser.add_argument("--watch", type=float, default=5.0, help="seconds between checks for a newer tree.pkl to publish (0 = never)")
+    parser.add_argument("--no-threads", action="store_true", help="one request at a time per worker")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.snapshot, args.watch, threads=not args.no_threads)
+
+
+if __name__ == "__main__":
+    main()
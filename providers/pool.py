@@ -0,0 +1,353 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, TypeVar
+
+from telemetry import metrics
+
+T = TypeVar("T")
+
+POOL_FILE_ENV = "LLM_POOL_FILE"
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+TRIP_AFTER = 3
+COOLDOWN_BASE = 2.0
+COOLDOWN_MAX = 300.0
+BUSY_WAIT = 0.05
+_NUMBERED_KEY = re.compile(r"^OPENAI_API_KEY_(\w+)$")
+
+
+class NoEndpointError(RuntimeError):
+    pass
+
+
+@dataclass
+class Endpoint:
+    name: str
+    api_key: str
+    base_url: Optional[str] = None
+    models: List[str] = field(default_factory=list)
+    weight: float = 1.0
+    max_concurrency: int = 0
+    max_retries: Optional[int] = None
+    in_flight: int = 0
+    requests: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    consecutive_failures: int = 0
+    cooldown_until: float = 0.0
+    disabled: Optional[str] = None
+    latency: float = 0.0
+    _clients: Dict[str, Any] = field(default_factory=dict, repr=False)
+
+    def serves(self, model: Optional[str]) -> bool:
+        return not model or not self.models or model in self.models
+
+    def ready(self, now: float) -> bool:
+        if self.disabled or now < self.cooldown_until:
+            return False
+        return self.max_concurrency <= 0 or self.in_flight < self.max_concurrency
+
+    def client(self, kind: str, factory: Callable[["Endpoint"], Any]) -> Any:
+        c = self._clients.get(kind)
+        if c is None:
+            c = self._clients[kind] = factory(self)
+        return c
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "models": self.models,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "cooldown": round(max(0.0, self.cooldown_until - time.monotonic()), 2),
+            "disabled": self.disabled,
+            "latency": round(self.latency, 3),
+        }
+
+
+def _wake(fut: Any) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+def _split(value: Any) -> List[str]:
+    if isinstance(value, str):
+        return [m.strip() for m in value.split(",") if m.strip()]
+    return [str(m) for m in value or []]
+
+
+def load_env() -> None:
+    try:
+        from dotenv import load_dotenv
+    except Exception:
+        return
+    path = os.path.join(ROOT_DIR, ".env")
+    if os.path.exists(path):
+        load_dotenv(dotenv_path=path, override=False)
+
+
+def endpoints_from_file(path: str) -> List[Endpoint]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    entries = data.get("endpoints", []) if isinstance(data, dict) else data
+    out: List[Endpoint] = []
+    for i, e in enumerate(entries):
+        key = e.get("api_key") or os.getenv(str(e.get("api_key_env", "")), "")
+        if not key:
+            raise ValueError(f"{path}: endpoint {e.get('name', i)} has no api_key (or api_key_env is unset)")
+        out.append(
+            Endpoint(
+                name=str(e.get("name") or f"endpoint-{i}"),
+                api_key=str(key).strip(),
+                base_url=(e.get("base_url") or "").strip() or None,
+                models=_split(e.get("models")),
+                weight=float(e.get("weight", 1.0)),
+                max_concurrency=int(e.get("max_concurrency", 0)),
+            )
+        )
+    return out
+
+
+def endpoints_from_env() -> List[Endpoint]:
+    out: List[Endpoint] = []
+    base = os.getenv("OPENAI_BASE_URL", "").strip() or None
+    key = os.getenv("OPENAI_API_KEY", "").strip()
+    if key:
+        out.append(Endpoint(name="default", api_key=key, base_url=base))
+    for var in sorted(os.environ):
+        m = _NUMBERED_KEY.match(var)
+        if not m or not os.environ[var].strip():
+            continue
+        suffix = m.group(1)
+        out.append(
+            Endpoint(
+                name=suffix.lower(),
+                api_key=os.environ[var].strip(),
+                base_url=os.getenv(f"OPENAI_BASE_URL_{suffix}", "").strip() or base,
+                models=_split(os.getenv(f"MODEL_LIST_{suffix}", "")),
+                max_concurrency=int(os.getenv(f"OPENAI_MAX_CONCURRENCY_{suffix}", "0") or 0),
+            )
+        )
+    return out
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    for name in ("retry-after-ms", "retry-after"):
+        raw = headers.get(name)
+        if raw is None:
+            continue
+        try:
+            value = float(raw)
+        except ValueError:
+            continue
+        return value / 1000.0 if name.endswith("-ms") else value
+    return None
+
+
+def classify(exc: BaseException) -> str:
+    seen = set()
+    cur: Optional[BaseException] = exc
+    while cur is not None and id(cur) not in seen:
+        seen.add(id(cur))
+        status = getattr(cur, "status_code", None)
+        name = type(cur).__name__
+        if status == 429 or name == "RateLimitError":
+            return "rate_limit"
+        if status in (401, 403) or name in ("AuthenticationError", "PermissionDeniedError"):
+            return "auth"
+        if (isinstance(status, int) and status >= 500) or name in ("APIConnectionError", "APITimeoutError", "InternalServerError"):
+            return "unavailable"
+        if isinstance(cur, (ConnectionError, TimeoutError)):
+            return "unavailable"
+        cur = cur.__cause__ or cur.__context__
+    return "fatal"
+
+
+class EndpointPool:
+    def __init__(self, endpoints: Sequence[Endpoint], attempts: Optional[int] = None, seed: Optional[int] = None) -> None:
+        if not endpoints:
+            raise NoEndpointError(f"No LLM endpoints configured: set OPENAI_API_KEY, OPENAI_API_KEY_<n> or {POOL_FILE_ENV}")
+        self.endpoints = list(endpoints)
+        if len(self.endpoints) > 1:
+            for ep in self.endpoints:
+                if ep.max_retries is None:
+                    ep.max_retries = 0
+        self.attempts = attempts or max(3, 2 * len(self.endpoints))
+        self._lock = threading.Lock()
+        self._freed = threading.Condition(self._lock)
+        self._async_waiters: List[Any] = []
+        self._rng = random.Random(seed)
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def serving(self, models: Sequence[str]) -> List[str]:
+        return [m for m in models if any(ep.serves(m) and not ep.disabled for ep in self.endpoints)]
+
+    def acquire(self, model: Optional[str] = None, avoid: Sequence[str] = ()) -> Optional[Endpoint]:
+        now = time.monotonic()
+        with self._lock:
+            ready = [ep for ep in self.endpoints if ep.serves(model) and ep.ready(now) and ep.name not in avoid]
+            if not ready:
+                return None
+            ep = min(ready, key=lambda e: ((e.in_flight + 1) / max(e.weight, 1e-9), e.latency, self._rng.random()))
+            ep.in_flight += 1
+            ep.requests += 1
+        metrics.set_gauge("llm_endpoint_in_flight", ep.in_flight, endpoint=ep.name)
+        return ep
+
+    def release(self, ep: Endpoint, latency: Optional[float] = None, error: Optional[BaseException] = None) -> str:
+        kind = "ok" if error is None else classify(error)
+        now = time.monotonic()
+        with self._lock:
+            ep.in_flight -= 1
+            if kind == "ok" or kind == "fatal":
+                ep.consecutive_failures = 0
+                if latency is not None:
+                    ep.latency = latency if ep.latency == 0 else 0.8 * ep.latency + 0.2 * latency
+            else:
+                ep.errors += 1
+                ep.consecutive_failures += 1
+                if kind == "auth":
+                    ep.disabled = type(error).__name__
+                elif kind == "rate_limit":
+                    ep.rate_limited += 1
+                    wait = retry_after(error)
+                    if wait is None:
+                        wait = min(COOLDOWN_MAX, COOLDOWN_BASE * 2 ** (ep.consecutive_failures - 1))
+                    ep.cooldown_until = max(ep.cooldown_until, now + wait)
+                elif ep.consecutive_failures >= TRIP_AFTER:
+                    ep.cooldown_until = now + min(COOLDOWN_MAX, COOLDOWN_BASE * 2 ** (ep.consecutive_failures - TRIP_AFTER))
+            self._freed.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, fut in waiters:
+            loop.call_soon_threadsafe(_wake, fut)
+        metrics.set_gauge("llm_endpoint_in_flight", ep.in_flight, endpoint=ep.name)
+        if kind not in ("ok", "fatal"):
+            metrics.inc("llm_endpoint_errors_total", endpoint=ep.name, kind=kind)
+        return kind
+
+    def _timeout(self, model: Optional[str], now: float) -> Optional[float]:
+        live = [ep for ep in self.endpoints if ep.serves(model) and not ep.disabled]
+        if not live:
+            raise NoEndpointError(f"No enabled endpoint serves model {model!r}")
+        if any(ep.ready(now) for ep in live):
+            return 0.0
+        cooling = [ep.cooldown_until - now for ep in live if ep.cooldown_until > now]
+        return max(BUSY_WAIT, min(cooling)) if cooling else None
+
+    def _wait(self, model: Optional[str]) -> None:
+        with self._lock:
+            timeout = self._timeout(model, time.monotonic())
+            if timeout != 0.0:
+                self._freed.wait(timeout)
+
+    async def _await(self, model: Optional[str]) -> None:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        with self._lock:
+            timeout = self._timeout(model, time.monotonic())
+            if timeout == 0.0:
+                return
+            self._async_waiters.append((loop, fut))
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                if (loop, fut) in self._async_waiters:
+                    self._async_waiters.remove((loop, fut))
+
+    def _next(self, model: Optional[str], tried: List[str]) -> Optional[Endpoint]:
+        return self.acquire(model, avoid=tried) or self.acquire(model)
+
+    def _failed(self, ep: Endpoint, kind: str, failures: int, tried: List[str]) -> bool:
+        if kind == "fatal" or failures >= self.attempts:
+            return False
+        tried.append(ep.name)
+        metrics.inc("llm_failovers_total", endpoint=ep.name, kind=kind)
+        return True
+
+    def call(self, fn: Callable[[Endpoint], T], model: Optional[str] = None) -> T:
+        tried: List[str] = []
+        failures = 0
+        while True:
+            ep = self._next(model, tried)
+            if ep is None:
+                self._wait(model)
+                continue
+            t0 = time.perf_counter()
+            try:
+                result = fn(ep)
+            except Exception as e:
+                failures += 1
+                if not self._failed(ep, self.release(ep, error=e), failures, tried):
+                    raise
+                continue
+            self.release(ep, latency=time.perf_counter() - t0)
+            return result
+
+    async def acall(self, fn: Callable[[Endpoint], Awaitable[T]], model: Optional[str] = None) -> T:
+        tried: List[str] = []
+        failures = 0
+        while True:
+            ep = self._next(model, tried)
+            if ep is None:
+                await self._await(model)
+                continue
+            t0 = time.perf_counter()
+            try:
+                result = await fn(ep)
+            except asyncio.CancelledError:
+                self.release(ep)
+                raise
+            except Exception as e:
+                failures += 1
+                if not self._failed(ep, self.release(ep, error=e), failures, tried):
+                    raise
+                continue
+            self.release(ep, latency=time.perf_counter() - t0)
+            return result
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [ep.summary() for ep in self.endpoints]
+
+
+def load_pool(path: Optional[str] = None) -> EndpointPool:
+    load_env()
+    path = path or os.getenv(POOL_FILE_ENV, "").strip()
+    return EndpointPool(endpoints_from_file(path) if path else endpoints_from_env())
+
+
+@lru_cache(maxsize=1)
+def get_pool() -> EndpointPool:
+    return load_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", default="", help=f"pool config (default: ${POOL_FILE_ENV}, else OPENAI_API_KEY and OPENAI_API_KEY_<n>)")
+    args = parser.parse_args()
+    pool = load_pool(args.file or None)
+    print(json.dumps([{k: v for k, v in ep.summary().items() if k in ("name", "base_url", "models")} for ep in pool.endpoints], indent=2))
+
+
+if __name__ == "__main__":
+    main()
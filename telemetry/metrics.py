@@ -0,0 +1,343 @@
+from __future__ import annotations
+import atexit
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_ENABLED = False
+_LOCK = threading.Lock()
+_COUNTERS: Dict[Tuple[str, LabelKey], float] = {}
+_GAUGES: Dict[Tuple[str, LabelKey], float] = {}
+_HISTOGRAMS: Dict[Tuple[str, LabelKey], "Histogram"] = {}
+_SPANS: Deque[Dict[str, Any]] = deque(maxlen=2000)
+_SPAN_IDS = itertools.count(1)
+_CURRENT_SPAN: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("current_span", default=None)
+_STARTED = time.time()
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "total")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self) -> List[int]:
+        out: List[int] = []
+        running = 0
+        for c in self.counts:
+            running += c
+            out.append(running)
+        return out
+
+
+def enable() -> None:
+    global _ENABLED
+    _ENABLED = True
+
+
+def disable() -> None:
+    global _ENABLED
+    _ENABLED = False
+
+
+def enabled() -> bool:
+    return _ENABLED
+
+
+def reset() -> None:
+    with _LOCK:
+        _COUNTERS.clear()
+        _GAUGES.clear()
+        _HISTOGRAMS.clear()
+        _SPANS.clear()
+
+
+def _key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1.0, **labels: Any) -> None:
+    if not _ENABLED:
+        return
+    k = (name, _key(labels))
+    with _LOCK:
+        _COUNTERS[k] = _COUNTERS.get(k, 0.0) + value
+
+
+def set_gauge(name: str, value: float, **labels: Any) -> None:
+    if not _ENABLED:
+        return
+    with _LOCK:
+        _GAUGES[(name, _key(labels))] = float(value)
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    if not _ENABLED:
+        return
+    k = (name, _key(labels))
+    with _LOCK:
+        h = _HISTOGRAMS.get(k)
+        if h is None:
+            h = _HISTOGRAMS[k] = Histogram()
+        h.observe(value)
+
+
+class _NullSpan:
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc: Any) -> bool:
+        return False
+
+    def set(self, **labels: Any) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ("name", "labels", "id", "parent", "start", "t0", "_token")
+
+    def __init__(self, name: str, labels: Dict[str, Any]) -> None:
+        self.name = name
+        self.labels = labels
+        self.id = next(_SPAN_IDS)
+        self.parent: Optional[int] = None
+        self.start = 0.0
+        self.t0 = 0.0
+        self._token = None
+
+    def set(self, **labels: Any) -> None:
+        self.labels.update(labels)
+
+    def __enter__(self) -> "Span":
+        self.parent = _CURRENT_SPAN.get()
+        self._token = _CURRENT_SPAN.set(self.id)
+        self.start = time.time()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> bool:
+        duration = time.perf_counter() - self.t0
+        if self._token is not None:
+            _CURRENT_SPAN.reset(self._token)
+        status = "error" if exc_type is not None else "ok"
+        observe(f"{self.name}_seconds", duration, status=status)
+        record = {
+            "id": self.id,
+            "parent": self.parent,
+            "name": self.name,
+            "start": self.start,
+            "duration": duration,
+            "status": status,
+            "labels": {k: str(v) for k, v in self.labels.items()},
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        with _LOCK:
+            _SPANS.append(record)
+        return False
+
+
+def span(name: str, **labels: Any):
+    if not _ENABLED:
+        return _NULL_SPAN
+    return Span(name, labels)
+
+
+def timed(name: str) -> Callable:
+    def decorator(fn: Callable) -> Callable:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args: Any, **kwargs: Any) -> Any:
+                with span(name):
+                    return await fn(*args, **kwargs)
+
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(labels: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in items)
+    return "{" + body + "}"
+
+
+def _metric_name(name: str) -> str:
+    return "scilogues_" + name.replace(".", "_").replace("-", "_")
+
+
+def render_prometheus() -> str:
+    lines: List[str] = []
+    with _LOCK:
+        counters = sorted(_COUNTERS.items())
+        gauges = sorted(_GAUGES.items())
+        hists = sorted(_HISTOGRAMS.items(), key=lambda kv: kv[0])
+        hist_data = [(k, h.buckets, h.cumulative(), h.count, h.total) for k, h in hists]
+    seen: set = set()
+    for (name, labels), value in counters:
+        m = _metric_name(name)
+        if m not in seen:
+            lines.append(f"# TYPE {m} counter")
+            seen.add(m)
+        lines.append(f"{m}{_fmt_labels(labels)} {value}")
+    for (name, labels), value in gauges:
+        m = _metric_name(name)
+        if m not in seen:
+            lines.append(f"# TYPE {m} gauge")
+            seen.add(m)
+        lines.append(f"{m}{_fmt_labels(labels)} {value}")
+    for (name, labels), buckets, cumulative, count, total in hist_data:
+        m = _metric_name(name)
+        if m not in seen:
+            lines.append(f"# TYPE {m} histogram")
+            seen.add(m)
+        for b, c in zip(buckets, cumulative):
+            lines.append(f"{m}_bucket{_fmt_labels(labels, ('le', repr(b)))} {c}")
+        lines.append(f"{m}_bucket{_fmt_labels(labels, ('le', '+Inf'))} {count}")
+        lines.append(f"{m}_sum{_fmt_labels(labels)} {total}")
+        lines.append(f"{m}_count{_fmt_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot(spans: int = 200) -> Dict[str, Any]:
+    with _LOCK:
+        counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in _COUNTERS.items()]
+        gauges = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in _GAUGES.items()]
+        hists = [
+            {
+                "name": n,
+                "labels": dict(l),
+                "count": h.count,
+                "sum": h.total,
+                "buckets": dict(zip([repr(b) for b in h.buckets], h.cumulative())),
+            }
+            for (n, l), h in _HISTOGRAMS.items()
+        ]
+        recent = list(_SPANS)[-spans:] if spans else []
+    return {
+        "timestamp": time.time(),
+        "uptime": time.time() - _STARTED,
+        "pid": os.getpid(),
+        "counters": counters,
+        "gauges": gauges,
+        "histograms": hists,
+        "spans": recent,
+    }
+
+
+def write_snapshot(path: str) -> None:
+    d = os.path.dirname(os.path.abspath(path))
+    os.makedirs(d, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", delete=False, dir=d, prefix=".tmp_metrics_", suffix=".json", encoding="utf-8") as tmp:
+        json.dump(snapshot(), tmp, ensure_ascii=False)
+        tmp_path = tmp.name
+    os.replace(tmp_path, path)
+
+
+def serve(port: int, host: str = "127.0.0.1") -> "ThreadingHTTPServer":
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            path = self.path.split("?", 1)[0].rstrip("/")
+            if path == "/metrics":
+                body = render_prometheus().encode("utf-8")
+                ctype = "text/plain; version=0.0.4"
+            elif path == "/metrics.json":
+                body = json.dumps(snapshot()).encode("utf-8")
+                ctype = "application/json"
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True, name="metrics-http").start()
+    return httpd
+
+
+def start_snapshots(path: str, interval: float = 15.0) -> threading.Thread:
+    stop = threading.Event()
+
+    def loop() -> None:
+        while not stop.wait(interval):
+            try:
+                write_snapshot(path)
+            except Exception:
+                pass
+
+    def final() -> None:
+        stop.set()
+        try:
+            write_snapshot(path)
+        except Exception:
+            pass
+
+    t = threading.Thread(target=loop, daemon=True, name="metrics-snapshot")
+    t.start()
+    atexit.register(final)
+    return t
+
+
+def configure_from_env() -> bool:
+    port = os.getenv("METRICS_PORT", "").strip()
+    json_path = os.getenv("METRICS_JSON", "").strip()
+    if not port and not json_path:
+        return False
+    enable()
+    if port:
+        serve(int(port), os.getenv("METRICS_HOST", "127.0.0.1").strip() or "127.0.0.1")
+    if json_path:
+        start_snapshots(json_path, float(os.getenv("METRICS_INTERVAL", "15") or 15))
+    return True
@@ -0,0 +1,230 @@
+from __future__ import annotations
+import argparse
+import atexit
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_DIR = os.path.join("data", "profile")
+DEFAULT_HZ = 100.0
+MAX_DEPTH = 128
+TOP_ALLOCATIONS = 25
+
+
+class SamplingProfiler:
+    def __init__(self, out_dir: str = DEFAULT_DIR, hz: float = DEFAULT_HZ, interval: float = 0.0, memory_frames: int = 0) -> None:
+        self.out_dir = out_dir
+        self.period = 1.0 / max(1.0, float(hz))
+        self.interval = float(interval)
+        self.memory_frames = int(memory_frames)
+        self.samples = 0
+        self.dumps = 0
+        self._total: Counter = Counter()
+        self._window: Counter = Counter()
+        self._labels: Dict[CodeType, str] = {}
+        self._names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._dump_requested = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_sites: Optional[Dict[Tuple[str, int], Tuple[int, int]]] = None
+        self._started = time.time()
+
+    def _label(self, code: CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+            self._labels[code] = label
+        return label
+
+    def _stack(self, frame: Optional[FrameType]) -> List[str]:
+        names: List[str] = []
+        while frame is not None and len(names) < MAX_DEPTH:
+            names.append(self._label(frame.f_code))
+            frame = frame.f_back
+        names.reverse()
+        return names
+
+    def sample(self) -> None:
+        own = threading.get_ident()
+        frames = sys._current_frames()
+        if any(tid not in self._names for tid in frames):
+            self._names = {t.ident: t.name for t in threading.enumerate() if t.ident is not None}
+        with self._lock:
+            for tid, frame in frames.items():
+                if tid == own:
+                    continue
+                stack = ";".join([self._names.get(tid, f"thread-{tid}")] + self._stack(frame))
+                self._total[stack] += 1
+                self._window[stack] += 1
+            self.samples += 1
+
+    def _run(self) -> None:
+        next_dump = time.monotonic() + self.interval if self.interval > 0 else None
+        while not self._stop.wait(self.period):
+            self.sample()
+            if self._dump_requested.is_set() or (next_dump is not None and time.monotonic() >= next_dump):
+                self._dump_requested.clear()
+                try:
+                    self.dump()
+                except Exception as e:
+                    print(f"[profile_error] type={type(e).__name__} message={e}", file=sys.stderr, flush=True)
+                if next_dump is not None:
+                    next_dump = time.monotonic() + self.interval
+
+    def start(self) -> "SamplingProfiler":
+        if self.memory_frames > 0:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.memory_frames)
+        self._thread = threading.Thread(target=self._run, daemon=True, name="profiler")
+        self._thread.start()
+        return self
+
+    def request_dump(self) -> None:
+        self._dump_requested.set()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _path(self, suffix: str) -> str:
+        return os.path.join(self.out_dir, f"{os.getpid()}-{suffix}")
+
+    def write_collapsed(self, path: str, stacks: Counter) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+    def write_memory(self, path: str) -> None:
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            return
+        snap = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        by_trace = snap.statistics("traceback" if self.memory_frames > 1 else "lineno")
+        sites: Dict[Tuple[str, int], List[int]] = {}
+        for stat in by_trace:
+            frame = stat.traceback[0]
+            if frame.filename in (__file__, tracemalloc.__file__):
+                continue
+            site = sites.setdefault((frame.filename, frame.lineno), [0, 0])
+            site[0] += stat.size
+            site[1] += stat.count
+        top = sorted(sites.items(), key=lambda kv: kv[1][0], reverse=True)[:TOP_ALLOCATIONS]
+        lines = [f"traced_current_mib={current / 2**20:.1f} traced_peak_mib={peak / 2**20:.1f} sites={len(sites)}", "", "top allocation sites (size, blocks, site):"]
+        lines += [f"{size / 1024:12.1f} KiB {count:10d}  {f}:{n}" for (f, n), (size, count) in top]
+        if self._last_sites is not None:
+            prev = self._last_sites
+            growth = sorted(
+                ((k, v[0] - prev.get(k, (0, 0))[0], v[1] - prev.get(k, (0, 0))[1]) for k, v in sites.items()),
+                key=lambda x: x[1],
+                reverse=True,
+            )[:TOP_ALLOCATIONS]
+            lines += ["", "growth since previous dump (size diff, blocks diff, site):"]
+            lines += [f"{ds / 1024:+12.1f} KiB {dc:+10d}  {f}:{n}" for (f, n), ds, dc in growth if ds > 0]
+        if self.memory_frames > 1:
+            for k, stat in enumerate(by_trace[:3], 1):
+                lines += ["", f"traceback #{k}: {stat.size / 1024:.1f} KiB in {stat.count} blocks"]
+                lines += [f"  {line}" for line in stat.traceback.format()]
+        self._last_sites = {k: (v[0], v[1]) for k, v in sites.items()}
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def dump(self, final: bool = False) -> List[str]:
+        os.makedirs(self.out_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%dT%H%M%S")
+        with self._lock:
+            window = self._window
+            self._window = Counter()
+            total = Counter(self._total)
+        written: List[str] = []
+        if not final:
+            path = self._path(f"{stamp}-{self.dumps:04d}.collapsed")
+            self.write_collapsed(path, window)
+            written.append(path)
+        path = self._path("total.collapsed")
+        self.write_collapsed(path, total)
+        written.append(path)
+        if self.memory_frames > 0:
+            path = self._path(f"{stamp}-{self.dumps:04d}.memory.txt" if not final else "final.memory.txt")
+            self.write_memory(path)
+            written.append(path)
+        self.dumps += 1
+        print(f"[profile] samples={self.samples} wrote {', '.join(written)}", file=sys.stderr, flush=True)
+        return written
+
+
+_PROFILER: Optional[SamplingProfiler] = None
+
+
+def active() -> Optional[SamplingProfiler]:
+    return _PROFILER
+
+
+def _forget() -> None:
+    global _PROFILER
+    _PROFILER = None
+    import tracemalloc
+
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def start(out_dir: str = DEFAULT_DIR, hz: float = DEFAULT_HZ, interval: float = 0.0, memory_frames: int = 0) -> SamplingProfiler:
+    global _PROFILER
+    if _PROFILER is not None:
+        return _PROFILER
+    prof = SamplingProfiler(out_dir, hz=hz, interval=interval, memory_frames=memory_frames).start()
+    sig = getattr(signal, "SIGUSR1", None)
+    if sig is not None and threading.current_thread() is threading.main_thread():
+        signal.signal(sig, lambda signum, frame: prof.request_dump())
+
+    def final() -> None:
+        if _PROFILER is not prof:
+            return
+        prof.stop()
+        try:
+            prof.dump(final=True)
+        except Exception:
+            pass
+
+    atexit.register(final)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_forget)
+    _PROFILER = prof
+    return prof
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--profile", action="store_true", help="sample thread stacks; dump collapsed stacks to --profile-dir on SIGUSR1, every --profile-interval seconds and at exit")
+    parser.add_argument("--profile-dir", default="", metavar="DIR", help=f"where --profile writes its dumps (default $PROFILE_DIR or {DEFAULT_DIR}); implies --profile")
+    parser.add_argument("--profile-interval", type=float, default=0.0, help="seconds between automatic profile dumps (0 = SIGUSR1 and exit only)")
+    parser.add_argument("--profile-hz", type=float, default=DEFAULT_HZ)
+    parser.add_argument("--profile-memory", action="store_true", help="also trace allocations with tracemalloc; slows allocation-heavy code")
+    parser.add_argument("--profile-memory-frames", type=int, default=1, metavar="FRAMES", help="stack depth recorded per allocation by --profile-memory")
+
+
+def configure_from_args(args: argparse.Namespace) -> Optional[SamplingProfiler]:
+    out_dir = getattr(args, "profile_dir", "") or os.getenv("PROFILE_DIR", "").strip()
+    if not (getattr(args, "profile", False) or out_dir):
+        return None
+    out_dir = out_dir or DEFAULT_DIR
+    memory_frames = 0
+    if getattr(args, "profile_memory", False):
+        memory_frames = max(1, int(getattr(args, "profile_memory_frames", 1) or 1))
+    return start(
+        out_dir,
+        hz=float(getattr(args, "profile_hz", DEFAULT_HZ) or DEFAULT_HZ),
+        interval=float(getattr(args, "profile_interval", 0.0) or 0.0),
+        memory_frames=memory_frames,
+    )
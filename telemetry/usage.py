@@ -0,0 +1,198 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from telemetry import metrics
+
+
+@dataclass
+class UsageRecord:
+    stage: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    reasoning_tokens: int = 0
+    cached_tokens: int = 0
+    latency: float = 0.0
+    ts: float = field(default_factory=time.time)
+    status: str = "ok"
+    depth: Optional[int] = None
+    label_layout: Optional[str] = None
+    label_content: Optional[str] = None
+    max_words: Optional[int] = None
+    topic_id: Optional[str] = None
+    row_id: Optional[str] = None
+    variant: Optional[int] = None
+    endpoint: Optional[str] = None
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+def _get(obj: Any, name: str) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def usage_from_response(resp: Any, stage: str, model: str, latency: float, **fields: Any) -> UsageRecord:
+    usage = _get(resp, "usage")
+    details = _get(usage, "completion_tokens_details")
+    prompt_details = _get(usage, "prompt_tokens_details")
+    return UsageRecord(
+        stage=stage,
+        model=str(_get(resp, "model") or model),
+        prompt_tokens=int(_get(usage, "prompt_tokens") or 0),
+        completion_tokens=int(_get(usage, "completion_tokens") or 0),
+        reasoning_tokens=int(_get(details, "reasoning_tokens") or 0),
+        cached_tokens=int(_get(prompt_details, "cached_tokens") or 0),
+        latency=float(latency),
+        **fields,
+    )
+
+
+class Ledger:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+
+    def append(self, record: UsageRecord) -> None:
+        line = json.dumps(asdict(record), ensure_ascii=False) + "\n"
+        with self._lock, metrics.span("write_usage"):
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+_DEFAULT: Optional[Ledger] = None
+
+
+def configure(path: Optional[str]) -> Optional[Ledger]:
+    global _DEFAULT
+    _DEFAULT = Ledger(path) if path else None
+    return _DEFAULT
+
+
+def record(rec: UsageRecord) -> None:
+    if _DEFAULT is not None:
+        _DEFAULT.append(rec)
+
+
+def iter_records(path: str) -> Iterable[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def load_prices(path: Optional[str]) -> Dict[str, Tuple[float, float]]:
+    raw: Dict[str, Any] = {}
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    elif os.getenv("MODEL_PRICES", "").strip():
+        raw = json.loads(os.getenv("MODEL_PRICES", ""))
+    prices: Dict[str, Tuple[float, float]] = {}
+    for model, p in raw.items():
+        if isinstance(p, dict):
+            prices[model] = (float(p.get("prompt", 0.0)), float(p.get("completion", 0.0)))
+        elif isinstance(p, (list, tuple)) and len(p) == 2:
+            prices[model] = (float(p[0]), float(p[1]))
+    return prices
+
+
+def cost_of(rec: Dict[str, Any], prices: Dict[str, Tuple[float, float]]) -> float:
+    p = prices.get(str(rec.get("model", "")))
+    if p is None:
+        return 0.0
+    return (int(rec.get("prompt_tokens", 0) or 0) * p[0] + int(rec.get("completion_tokens", 0) or 0) * p[1]) / 1_000_000
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round((len(s) - 1) * q)))]
+
+
+def report(path: str, by: List[str], prices: Optional[Dict[str, Tuple[float, float]]] = None) -> List[Dict[str, Any]]:
+    prices = prices or {}
+    groups: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+    for rec in iter_records(path):
+        key = tuple(rec.get(k) for k in by)
+        g = groups.get(key)
+        if g is None:
+            g = groups[key] = {
+                "calls": 0,
+                "records": 0,
+                "ok": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "reasoning_tokens": 0,
+                "cached_tokens": 0,
+                "cache_hits": 0,
+                "useful_tokens": 0,
+                "cost": 0.0,
+                "latencies": [],
+            }
+        prompt = int(rec.get("prompt_tokens", 0) or 0)
+        completion = int(rec.get("completion_tokens", 0) or 0)
+        first = not rec.get("variant")
+        g["calls"] += 1 if first else 0
+        g["records"] += 1
+        g["prompt_tokens"] += prompt
+        g["completion_tokens"] += completion
+        g["reasoning_tokens"] += int(rec.get("reasoning_tokens", 0) or 0)
+        cached = int(rec.get("cached_tokens", 0) or 0)
+        g["cached_tokens"] += cached
+        g["cache_hits"] += 1 if cached > 0 else 0
+        g["cost"] += cost_of(rec, prices)
+        if first:
+            g["latencies"].append(float(rec.get("latency", 0.0) or 0.0))
+        if rec.get("status", "ok") == "ok":
+            g["ok"] += 1
+            g["useful_tokens"] += completion - int(rec.get("reasoning_tokens", 0) or 0)
+    rows: List[Dict[str, Any]] = []
+    for key, g in sorted(groups.items(), key=lambda kv: tuple(str(x) for x in kv[0])):
+        lat = g.pop("latencies")
+        row = dict(zip(by, key))
+        row.update(g)
+        row["ok_rate"] = g["ok"] / g["records"] if g["records"] else 0.0
+        row["cache_hit_rate"] = g["cache_hits"] / g["calls"] if g["calls"] else 0.0
+        row["cached_prompt_share"] = g["cached_tokens"] / g["prompt_tokens"] if g["prompt_tokens"] else 0.0
+        row["avg_completion_tokens"] = g["completion_tokens"] / g["calls"] if g["calls"] else 0.0
+        row["p50_latency"] = _percentile(lat, 0.50)
+        row["p95_latency"] = _percentile(lat, 0.95)
+        row["cost_per_1k_useful"] = (g["cost"] / g["useful_tokens"] * 1000.0) if g["useful_tokens"] else 0.0
+        rows.append(row)
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ledger", default=os.path.join("data", "usage.jsonl"))
+    parser.add_argument("--by", default="stage,model", help="comma-separated fields, e.g. model,depth,label_layout,max_words")
+    parser.add_argument("--prices", default="", help="JSON file: {model: {prompt: usd_per_1m, completion: usd_per_1m}}")
+    args = parser.parse_args()
+    by = [b.strip() for b in args.by.split(",") if b.strip()]
+    rows = report(args.ledger, by, load_prices(args.prices or None))
+    for row in rows:
+        print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
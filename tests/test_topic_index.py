@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ontology"))
+
+from topic_index import TopicIndex  # noqa: E402
+
+
+def index(*topics):
+    idx = TopicIndex()
+    for i, topic in enumerate(topics):
+        idx.add(topic, f"n{i}")
+    return idx
+
+
+def test_qualified_query_links_to_unique_unqualified_topic():
+    assert index("Quantum Mechanics").lookup("Quantum mechanics (physics)") == "n0"
+
+
+def test_unqualified_query_links_to_unique_qualified_topic():
+    assert index("Quantum mechanics (physics)").lookup("Quantum Mechanics") == "n0"
+
+
+def test_different_qualifiers_stay_distinct():
+    idx = index("Mercury (planet)")
+    assert idx.lookup("Mercury (element)") is None
+    idx.add("Mercury (element)", "n1")
+    assert idx.lookup("Mercury") is None